@@ -0,0 +1,442 @@
+"""
+    This module benchmarks the public functions of data_manipulation and
+    refactored_notebook on synthetic data.
+
+    For every requested number of student records, a data directory is generated with
+    synthetic_data.py (once, it is reused by later runs with the same size and seed) and
+    each function is timed in that directory. Inputs of a function are prepared outside
+    of the timings. Each benchmark reports:
+        seconds        -> Fastest wall time of the repeated runs.
+        seconds_mean   -> Mean wall time of the repeated runs.
+        peak_bytes     -> tracemalloc peak of one extra run.
+        output_rows    -> Rows of the returned dataframes.
+        digest         -> Hash of the returned dataframes, to detect result changes.
+
+    Pipeline memoization is disabled during the runs and the in-process workbook memo is
+    cleared before every run, so each run reads the BLS sheets from the Arrow cache
+    (or parses the workbooks with --cold).
+
+    Results can be saved as a baseline and later runs compared against it. A run fails,
+    with exit status 1, when a function is slower or uses more memory than its baseline
+    beyond the tolerances, or when its result changed.
+
+    Run -> python benchmark_suite.py --rows 10000 1000000 --save-baseline baseline.json
+           python benchmark_suite.py --rows 10000 1000000 --baseline baseline.json
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import hashlib
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+from synthetic_data import write_synthetic_data, SYNTHETIC_DATA_FILES
+from stage_profiler import describe_frames
+
+DEFAULT_WORKDIR = os.path.join(tempfile.gettempdir(), 'bls_benchmarks')
+LEVEL_NAMES = ['l1', 'l2']
+METRIC = 'number_of_students_all_sum'
+# Random ids, ex. of Bokeh documents, left out of the digests of string results.
+_UUID_PATTERN = re.compile('[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+# Options of run_benchmarks and their defaults.
+BENCHMARK_OPTIONS = {'repeat': 3, 'functions': None, 'cold': False}
+# Tolerances of compare_to_baseline and their defaults.
+BASELINE_TOLERANCES = {'time': 0.25, 'memory': 0.25, 'min_seconds': 0.005,
+                       'min_bytes': 1024 * 1024}
+
+# Inputs shared by the benchmarks of one data directory, computed once on first use.
+_inputs = {}
+
+
+def _get_input_builders() -> dict:
+    """
+        List the inputs of the benchmarks. Each input is a function computing it.
+        :return dict<string, function> -> Input builders by name
+    """
+    # pylint: disable=import-outside-toplevel
+    import data_manipulation as dm
+    import refactored_notebook as rn
+
+    return {
+        'raw_record': lambda: pd.read_csv(dm.STUDENT_RECORD_CSV,
+                                          dtype=dm.STUDENT_RECORD_DTYPES),
+        'term': dm.get_term_df,
+        'record': lambda: dm.get_student_record_df(
+            term_columns=dm.STUDENT_TERM_VALIDATION_COLUMNS),
+        'grouped': lambda: dm.get_df_record_occupation_level_grouped_by_year_filtered(
+            _get_input('record').copy()),
+        'level_list': dm.get_df_list_final,
+        'hierarchy': lambda: rn.get_distinct_hierarchical_mappings(
+            ['l4', 'l3', 'l2', 'l1'], dm.BLS_WORKBOOK_2011_TO_2015, dm.BLS_LEVEL_MAPPING_SHEET),
+        'groupings': lambda: rn.create_treemap_levels(_get_input('level_list'),
+                                                      _get_input('hierarchy'), LEVEL_NAMES),
+        'filtered': lambda: rn.filter_by_year_and_metric(*_get_input('groupings'),
+                                                         LEVEL_NAMES, '2015', METRIC),
+        'short': lambda: rn.apply_short_names(*_copy_frames(_get_input('filtered')),
+                                              LEVEL_NAMES, METRIC),
+        'labeled': lambda: rn.create_labels_for_treemap(*_copy_frames(_get_input('short')),
+                                                        LEVEL_NAMES, METRIC),
+        'output_dir': lambda: tempfile.mkdtemp(prefix='bls_benchmark_outputs_'),
+    }
+
+def _get_input(name):
+    """
+        Get an input of the benchmarks, computing it on first use.
+    """
+    if name not in _inputs:
+        _inputs[name] = _get_input_builders()[name]()
+
+    return _inputs[name]
+
+def _copy_frames(frames):
+    """
+        Copy a tuple of dataframes, for functions modifying their inputs in place.
+    """
+    return tuple(frame.copy() for frame in frames)
+
+def get_benchmarks() -> dict:
+    """
+        List the benchmarked functions. Each benchmark is a function preparing the
+        arguments of a run, outside of the timings, and returning the function to time
+        with its arguments.
+        :return dict<string, function> -> Benchmarks by name
+    """
+    # pylint: disable=import-outside-toplevel
+    import data_manipulation as dm
+    import refactored_notebook as rn
+
+    return {
+        'data_manipulation.get_base_metric': lambda: (dm.get_base_metric, (METRIC,), {}),
+        'data_manipulation.get_short_names': lambda: (dm.get_short_names,
+                                                      ('l1', 'number_of_students'), {}),
+        'data_manipulation.get_palette': lambda: (dm.get_palette, (14,), {}),
+        'data_manipulation.get_format_parameters': lambda: (
+            dm.get_format_parameters, ('number_of_students', 14), {}),
+        'data_manipulation.get_term_df': lambda: (dm.get_term_df, (), {}),
+        'data_manipulation.enrich_student_record': lambda: (
+            dm.enrich_student_record, (_get_input('raw_record').copy(), _get_input('term')),
+            {}),
+        'data_manipulation.get_student_record_df': lambda: (dm.get_student_record_df, (), {}),
+        'data_manipulation.get_student_occupation_counts': lambda: (
+            dm.get_student_occupation_counts, (_get_input('record').copy(),), {}),
+        'data_manipulation.get_student_occupation_counts_chunked': lambda: (
+            dm.get_student_occupation_counts_chunked,
+            (max(len(_get_input('record')) // 4, 1),), {}),
+        'data_manipulation.get_df_record_occupation_level_grouped_by_year_filtered': lambda: (
+            dm.get_df_record_occupation_level_grouped_by_year_filtered,
+            (_get_input('record').copy(),), {}),
+        'data_manipulation.get_bls_year_tabs': lambda: (
+            dm.get_bls_year_tabs, (dm.BLS_WORKBOOK_2011_TO_2015,
+                                   dm.get_year_tabs(dm.BLS_WORKBOOK_2011_TO_2015)),
+            {'header': 0}),
+        'data_manipulation.get_df_level_list': lambda: (dm.get_df_level_list,
+                                                        _get_input('grouped'), {}),
+        'data_manipulation.get_bls_hierarchy_rollup': lambda: (dm.get_bls_hierarchy_rollup,
+                                                               (), {}),
+        'data_manipulation.get_df_list_final': lambda: (dm.get_df_list_final, (), {}),
+        'data_manipulation.get_bls_data_2002_to_2015': lambda: (dm.get_bls_data_2002_to_2015,
+                                                                (), {}),
+        'refactored_notebook.get_distinct_hierarchical_mappings': lambda: (
+            rn.get_distinct_hierarchical_mappings,
+            (['l4', 'l3', 'l2', 'l1'], dm.BLS_WORKBOOK_2011_TO_2015,
+             dm.BLS_LEVEL_MAPPING_SHEET), {}),
+        'refactored_notebook.create_treemap_levels': lambda: (
+            rn.create_treemap_levels, (_get_input('level_list'), _get_input('hierarchy'),
+                                       LEVEL_NAMES), {}),
+        'refactored_notebook.filter_by_year_and_metric': lambda: (
+            rn.filter_by_year_and_metric, _get_input('groupings') + (LEVEL_NAMES, '2015',
+                                                                      METRIC), {}),
+        'refactored_notebook.apply_short_names': lambda: (
+            rn.apply_short_names, _copy_frames(_get_input('filtered')) + (LEVEL_NAMES,
+                                                                           METRIC), {}),
+        'refactored_notebook.create_labels_for_treemap': lambda: (
+            rn.create_labels_for_treemap, _copy_frames(_get_input('short')) + (LEVEL_NAMES,
+                                                                                METRIC), {}),
+        'refactored_notebook.get_treemap_sum_metrics': lambda: (
+            rn.get_treemap_sum_metrics, (_get_input('level_list'),), {}),
+        'refactored_notebook.write_treemap_outputs': lambda: (
+            rn.write_treemap_outputs, _get_input('labeled') + (
+                {'year': '2015', 'metric': METRIC, 'level_names': LEVEL_NAMES,
+                 'output_dir': _get_input('output_dir'), 'output_formats': ['json', 'csv']},),
+            {}),
+        'refactored_notebook.render_treemap_html': lambda: (
+            rn.render_treemap_html, _get_input('labeled') + (LEVEL_NAMES, METRIC), {}),
+        'refactored_notebook.run_treemap_batch': lambda: (
+            rn.run_treemap_batch, (_get_input('level_list'), _get_input('hierarchy'),
+                                   LEVEL_NAMES, _get_input('output_dir')),
+            {'options': {'output_formats': ['json'], 'max_workers': 1}}),
+    }
+
+def get_result_digest(result):
+    """
+        Hash the dataframes, series and strings of a result, looking into lists and
+        tuples. Other results, ex. run manifests with timings, are not hashed, and random
+        ids are left out of strings.
+        :param object result -> Result of a benchmarked function.
+        :return string -> Hex digest or None
+    """
+    hasher = hashlib.sha256()
+    def update(value):
+        if isinstance(value, pd.DataFrame):
+            hasher.update(repr(list(value.columns)).encode('utf-8'))
+            hasher.update(pd.util.hash_pandas_object(value, index=False).to_numpy().tobytes())
+        elif isinstance(value, pd.Series):
+            hasher.update(pd.util.hash_pandas_object(value, index=False).to_numpy().tobytes())
+        elif isinstance(value, str):
+            hasher.update(_UUID_PATTERN.sub('', value).encode('utf-8'))
+        elif isinstance(value, (list, tuple)) and value:
+            return all(update(item) for item in value)
+        else:
+            return False
+        return True
+
+    return hasher.hexdigest() if update(result) else None
+
+def _prepare_run():
+    """
+        Clear the in-process caches before a run.
+    """
+    # pylint: disable=import-outside-toplevel
+    from workbook_cache import clear_loaded_workbooks
+    from pipeline_cache import clear_memoized
+    clear_loaded_workbooks()
+    clear_memoized()
+
+def run_benchmark(name, benchmark, repeat=3) -> dict:
+    """
+        Time a benchmark and measure its peak memory.
+        :param string name -> Benchmark name.
+        :param function benchmark -> Benchmark from get_benchmarks.
+        :param int repeat -> Number of timed runs.
+        :return dict -> Measures of the benchmark
+    """
+    timings = []
+    result = None
+    for _ in range(repeat):
+        func, func_args, func_kwargs = benchmark()
+        _prepare_run()
+        start = time.perf_counter()
+        result = func(*func_args, **func_kwargs)
+        timings.append(time.perf_counter() - start)
+
+    # Memory is measured on a separate run, tracemalloc slows allocations down.
+    func, func_args, func_kwargs = benchmark()
+    _prepare_run()
+    tracemalloc.start()
+    try:
+        func(*func_args, **func_kwargs)
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {'function': name,
+            'seconds': min(timings),
+            'seconds_mean': float(np.mean(timings)),
+            'peak_bytes': peak_bytes,
+            'output_rows': describe_frames(result)[0],
+            'digest': get_result_digest(result)}
+
+def prepare_data_dir(workdir, n_rows, seed=0) -> str:
+    """
+        Generate the synthetic data directory of a size, unless it already exists with
+        every file of SYNTHETIC_DATA_FILES.
+        :param string workdir -> Directory of the benchmark data.
+        :param int n_rows -> Number of student records.
+        :param int seed -> Random seed.
+        :return string -> Working directory of the benchmarks, holding ./data
+    """
+    run_dir = os.path.join(workdir, f'rows_{n_rows}_seed_{seed}')
+    marker = os.path.join(run_dir, 'data', 'synthetic.json')
+    if not all(os.path.exists(os.path.join(run_dir, 'data', name))
+               for name in SYNTHETIC_DATA_FILES + ['synthetic.json']):
+        shutil.rmtree(run_dir, ignore_errors=True)
+        write_synthetic_data(os.path.join(run_dir, 'data'), n_rows, seed=seed)
+        with open(marker, 'w', encoding='utf-8') as file:
+            json.dump({'rows': n_rows, 'seed': seed}, file)
+    return run_dir
+
+def _set_benchmark_env(run_dir, cold):
+    """
+        Disable the pipeline memoization and point the Arrow cache to the data directory,
+        or disable it for cold runs.
+        :return dict -> Previous values of the environment variables, None when unset
+    """
+    previous_env = {key: os.environ.get(key) for key in
+                    ['BLS_MEMO_MAXSIZE', 'BLS_PIPELINE_CACHE_DIR', 'BLS_CACHE_DIR']}
+    os.environ['BLS_MEMO_MAXSIZE'] = '0'
+    os.environ.pop('BLS_PIPELINE_CACHE_DIR', None)
+    os.environ['BLS_CACHE_DIR'] = '' if cold else os.path.join(run_dir, '.bls_cache')
+    return previous_env
+
+def _restore_env(previous_env):
+    """
+        Restore environment variables saved by _set_benchmark_env.
+    """
+    for key, value in previous_env.items():
+        if value is None:
+            os.environ.pop(key, None)
+        else:
+            os.environ[key] = value
+
+def _run_selected_benchmarks(n_rows, repeat, functions):
+    """
+        Run the benchmarks selected by name or function name, all by default, in the
+        current directory.
+        :return List<dict> -> Measures of the benchmarks
+    """
+    records = []
+    for name, benchmark in get_benchmarks().items():
+        if functions and name not in functions and name.split('.')[-1] not in functions:
+            continue
+        try:
+            record = run_benchmark(name, benchmark, repeat=repeat)
+        except ImportError as error:
+            # Optional dependencies, ex. Bokeh for render_treemap_html.
+            print('Skipped', name + ':', error, file=sys.stderr)
+            continue
+        record['rows'] = n_rows
+        records.append(record)
+    return records
+
+def run_benchmarks(n_rows, workdir=DEFAULT_WORKDIR, seed=0, options=None) -> pd.DataFrame:
+    """
+        Run the benchmarks on synthetic data of a size.
+        :param int n_rows -> Number of student records.
+        :param string workdir -> Directory of the benchmark data.
+        :param int seed -> Random seed of the synthetic data.
+        :param dict options -> Any of BENCHMARK_OPTIONS:
+                                   'repeat'    -> Number of timed runs per benchmark.
+                                   'functions' -> Benchmarks to run, by name or function
+                                                  name, defaults to all.
+                                   'cold'      -> Parse the workbooks on every run instead
+                                                  of reading the Arrow cache.
+        :return Dataframe -> One row per benchmark
+    """
+    for option in options or {}:
+        if option not in BENCHMARK_OPTIONS:
+            raise ValueError('Unknown benchmark option: ' + str(option))
+    options = dict(BENCHMARK_OPTIONS, **(options or {}))
+    run_dir = prepare_data_dir(workdir, n_rows, seed=seed)
+    previous_dir = os.getcwd()
+    previous_env = _set_benchmark_env(run_dir, options['cold'])
+    os.chdir(run_dir)
+    _inputs.clear()
+    try:
+        records = _run_selected_benchmarks(n_rows, options['repeat'], options['functions'])
+    finally:
+        os.chdir(previous_dir)
+        _restore_env(previous_env)
+        if 'output_dir' in _inputs:
+            shutil.rmtree(_inputs['output_dir'], ignore_errors=True)
+        _inputs.clear()
+
+    df_results = pd.DataFrame(records, columns=['rows', 'function', 'seconds', 'seconds_mean',
+                                                'peak_bytes', 'output_rows', 'digest'])
+    return df_results.astype({'output_rows': 'Int64'})
+
+def save_baseline(df_results, path):
+    """
+        Save benchmark results as a baseline.
+        :param Dataframe df_results -> Results of run_benchmarks.
+        :param string path -> Baseline file.
+    """
+    baseline = {'python': platform.python_version(), 'pandas': pd.__version__,
+                'numpy': np.__version__, 'machine': platform.platform(),
+                'results': json.loads(df_results.to_json(orient='records'))}
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(baseline, file, indent=1)
+
+def compare_to_baseline(df_results, path, tolerances=None) -> pd.DataFrame:
+    """
+        Compare benchmark results with a baseline.
+        :param Dataframe df_results -> Results of run_benchmarks.
+        :param string path -> Baseline file from save_baseline.
+        :param dict tolerances -> Any of BASELINE_TOLERANCES:
+                                      'time'        -> Allowed relative slowdown, ex. 0.25
+                                                       for 25%.
+                                      'memory'      -> Allowed relative growth of the peak
+                                                       memory.
+                                      'min_seconds' -> Slowdowns below this many seconds
+                                                       are ignored as noise.
+                                      'min_bytes'   -> Memory growths below this many bytes
+                                                       are ignored.
+        :return Dataframe -> Results with the baseline measures, the time and memory
+                             ratios and a 'regression' column describing failures
+    """
+    tolerances = dict(BASELINE_TOLERANCES, **(tolerances or {}))
+    with open(path, 'r', encoding='utf-8') as file:
+        df_baseline = pd.DataFrame(json.load(file)['results'])
+    df_compare = pd.merge(df_results,
+                          df_baseline[['rows', 'function', 'seconds', 'peak_bytes', 'digest']],
+                          how='left', on=['rows', 'function'], suffixes=('', '_baseline'))
+    df_compare['time_ratio'] = df_compare['seconds'] / df_compare['seconds_baseline']
+    df_compare['memory_ratio'] = df_compare['peak_bytes'] / df_compare['peak_bytes_baseline']
+
+    slower = (df_compare['time_ratio'] > 1 + tolerances['time']) &\
+        (df_compare['seconds'] - df_compare['seconds_baseline'] > tolerances['min_seconds'])
+    larger = (df_compare['memory_ratio'] > 1 + tolerances['memory']) &\
+        (df_compare['peak_bytes'] - df_compare['peak_bytes_baseline'] >
+         tolerances['min_bytes'])
+    changed = df_compare['digest'].notna() & df_compare['digest_baseline'].notna() &\
+        (df_compare['digest'] != df_compare['digest_baseline'])
+    df_compare['regression'] = [
+        ', '.join(reason for reason, failed in
+                  [('slower', is_slower), ('more memory', is_larger),
+                   ('result changed', is_changed)] if failed)
+        for is_slower, is_larger, is_changed in zip(slower, larger, changed)]
+
+    return df_compare
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000],
+                        help='Numbers of student records, ex. 10000 1000000 50000000.')
+    parser.add_argument('--functions', type=str, nargs='+', default=None,
+                        help='Benchmarks to run, defaults to all.')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per benchmark.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic data.')
+    parser.add_argument('--workdir', type=str, default=DEFAULT_WORKDIR,
+                        help='Directory of the synthetic data.')
+    parser.add_argument('--cold', action='store_true',
+                        help='Parse the workbooks on every run instead of reading the cache.')
+    parser.add_argument('--baseline', type=str, default=None,
+                        help='Baseline to compare the results with.')
+    parser.add_argument('--save-baseline', type=str, default=None,
+                        help='Save the results as a baseline.')
+    parser.add_argument('--time-tolerance', type=float, default=0.25,
+                        help='Allowed relative slowdown against the baseline.')
+    parser.add_argument('--memory-tolerance', type=float, default=0.25,
+                        help='Allowed relative growth of the peak memory.')
+    args = parser.parse_args()
+
+    df_all_results = pd.concat([run_benchmarks(n_rows, workdir=args.workdir, seed=args.seed,
+                                               options={'repeat': args.repeat,
+                                                        'functions': args.functions,
+                                                        'cold': args.cold})
+                                for n_rows in args.rows], ignore_index=True)
+    report_columns = ['rows', 'function', 'seconds', 'seconds_mean', 'peak_bytes',
+                      'output_rows']
+    if args.baseline:
+        df_report = compare_to_baseline(df_all_results, args.baseline,
+                                        tolerances={'time': args.time_tolerance,
+                                                    'memory': args.memory_tolerance})
+        print(df_report[report_columns + ['time_ratio', 'memory_ratio', 'regression']].
+              to_string(index=False))
+    else:
+        df_report = None
+        print(df_all_results[report_columns].to_string(index=False))
+    if args.save_baseline:
+        save_baseline(df_all_results, args.save_baseline)
+
+    if df_report is not None:
+        df_regressions = df_report[df_report['regression'] != '']
+        for _, regression in df_regressions.iterrows():
+            print(f"REGRESSION: {regression['function']} ({regression['rows']} rows): "
+                  f"{regression['regression']}")
+        sys.exit(1 if len(df_regressions) else 0)
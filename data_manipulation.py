@@ -1,343 +1,492 @@
 """
     This module performs most of the data manipulation tasks for the BLS project
 """
+import os
+import re
+import importlib
+from types import MappingProxyType
+import numpy as np
 import pandas as pd
-from bokeh.palettes import Cividis256
+from workbook_cache import read_excel_sheet, read_excel_sheets, register_workbook_sheets,\
+    get_sheet_names
+from dtype_policy import apply_dtype_policy, fillna_category
+from pipeline_cache import memoize_on_files
+from hierarchy_rollup import rollup_hierarchy, get_rollup_level
+from occupation_hierarchy import get_occupation_hierarchy, build_hierarchy, code, decode,\
+    ancestors
+from major_allocation import get_allocation_weights, count_students_by_major,\
+    allocate_student_counts
+from stage_profiler import profile_stage, profile_block, record_frames
+
+# Student record inputs.
+STUDENT_RECORD_CSV = './data/student.record.csv'
+TERM_TABLE = './data/term.table.txt'
+MAJORS_WORKBOOK = './data/majors.xlsx'
+MAJORS_OCCUPATIONS_CSV = './data/majors_occupations_map.csv'
+# Major -> occupation mappings, selected with BLS_MAJOR_MAPPING, and the environment
+# variables changing how students are allocated to occupations.
+MAJOR_MAPPING_FILES = {'workbook': MAJORS_WORKBOOK, 'csv': MAJORS_OCCUPATIONS_CSV}
+MAJOR_ALLOCATION_ENV = ['BLS_MAJOR_MAPPING', 'BLS_MAJOR_WEIGHTING']
+
+# BLS workbooks and the sheets the project reads from them. Registered sheets are
+# loaded together in one pass over each workbook and shared by every caller.
+# Year tabs are discovered from the sheet names, so a new year only needs a new tab.
+BLS_WORKBOOK_2011_TO_2015 = './data/bls_cpsaat39_2011_to_2015.xlsx'
+BLS_LEVEL_MAPPING_SHEET = 'level_mapping_l0'
+BLS_WORKBOOK_2002_TO_2015 = './data/bls_cpsaat09_2002_to_2015.xlsx'
+YEAR_TAB_PATTERN = r'^\d{4}$'
+
+# Student counts by sex derived from the student record.
+STUDENT_COUNT_COLUMNS = ['number_of_students_all', 'number_of_students_men',
+                         'number_of_students_women', 'number_of_students_unknown']
+
+# Student record columns read as categoricals.
+STUDENT_RECORD_DTYPES = {'SEX': 'category', 'MAJOR1_DESCR': 'category'}
+# Weight of each BLS earnings measure when averaged over occupations.
+EARNINGS_WEIGHT_COLUMNS = {'median_weekly_earnings_all': 'number_of_workers_all',
+                           'median_weekly_earnings_men': 'number_of_workers_men',
+                           'median_weekly_earnings_women': 'number_of_workers_women'}
+# Term columns of the student record and the fields looked up for each of them.
+STUDENT_TERM_COLUMNS = ['ADMIT_TERM', 'MAJOR1_TERM', 'MAJOR2_TERM', 'MAJOR3_TERM']
+TERM_FIELDS = ['TERM_ID', 'TERM_DESCRIPTION', 'TERM_NAME', 'TERM_YEAR']
+# Term fields required by the validation fields of the student record.
+STUDENT_TERM_VALIDATION_COLUMNS = ['ADMIT_TERM_TERM_YEAR', 'MAJOR1_TERM_TERM_YEAR']
+
+# Metric columns of the BLS level data.
+LEVEL_METRIC_COLUMNS = [column + '_sum' for column in
+                        STUDENT_COUNT_COLUMNS + list(EARNINGS_WEIGHT_COLUMNS.values())] +\
+                       [column + '_mean' for column in EARNINGS_WEIGHT_COLUMNS]
+
+# Measures of the level dataframes, in column order.
+LEVEL_SUM_COLUMNS = ['number_of_students_all_sum', 'number_of_students_men_sum',
+                     'number_of_students_women_sum', 'number_of_students_unknown_sum',
+                     'number_of_workers_all_sum', 'median_weekly_earnings_all_mean',
+                     'number_of_workers_men_sum', 'median_weekly_earnings_men_mean',
+                     'number_of_workers_women_sum', 'median_weekly_earnings_women_mean']
+# Execution backends of get_df_list_final.
+PIPELINE_BACKENDS = ['pandas', 'duckdb']
+
+# Short names of the BLS occupations by level and base metric, for visualization purposes.
+_SHORT_NAMES = {
+    'l1': {
+        'default':{
+            'Architecture and engineering occupations' : 'Arch & Eng',
+            'Arts, design, entertainment, sports, and media occupations' : 'Ent',
+            'Building and grounds cleaning and maintenance occupations' : 'Maintenance',
+            'Business and financial operations occupations' : 'Financial',
+            'Community and social service occupations' : 'Social Services',
+            'Computer and mathematical occupations' : 'Comp & Math',
+            'Construction and extraction occupations' : 'Construction',
+            'Education, training, and library occupations' : 'Education',
+            'Farming, fishing, and forestry occupations' : 'Natural Resources',
+            'Food preparation and serving related occupations' : 'Food',
+            'Healthcare practitioners and technical occupations' : 'Healthcare Practitioners',
+            'Healthcare support occupations' : 'Healthcare',
+            'Installation, maintenance, and repair occupations' : 'Facilities',
+            'Legal occupations' : 'Legal',
+            'Life, physical, and social science occupations' : 'Science',
+            'Management occupations' : 'Management',
+            'Office and administrative support occupations' : 'Office Admin',
+            'Personal care and service occupations': 'Personal Care',
+            'Production occupations' : 'Production',
+            'Protective service occupations': 'Security',
+            'Sales and related occupations' : 'Sales',
+            'Transportation and material moving occupations' : 'Logistics'
+        },
+        'number_of_workers':{
+            'Architecture and engineering occupations' : 'Arch & Eng',
+            'Arts, design, entertainment, sports, and media occupations' : 'Ent',
+            'Building and grounds cleaning and maintenance occupations' : 'Maintenance',
+            'Business and financial operations occupations' : 'Financial',
+            'Community and social service occupations' : 'Social Srvcs',
+            'Computer and mathematical occupations' : 'Comp & Math',
+            'Construction and extraction occupations' : 'Construction',
+            'Education, training, and library occupations' : 'Education',
+            'Farming, fishing, and forestry occupations' : 'Ntrl Rsrcs',
+            'Food preparation and serving related occupations' : 'Food',
+            'Healthcare practitioners and technical occupations' : 'Healthcare Practitioners',
+            'Healthcare support occupations' : 'Healthcare',
+            'Installation, maintenance, and repair occupations' : 'Facilities',
+            'Legal occupations' : 'Legal',
+            'Life, physical, and social science occupations' : 'Sci',
+            'Management occupations' : 'Management',
+            'Office and administrative support occupations' : 'Office Admin',
+            'Personal care and service occupations': 'Personal Care',
+            'Production occupations' : 'Production',
+            'Protective service occupations': 'Security',
+            'Sales and related occupations' : 'Sales',
+            'Transportation and material moving occupations' : 'Logistics'
+        },
+        'number_of_students':{
+            'Architecture and engineering occupations' : 'Arch & Eng',
+            'Arts, design, entertainment, sports, and media occupations' : 'Ent',
+            'Building and grounds cleaning and maintenance occupations' : 'Maintenance',
+            'Business and financial operations occupations' : 'Fin',
+            'Community and social service occupations' : 'Social Services',
+            'Computer and mathematical occupations' : 'Computer',
+            'Construction and extraction occupations' : 'Construction',
+            'Education, training, and library occupations' : 'Education',
+            'Farming, fishing, and forestry occupations' : 'Natural Resources',
+            'Food preparation and serving related occupations' : 'Food',
+            'Healthcare practitioners and technical occupations' : 'Med Pract',
+            'Healthcare support occupations' : 'Healthcare',
+            'Installation, maintenance, and repair occupations' : 'Facilities',
+            'Legal occupations' : 'Legal',
+            'Life, physical, and social science occupations' : 'Science',
+            'Management occupations' : 'Mgmt',
+            'Office and administrative support occupations' : 'Office Admin',
+            'Personal care and service occupations': 'Personal Care',
+            'Production occupations' : 'Production',
+            'Protective service occupations': 'Security',
+            'Sales and related occupations' : 'Sales',
+            'Transportation and material moving occupations' : 'Logistics'
+        },
+    },
+    'l2': {
+        'default':{
+            'Building and grounds cleaning and maintenance occupations' : 'Maint',
+            'Construction and extraction occupations' : 'Construction',
+            'Farming, fishing, and forestry occupations' : 'Natural Resources',
+            'Food preparation and serving related occupations' : 'Food',
+            'Healthcare support occupations' : 'Health',
+            'Installation, maintenance, and repair occupations' : 'Facilities',
+            'Management, business, and financial operations occupations' : 'Business',
+            'Office and administrative support occupations' : 'Office Admin',
+            'Personal care and service occupations': 'Personal Care',
+            'Production occupations' : 'Production',
+            'Professional and related occupations' : 'Professional',
+            'Protective service occupations' : 'Security',
+            'Sales and related occupations' : 'Sales',
+            'Transportation and material moving occupations' : 'Logistics'
+        },
+        'number_of_workers':{
+            'Building and grounds cleaning and maintenance occupations' : 'Maint',
+            'Construction and extraction occupations' : 'Construction',
+            'Farming, fishing, and forestry occupations' : 'Natural',
+            'Food preparation and serving related occupations' : 'Food',
+            'Healthcare support occupations' : 'Health',
+            'Installation, maintenance, and repair occupations' : 'Facilities',
+            'Management, business, and financial operations occupations' : 'Business',
+            'Office and administrative support occupations' : 'Office Admin',
+            'Personal care and service occupations': 'Personal Care',
+            'Production occupations' : 'Production',
+            'Professional and related occupations' : 'Professional',
+            'Protective service occupations' : 'Security',
+            'Sales and related occupations' : 'Sales',
+            'Transportation and material moving occupations' : 'Logistics'
+        },
+        'number_of_students':{
+            'Building and grounds cleaning and maintenance occupations' : 'Maint',
+            'Construction and extraction occupations' : 'Construction',
+            'Farming, fishing, and forestry occupations' : 'Natural Resources',
+            'Food preparation and serving related occupations' : 'Food',
+            'Healthcare support occupations' : 'Health',
+            'Installation, maintenance, and repair occupations' : 'Facilities',
+            'Management, business, and financial operations occupations' : 'Bus',
+            'Office and administrative support occupations' : 'Office',
+            'Personal care and service occupations': 'Personal Care',
+            'Production occupations' : 'Production',
+            'Professional and related occupations' : 'Professional',
+            'Protective service occupations' : 'Security',
+            'Sales and related occupations' : 'Sales',
+            'Transportation and material moving occupations' : 'Logistics'
+        },
+
+    },
+}
+# Read-only views of the short names, built once.
+SHORT_NAMES = MappingProxyType({
+    level: MappingProxyType({metric: MappingProxyType(names)
+                             for metric, names in short_names.items()})
+    for level, short_names in _SHORT_NAMES.items()
+})
+
+register_workbook_sheets(BLS_WORKBOOK_2011_TO_2015, [BLS_LEVEL_MAPPING_SHEET],
+                         pattern=YEAR_TAB_PATTERN)
+register_workbook_sheets(BLS_WORKBOOK_2002_TO_2015, pattern=YEAR_TAB_PATTERN)
 
+# Visualization helpers re-exported from other modules on first access, so the data
+# pipeline does not load them.
+_LAZY_ATTRIBUTES = {'get_palette': 'treemap_format',
+                    'get_format_parameters': 'treemap_format'}
 
-def get_short_names(level, metric) -> dict:
+
+def __getattr__(name):
     """
-        Used to map long name data attributes to short names for visualization purposes.
+        Import the lazily re-exported attributes of the module, ex.
+        from data_manipulation import get_format_parameters.
     """
+    module_name = _LAZY_ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError('module ' + repr(__name__) + ' has no attribute ' + repr(name))
+    return getattr(importlib.import_module(module_name), name)
 
-    short_names_dict = {
-        'l1': {
-            'default':{
-                'Architecture and engineering occupations' : 'Arch & Eng',
-                'Arts, design, entertainment, sports, and media occupations' : 'Ent',
-                'Building and grounds cleaning and maintenance occupations' : 'Maintenance',
-                'Business and financial operations occupations' : 'Financial',
-                'Community and social service occupations' : 'Social Services',
-                'Computer and mathematical occupations' : 'Comp & Math',
-                'Construction and extraction occupations' : 'Construction',
-                'Education, training, and library occupations' : 'Education',
-                'Farming, fishing, and forestry occupations' : 'Natural Resources',
-                'Food preparation and serving related occupations' : 'Food',
-                'Healthcare practitioners and technical occupations' : 'Healthcare Practitioners',
-                'Healthcare support occupations' : 'Healthcare',
-                'Installation, maintenance, and repair occupations' : 'Facilities',
-                'Legal occupations' : 'Legal',
-                'Life, physical, and social science occupations' : 'Science',
-                'Management occupations' : 'Management',
-                'Office and administrative support occupations' : 'Office Admin',
-                'Personal care and service occupations': 'Personal Care', 
-                'Production occupations' : 'Production',
-                'Protective service occupations': 'Security', 
-                'Sales and related occupations' : 'Sales',
-                'Transportation and material moving occupations' : 'Logistics'
-            },
-            'number_of_workers':{
-                'Architecture and engineering occupations' : 'Arch & Eng',
-                'Arts, design, entertainment, sports, and media occupations' : 'Ent',
-                'Building and grounds cleaning and maintenance occupations' : 'Maintenance',
-                'Business and financial operations occupations' : 'Financial',
-                'Community and social service occupations' : 'Social Srvcs',
-                'Computer and mathematical occupations' : 'Comp & Math',
-                'Construction and extraction occupations' : 'Construction',
-                'Education, training, and library occupations' : 'Education',
-                'Farming, fishing, and forestry occupations' : 'Ntrl Rsrcs',
-                'Food preparation and serving related occupations' : 'Food',
-                'Healthcare practitioners and technical occupations' : 'Healthcare Practitioners',
-                'Healthcare support occupations' : 'Healthcare',
-                'Installation, maintenance, and repair occupations' : 'Facilities',
-                'Legal occupations' : 'Legal',
-                'Life, physical, and social science occupations' : 'Sci',
-                'Management occupations' : 'Management',
-                'Office and administrative support occupations' : 'Office Admin',
-                'Personal care and service occupations': 'Personal Care', 
-                'Production occupations' : 'Production',
-                'Protective service occupations': 'Security', 
-                'Sales and related occupations' : 'Sales',
-                'Transportation and material moving occupations' : 'Logistics'
-            },
-            'number_of_students':{
-                'Architecture and engineering occupations' : 'Arch & Eng',
-                'Arts, design, entertainment, sports, and media occupations' : 'Ent',
-                'Building and grounds cleaning and maintenance occupations' : 'Maintenance',
-                'Business and financial operations occupations' : 'Fin',
-                'Community and social service occupations' : 'Social Services',
-                'Computer and mathematical occupations' : 'Computer',
-                'Construction and extraction occupations' : 'Construction',
-                'Education, training, and library occupations' : 'Education',
-                'Farming, fishing, and forestry occupations' : 'Natural Resources',
-                'Food preparation and serving related occupations' : 'Food',
-                'Healthcare practitioners and technical occupations' : 'Med Pract',
-                'Healthcare support occupations' : 'Healthcare',
-                'Installation, maintenance, and repair occupations' : 'Facilities',
-                'Legal occupations' : 'Legal',
-                'Life, physical, and social science occupations' : 'Science',
-                'Management occupations' : 'Mgmt',
-                'Office and administrative support occupations' : 'Office Admin',
-                'Personal care and service occupations': 'Personal Care', 
-                'Production occupations' : 'Production',
-                'Protective service occupations': 'Security', 
-                'Sales and related occupations' : 'Sales',
-                'Transportation and material moving occupations' : 'Logistics'
-            },
-        },
-        'l2': {
-            'default':{
-                'Building and grounds cleaning and maintenance occupations' : 'Maint',
-                'Construction and extraction occupations' : 'Construction',
-                'Farming, fishing, and forestry occupations' : 'Natural Resources',
-                'Food preparation and serving related occupations' : 'Food',
-                'Healthcare support occupations' : 'Health',
-                'Installation, maintenance, and repair occupations' : 'Facilities',
-                'Management, business, and financial operations occupations' : 'Business',
-                'Office and administrative support occupations' : 'Office Admin',
-                'Personal care and service occupations': 'Personal Care', 
-                'Production occupations' : 'Production',
-                'Professional and related occupations' : 'Professional',
-                'Protective service occupations' : 'Security',
-                'Sales and related occupations' : 'Sales',
-                'Transportation and material moving occupations' : 'Logistics'
-            },
-            'number_of_workers':{
-                'Building and grounds cleaning and maintenance occupations' : 'Maint',
-                'Construction and extraction occupations' : 'Construction',
-                'Farming, fishing, and forestry occupations' : 'Natural',
-                'Food preparation and serving related occupations' : 'Food',
-                'Healthcare support occupations' : 'Health',
-                'Installation, maintenance, and repair occupations' : 'Facilities',
-                'Management, business, and financial operations occupations' : 'Business',
-                'Office and administrative support occupations' : 'Office Admin',
-                'Personal care and service occupations': 'Personal Care', 
-                'Production occupations' : 'Production',
-                'Professional and related occupations' : 'Professional',
-                'Protective service occupations' : 'Security',
-                'Sales and related occupations' : 'Sales',
-                'Transportation and material moving occupations' : 'Logistics'
-            },
-            'number_of_students':{
-                'Building and grounds cleaning and maintenance occupations' : 'Maint',
-                'Construction and extraction occupations' : 'Construction',
-                'Farming, fishing, and forestry occupations' : 'Natural Resources',
-                'Food preparation and serving related occupations' : 'Food',
-                'Healthcare support occupations' : 'Health',
-                'Installation, maintenance, and repair occupations' : 'Facilities',
-                'Management, business, and financial operations occupations' : 'Bus',
-                'Office and administrative support occupations' : 'Office',
-                'Personal care and service occupations': 'Personal Care', 
-                'Production occupations' : 'Production',
-                'Professional and related occupations' : 'Professional',
-                'Protective service occupations' : 'Security',
-                'Sales and related occupations' : 'Sales',
-                'Transportation and material moving occupations' : 'Logistics'
-            },
+def _strip_metric(metric):
+    """
+        Remove the aggregation and sex of a metric name, ex. 'number_of_workers_men_sum'
+        -> 'number_of_workers'.
+    """
+    return metric.replace('_sum', '').replace('_women', '').replace('_men', '').\
+        replace('_all', '')
 
-        },
-    }
+# Base metric of every metric of the BLS level data, resolved once.
+BASE_METRICS = MappingProxyType({metric: _strip_metric(metric)
+                                 for metric in LEVEL_METRIC_COLUMNS})
 
-    if metric in short_names_dict[level].keys():
-        short_name = short_names_dict[level][metric]
-    else:
-        short_name = short_names_dict[level]['default']
 
-    return short_name
-
-def get_palette(number_of_groups) -> dict:
+def get_base_metric(metric) -> str:
     """
-        Used to break the larger Cividis color palette into smaller paletted 
-        schemes for visualization purposes.
+        Get the base metric exclusive of sex used by get_short_names and
+        get_format_parameters, ex. 'number_of_workers_men_sum' -> 'number_of_workers'.
+        :param string metric -> Metric column name.
+        :return string -> Base metric
     """
+    base_metric = BASE_METRICS.get(metric)
+    return base_metric if base_metric is not None else _strip_metric(metric)
 
-    cividis = {
-        'default': Cividis256[0:3] + Cividis256[64:67] + Cividis256[128:131] + 
-                    Cividis256[192: 195] + Cividis256[252: 255],
-        14: Cividis256[0:3] + Cividis256[64:67] + Cividis256[128:131] +
-                    Cividis256[192: 195] + Cividis256[252: 255],
-        4: [Cividis256[0]] + [Cividis256[64]] + [Cividis256[192]] +
-                    [Cividis256[252]],
-        2: Cividis256[0]  + Cividis256[255]
-    }
-
-    if cividis.get(number_of_groups) is not None:
-        color = cividis[number_of_groups]
-    else:
-        color = cividis['default']
+def get_short_names(level, metric) -> MappingProxyType:
+    """
+        Used to map long name data attributes to short names for visualization purposes.
+        Returns a read-only view of the short names of the level for the base metric,
+        or of the default short names of the level.
+    """
+    short_names = SHORT_NAMES[level]
+    return short_names.get(metric, short_names['default'])
 
-    return color
+def get_year_tabs(filepath) -> list:
+    """
+        Discover the year tabs of a BLS workbook from its sheet names, ex. '2015'.
+        :param string filepath -> Filepath to BLS excel file.
+        :return List<string> -> Year tabs, most recent year first
+    """
+    tabs = [sheet_name for sheet_name in get_sheet_names(filepath)
+            if re.search(YEAR_TAB_PATTERN, sheet_name)]
+    return sorted(tabs, key=int, reverse=True)
 
-def get_format_parameters(metric, number_of_groups) -> dict:
+def get_pipeline_backend() -> str:
     """
-        Get visualization configuration for treemap.
+        Get the execution backend of get_df_list_final from BLS_BACKEND.
+        :return string -> One of PIPELINE_BACKENDS, defaults to 'pandas'
     """
-    palette = get_palette(number_of_groups=number_of_groups)
-    label_offset_dict = {
-        'default':{
-                'block':{'line_width': 1, 
-                         'line_color': 'white', 
-                         'fill_alpha': 0.80, 
-                         'palette': palette},
-                'l2' : {'x_offset': 2, 
-                        'y_offset': -35,
-                        'text_font_size': "30pt",
-                        'text_baseline': "top",
-                        'text_color': 'black'
-                        },
-                'l1' : {'x_offset': 2, 
-                        'y_offset': 35,
-                        'text_font_size': "18pt",
-                        'text_baseline': "top",
-                        'text_color': 'black'
-                        },
-        },
+    backend = os.environ.get('BLS_BACKEND') or 'pandas'
+    if backend not in PIPELINE_BACKENDS:
+        raise ValueError('Unknown pipeline backend: ' + backend)
+    return backend
 
-        'number_of_workers':{
-            'block':{'line_width': 10, 
-                        'line_color': 'white', 
-                        'fill_alpha': 0.80, 
-                        'palette': palette},
-            'l2' : {'x_offset': 8, 
-                    'y_offset': -15,
-                    'text_font_size': "23pt",
-                    'text_baseline': "top",
-                    'text_color': 'black'
-                    },
-            'l1' : {'x_offset': 8, 
-                    'y_offset': 4,
-                    'text_font_size': "17pt",
-                    'text_baseline': "top",
-                    'text_color': 'white'
-                    },
-        },
+def get_major_mapping_source() -> str:
+    """
+        Get the major -> occupation mapping from BLS_MAJOR_MAPPING.
+        :return string -> One of MAJOR_MAPPING_FILES, defaults to 'workbook'
+    """
+    source = os.environ.get('BLS_MAJOR_MAPPING') or 'workbook'
+    if source not in MAJOR_MAPPING_FILES:
+        raise ValueError('Unknown major mapping: ' + source)
+    return source
 
-        'number_of_students':{
-                'block':{'line_width': 10, 
-                         'line_color': 'white', 
-                         'fill_alpha': 0.80, 
-                         'palette': palette},
-                'l2' : {'x_offset': 10, 
-                        'y_offset': -35,
-                        'text_font_size': "30pt",
-                        'text_baseline': "top",
-                        'text_color': 'black'
-                        },
-                'l1' : {'x_offset': 10, 
-                        'y_offset': 4,
-                        'text_font_size': "18pt",
-                        'text_baseline': "top",
-                        'text_color': 'white'
-                        },
-        },
-    }
+def get_major_weighting() -> str:
+    """
+        Get the weighting of majors mapped to several occupations from BLS_MAJOR_WEIGHTING.
+        :return string -> 'unit' or 'fractional', defaults to 'unit'
+    """
+    return os.environ.get('BLS_MAJOR_WEIGHTING') or 'unit'
 
-    if label_offset_dict.get(metric)  is not None:
-        label_dict = label_offset_dict[metric]
+def get_major_mapping(source=None) -> pd.DataFrame:
+    """
+        Imports the many to many major -> occupation mapping table.
+        :param string source -> 'workbook' for the 'majors' sheet of ./data/majors.xlsx or
+                                'csv' for ./data/majors_occupations_map.csv, defaults to
+                                BLS_MAJOR_MAPPING.
+        :return Dataframe -> Columns 'MAJOR', 'OCCUPATION' and optionally 'WEIGHT'
+    """
+    source = source or get_major_mapping_source()
+    if source == 'csv':
+        df_majors = pd.read_csv(MAJORS_OCCUPATIONS_CSV, encoding='utf-8-sig')
     else:
-        label_dict = label_offset_dict[metric]['default']
+        df_majors = read_excel_sheet(MAJORS_WORKBOOK, sheet_name='majors', header=0)
 
-    return label_dict
+    return apply_dtype_policy(df_majors)
 
-def get_student_record_df() -> pd.DataFrame:
+@profile_stage
+def get_term_df() -> pd.DataFrame:
     """
-        Manipulates student data record analysis.
+        Imports the term table with the term name and year derived from the description.
     """
-
-    # Import file data in dataframes
-    df_record = pd.read_csv('./data/student.record.csv') #
-    df_term = pd.read_table('./data/term.table.txt', delimiter="\t").fillna('Unknown')
+    df_term = pd.read_table(TERM_TABLE, delimiter="\t").fillna('Unknown')
 
     # Create term_name field and term_year from term_description.
     df_term.columns = ['TERM_ID', 'TERM_DESCRIPTION']
     terms = ['Fall', 'Winter', 'Summer', 'Spring', 'Unknown']
-    df_term['TERM_NAME'] = df_term['TERM_DESCRIPTION'].\
-        apply(lambda x: list(filter(lambda y: y!='', [t if t in x else '' for t in terms]))[0])
-    df_term['TERM_YEAR'] = df_term['TERM_DESCRIPTION'].\
-        apply(lambda x: int(x[-4:]) if x[-4:].isnumeric() else None)
-
-    # Recrusively merge the ADMIT_TERM, MAJOR1_TERM, MAJOR2_TERM, and 'MAJOR3_TERM' to term table.
-    terms_student = ['ADMIT_TERM', 'MAJOR1_TERM', 'MAJOR2_TERM', 'MAJOR3_TERM']
-    merge_record_df = df_record.copy()
-    for term in terms_student:
-
-        merge_record_df = pd.merge(
-                            merge_record_df,
-                            df_term,
-                            how='left',
-                            left_on=term,
-                            right_on='TERM_ID')
-
-        merge_record_df.rename(columns={'TERM_ID': term + '_' + 'TERM_ID',
-                                'TERM_DESCRIPTION': term + '_' + 'TERM_DESCRIPTION', 
-                                'TERM_NAME': term + '_' + 'TERM_NAME', 
-                                'TERM_YEAR': term + '_' + 'TERM_YEAR'}, inplace=True)    
+    # The first term of the list found in the description wins, ex. 'Spring/Summer' -> 'Summer'.
+    df_term['TERM_NAME'] = np.select(
+        [df_term['TERM_DESCRIPTION'].str.contains(t, regex=False) for t in terms],
+        terms, default=None)
+    term_year = df_term['TERM_DESCRIPTION'].str[-4:]
+    df_term['TERM_YEAR'] = pd.to_numeric(term_year.where(term_year.str.isnumeric()))
+
+    return df_term
+
+@profile_stage
+def enrich_student_record(df_record, df_term, term_columns=None) -> pd.DataFrame:
+    """
+        Adds the term fields of ADMIT_TERM, MAJOR1_TERM, MAJOR2_TERM and MAJOR3_TERM
+        (ex. 'MAJOR1_TERM_TERM_YEAR') and the validation fields to the student record.
+        The term table is indexed once and every term column is looked up in a single
+        pass, the new columns are added to df_record in place.
+        :param Dataframe df_record -> Student record data.
+        :param Dataframe df_term -> Term table from get_term_df.
+        :param List<string> term_columns -> Term fields to add, defaults to all of them.
+                                            The ADMIT_TERM and MAJOR1_TERM years are
+                                            always added for the validation fields.
+        :return Dataframe -> Enriched student record data
+    """
+    term_index = pd.Index(df_term['TERM_ID'])
+    for term in STUDENT_TERM_COLUMNS:
+        with profile_block('enrich_student_record.' + term, inputs=df_record[term]) as record:
+            # Position of each student term in the term table, -1 for unknown terms.
+            indexer = term_index.get_indexer(df_record[term])
+            for field in TERM_FIELDS:
+                column = term + '_' + field
+                if term_columns is None or column in term_columns or\
+                        column in STUDENT_TERM_VALIDATION_COLUMNS:
+                    df_record[column] = pd.api.extensions.take(df_term[field].to_numpy(),
+                                                               indexer, allow_fill=True)
+            if record is not None:
+                record_frames(record, df_record.filter(like=term + '_TERM_'))
 
     # Create additional fields for validation and filtering.
     # The delta between 'MAJOR1_TERM_TERM_YEAR' and 'ADMIT_TERM_TERM_YEAR' is on
     # average 3.7 years, infering 'MAJOR1_TERM_TERM_YEAR' as graduation year.
-    merge_record_df['ADMIT_TERM_EQUALS_MAJOR1_TERM'] =\
-          merge_record_df['ADMIT_TERM'] == merge_record_df['MAJOR1_TERM']
-    merge_record_df['MAJOR1_TERM_YEAR_MINUS_ADMIT_TERM_YEAR'] =\
-          merge_record_df['MAJOR1_TERM_TERM_YEAR'] - merge_record_df['ADMIT_TERM_TERM_YEAR']
+    df_record['ADMIT_TERM_EQUALS_MAJOR1_TERM'] =\
+          df_record['ADMIT_TERM'] == df_record['MAJOR1_TERM']
+    df_record['MAJOR1_TERM_YEAR_MINUS_ADMIT_TERM_YEAR'] =\
+          df_record['MAJOR1_TERM_TERM_YEAR'] - df_record['ADMIT_TERM_TERM_YEAR']
 
-    return merge_record_df
+    return df_record
 
-def get_df_record_occupation_level_grouped_by_year_filtered(merge_record_df) -> pd.DataFrame:
+@profile_stage
+@memoize_on_files([STUDENT_RECORD_CSV, TERM_TABLE])
+def get_student_record_df(term_columns=None) -> pd.DataFrame:
     """
-        Merges BLS class hierarchy to student record data to later join to BLS dataset.
+        Manipulates student data record analysis.
+        :param List<string> term_columns -> Term fields to add to the record, ex.
+                                            ['MAJOR1_TERM_TERM_YEAR'], defaults to all.
+    """
+
+    # Import file data in dataframes
+    df_record = pd.read_csv(STUDENT_RECORD_CSV, dtype=STUDENT_RECORD_DTYPES) #
+
+    return enrich_student_record(df_record, get_term_df(), term_columns=term_columns)
+
+@profile_stage
+def get_student_occupation_counts(merge_record_df, weighting=None) -> pd.DataFrame:
+    """
+        Maps student majors to occupations and counts students by sex per occupation and
+        MAJOR1_TERM_TERM_YEAR. Students are counted by major first and the counts are
+        allocated to occupations with the sparse weight matrix of major_allocation.
+        :param Dataframe merge_record_df -> Student record data from get_student_record_df.
+        :param string weighting -> 'unit' or 'fractional', defaults to BLS_MAJOR_WEIGHTING.
+        :return Dataframe -> Student counts by 'OCCUPATION' and 'MAJOR1_TERM_TERM_YEAR'
     """
 
     # Import many to many major mapping table
     term = 'MAJOR1_TERM_TERM_YEAR'
 
-    df_majors = pd.read_excel('./data/majors.xlsx', sheet_name='majors', header=0)
+    df_majors = get_major_mapping()
+    df_weights = get_allocation_weights(df_majors, weighting or get_major_weighting())
     # Handle missing major1 values as undeclared majors
-    merge_record_df['MAJOR1_DESCR'] = merge_record_df['MAJOR1_DESCR'].fillna('Undeclared')
-    # Merge major1 to major mapping table
-    df_record_occupation = pd.merge(merge_record_df,
-                                df_majors,
-                                how='left',
-                                left_on='MAJOR1_DESCR',
-                                right_on='MAJOR')
-    # transpose genders from row to column values.
-    df_record_occupation['number_of_students_all'] = 1
-    df_record_occupation['number_of_students_men'] =\
-          df_record_occupation['SEX'].apply(lambda sex: 1 if sex == 'M' else 0)
-    df_record_occupation['number_of_students_women'] =\
-          df_record_occupation['SEX'].apply(lambda sex: 1 if sex == 'F' else 0)
-    df_record_occupation['number_of_students_unknown'] =\
-          df_record_occupation['SEX'].apply(lambda sex: 1 if sex not in ['M', 'F'] else 0)
-    df_record_occupation['MAJOR1_TERM_TERM_YEAR'] =\
-          df_record_occupation['MAJOR1_TERM_TERM_YEAR'].apply(lambda x: str(x)[0:4])
-    # Aggreate by occupation.
-    df_record_occupation_grouped =\
-          df_record_occupation.groupby(['OCCUPATION',term]).sum().reset_index()
-    # Import bls hierarchy mapping to join with grouped student occupation data.
-    df_occupation_level_mapping =\
-          pd.read_excel('./data/bls_cpsaat39_2011_to_2015.xlsx',
-                        sheet_name='level_mapping_l0', header=0)
-    df_occupation_level_mapping_distinct =\
-          df_occupation_level_mapping[
-              ['l4', 'l3', 'l2', 'l1']
-              ].drop_duplicates().reset_index()
-    df_occupation_level_mapping_distinct =\
-          df_occupation_level_mapping_distinct[['l4', 'l3', 'l2', 'l1']]
-    # Merge student occupation data with bls hierarchy mapping.
-    df_record_occupation_level_grouped = pd.merge(df_record_occupation_grouped,
-                                                    df_occupation_level_mapping_distinct,
-                                                    how='left',
-                                                    left_on='OCCUPATION',
-                                                    right_on='l1')
-    # Select desired fields and sort by occupation and term.
-    df_record_occupation_level_grouped = df_record_occupation_level_grouped[
-                                        [term, 'OCCUPATION', 'number_of_students_all',
-                                        'number_of_students_men', 'number_of_students_women', 
-                                        'number_of_students_unknown', 'l4', 'l3', 'l2', 'l1']].\
-                                        sort_values(by=['OCCUPATION', term])
+    merge_record_df['MAJOR1_DESCR'] = fillna_category(merge_record_df['MAJOR1_DESCR'],
+                                                      'Undeclared')
+    # Count students by major, year and sex, then allocate the counts to occupations.
+    df_record_occupation_grouped = allocate_student_counts(
+        count_students_by_major(merge_record_df, df_weights['MAJOR'], term=term),
+        df_weights, term=term)
+    # Format the year as a string for the BLS join, with every year of the record as
+    # categories.
+    years = pd.unique(merge_record_df[term].dropna().to_numpy())
+    df_record_occupation_grouped['OCCUPATION'] = pd.Categorical(
+        df_record_occupation_grouped['OCCUPATION'], dtype=df_majors['OCCUPATION'].dtype)
+    df_record_occupation_grouped[term] = pd.Categorical(
+        df_record_occupation_grouped[term].astype('int64').astype(str),
+        categories=np.unique(years.astype('int64').astype(str)))
+
+    return apply_dtype_policy(df_record_occupation_grouped)
+
+@profile_stage
+def get_student_occupation_counts_chunked(chunksize) -> pd.DataFrame:
+    """
+        Streams ./data/student.record.csv in chunks of chunksize rows, enriches and counts
+        each chunk with get_student_occupation_counts and adds up the partial counts, so
+        peak memory is bounded by the chunk size. The result equals
+        get_student_occupation_counts(get_student_record_df()).
+        :param int chunksize -> Number of student records read at a time.
+        :return Dataframe -> Student counts by 'OCCUPATION' and 'MAJOR1_TERM_TERM_YEAR'
+    """
+    df_term = get_term_df()
+
+    df_partial_counts = []
+    for df_record_chunk in pd.read_csv(STUDENT_RECORD_CSV, chunksize=chunksize,
+                                       dtype=STUDENT_RECORD_DTYPES):
+        merge_record_chunk = enrich_student_record(
+                                df_record_chunk, df_term,
+                                term_columns=STUDENT_TERM_VALIDATION_COLUMNS)
+        df_partial_counts.append(get_student_occupation_counts(merge_record_chunk))
 
+    return add_student_occupation_counts(df_partial_counts)
+
+def add_student_occupation_counts(df_partial_counts) -> pd.DataFrame:
+    """
+        Add up student counts of disjoint parts of the student record, ex. chunks of
+        the file or records appended since the counts were stored.
+        :param List<Dataframe> df_partial_counts -> Counts from get_student_occupation_counts.
+        :return Dataframe -> Student counts by 'OCCUPATION' and 'MAJOR1_TERM_TERM_YEAR'
+    """
+    term = 'MAJOR1_TERM_TERM_YEAR'
+    # Parts have their own categories, so keys are plain strings until counts are merged.
+    df_record_occupation_grouped = pd.concat(df_partial_counts).\
+        groupby(['OCCUPATION', term], observed=True)[STUDENT_COUNT_COLUMNS].sum().reset_index()
+
+    return apply_dtype_policy(df_record_occupation_grouped)
+
+@profile_stage
+@memoize_on_files([MAJORS_WORKBOOK, MAJORS_OCCUPATIONS_CSV, BLS_WORKBOOK_2011_TO_2015],
+                  env=MAJOR_ALLOCATION_ENV)
+def get_df_record_occupation_level_grouped_by_year_filtered(merge_record_df,
+                                                             df_record_occupation_grouped=None
+                                                             ) -> pd.DataFrame:
+    """
+        Merges BLS class hierarchy to student record data to later join to BLS dataset.
+        Student counts already computed by get_student_occupation_counts (or its chunked
+        variant) can be passed as df_record_occupation_grouped, merge_record_df is then
+        ignored.
+    """
+    term = 'MAJOR1_TERM_TERM_YEAR'
+    if df_record_occupation_grouped is None:
+        df_record_occupation_grouped = get_student_occupation_counts(merge_record_df)
+
+    # Import bls hierarchy mapping to join with grouped student occupation data.
+    df_occupation_level_mapping = apply_dtype_policy(
+          read_excel_sheet(BLS_WORKBOOK_2011_TO_2015,
+                           sheet_name=BLS_LEVEL_MAPPING_SHEET, header=0))
+    hierarchy = get_occupation_hierarchy(BLS_WORKBOOK_2011_TO_2015, BLS_LEVEL_MAPPING_SHEET)
+    # Code student occupations as l1 groups of the hierarchy, occupations outside of it
+    # are dropped.
+    l1_codes = code(hierarchy, df_record_occupation_grouped['OCCUPATION'], 'l1')
+    df_record_occupation_level_grouped =\
+          df_record_occupation_grouped.loc[l1_codes >= 0, [term] + STUDENT_COUNT_COLUMNS]
+    df_record_occupation_level_grouped['l1'] = l1_codes[l1_codes >= 0]
+    # Codes follow the name order, so groups are sorted as by name.
     df_record_occupation_level_grouped_by_year =\
-          df_record_occupation_level_grouped.groupby([term, 'l1']).sum().reset_index()
+          df_record_occupation_level_grouped.groupby([term, 'l1'], observed=True)[
+              STUDENT_COUNT_COLUMNS].sum().reset_index()
+    # Levels above l1 are looked up in the parent arrays of the hierarchy, with the
+    # categories of the mapping.
+    l1_codes = df_record_occupation_level_grouped_by_year['l1'].to_numpy()
+    ancestor_codes = ancestors(hierarchy, 'l1', l1_codes)
+    ancestor_codes['l1'] = l1_codes
+    for level in ['l4', 'l3', 'l2', 'l1']:
+        df_record_occupation_level_grouped_by_year[level] = pd.Categorical(
+              decode(hierarchy, ancestor_codes[level], level),
+              dtype=df_occupation_level_mapping[level].dtype)
     # reorder fields in dataframe for readability.
     df_record_occupation_level_grouped_by_year =\
         df_record_occupation_level_grouped_by_year[[term, 'l4', 'l3', 'l2', 'l1',
@@ -350,138 +499,233 @@ def get_df_record_occupation_level_grouped_by_year_filtered(merge_record_df) ->
     df_record_occ_lvl_grouped_by_year_filtered = df_record_occupation_level_grouped_by_year[
                                                     df_record_occupation_level_grouped_by_year[
                                                     'MAJOR1_TERM_TERM_YEAR'].\
-                                                    isin(['2011', '2012', '2013',
-                                                    '2014', '2015'])] 
+                                                    isin(get_year_tabs(
+                                                        BLS_WORKBOOK_2011_TO_2015))]
 
-    return df_record_occ_lvl_grouped_by_year_filtered, df_occupation_level_mapping
+    return apply_dtype_policy(df_record_occ_lvl_grouped_by_year_filtered),\
+        df_occupation_level_mapping
 
+@profile_stage
+def get_bls_year_tabs(filepath, tabs, columns=None, max_workers=None, **read_kwargs):
+    """
+        Imports one tab per year from a BLS workbook into a single dataframe.
+        Tabs are parsed in one pass, or concurrently when max_workers is greater than 1,
+        and concatenated once in the order of tabs.
+        :param string filepath -> Filepath to BLS excel file
+        :param List<string> tabs -> Names of the year tabs to import.
+        :param List<string> columns -> Optional column names for every tab.
+        :param int max_workers -> Number of parsing processes, defaults to BLS_EXCEL_WORKERS.
+        :return Dataframe -> BLS data of every year with a categorical 'year' column
+    """
+    df_bls_tabs = read_excel_sheets(filepath, tabs, max_workers=max_workers, **read_kwargs)
+
+    df_bls_years = []
+    for tab in tabs:
+        df_bls_next = df_bls_tabs[str(tab)].fillna('Unknown')
+        if columns is not None:
+            df_bls_next.columns = columns
+        df_bls_next['year'] = str(tab)
+        df_bls_years.append(df_bls_next)
+
+    return apply_dtype_policy(pd.concat(df_bls_years))
+
+@profile_stage
+@memoize_on_files([BLS_WORKBOOK_2011_TO_2015])
 def get_df_level_list(df_record_occupation_level_grouped_by_year_filtered,
-                      df_occupation_level_mapping):
+                      df_occupation_level_mapping,
+                      max_workers=None,
+                      years=None):
     """
         Merges student record data with BLS dataset to create a list of dataframes 
         at the desired BLS aggregate level to feed treemap visuals.
+        The max_workers argument sets the number of processes parsing the year tabs
+        (defaults to BLS_EXCEL_WORKERS). The years argument restricts the level data to
+        some of the year tabs, ex. ['2015'], defaults to every year tab of the workbook.
     """
     # select only the years with avaiable wages data in the BLS dataset.
-    tabs = ['2015', '2014', '2013', '2012', '2011']
+    tabs = get_year_tabs(BLS_WORKBOOK_2011_TO_2015) if years is None else\
+        [str(year) for year in years]
 
-    # for each tab in the excel BLS dataset, merge to one dataframe.
-    df_bls_all = pd.DataFrame()
-    for tab in tabs:
-        df_bls_next = pd.read_excel('./data/bls_cpsaat39_2011_to_2015.xlsx',
-                                    sheet_name=str(tab),
-                                    header=0,
-                                    ).fillna('Unknown')
-        df_bls_next['year'] = str(tab)
-        df_bls_all = pd.concat([df_bls_all, df_bls_next])
+    # merge each tab in the excel BLS dataset to one dataframe.
+    df_bls_all = get_bls_year_tabs(BLS_WORKBOOK_2011_TO_2015, tabs,
+                                   max_workers=max_workers, header=0)
 
-    # merge with occupation level mapping.
-    df_level = pd.merge(df_bls_all,
-                        df_occupation_level_mapping,
-                        how='left',
-                        left_on='occupation',
-                        right_on='l0')
+    hierarchy = build_hierarchy(df_occupation_level_mapping)
+    df_merge_bls = _get_coded_bls_levels(df_bls_all, hierarchy)
+    _add_student_counts(df_merge_bls, df_record_occupation_level_grouped_by_year_filtered,
+                        hierarchy)
 
-    # Exclude null values from the measureable dataset.
-    df_level = df_level[df_level['l0'].notnull()]
-    # change formate of year to string for joiner
-    df_level['year'] = df_level['year'].apply(str)
-    # when aggregating, define aggregate function by field and ignore categorical fields.
-    df_level = df_level.groupby(['year', 'l1'], sort=True).agg({
-        'number_of_workers_all': 'sum',
-        'median_weekly_earnings_all': 'mean',
-        'number_of_workers_men': 'sum',
-        'median_weekly_earnings_men': 'mean',
-        'number_of_workers_women': 'sum',
-        'median_weekly_earnings_women': 'mean',
-        'occupation_x': 'first',
-        'occupation_y': 'first',
-        'l4': 'first',
-        'l3': 'first',
-        'l2': 'first',
-        'l0': 'first'
-    }).reset_index()
-    # merget the resulting dataframe from
-    # get_df_record_occupation_level_grouped_by_year_filtered(merge_record_df) to the BLS dataset.
-    df_merge_bls = pd.merge(df_level,
-                        df_record_occupation_level_grouped_by_year_filtered,
-                        how='left',
-                        left_on=['l1', 'year'],
-                        right_on=['l1', 'MAJOR1_TERM_TERM_YEAR'])[[
-                                    'year', 'occupation_x', 'l0','l1','l2_x','l3_x','l4_x',                                    
-                                    'number_of_workers_all', 'median_weekly_earnings_all',
-                                    'number_of_workers_men', 'median_weekly_earnings_men',
-                                    'number_of_workers_women', 'median_weekly_earnings_women',
-                                    'number_of_students_all', 'number_of_students_men',
-                                    'number_of_students_women', 'number_of_students_unknown'
-                        ]]
-    # Rename columns for consistency across student record and BLS column naming conventions.
-    new_column_names = {
-        'year': 'year',
-        'occupation_x': 'occupation',
-        'l0': 'l0',
-        'l1': 'l1',
-        'l2_x': 'l2',
-        'l3_x': 'l3',
-        'l4_x': 'l4',
-        'number_of_workers_all': 'number_of_workers_all_sum',
-        'median_weekly_earnings_all': 'median_weekly_earnings_all_mean',
-        'number_of_workers_men': 'number_of_workers_men_sum',
-        'median_weekly_earnings_men': 'median_weekly_earnings_men_mean',
-        'number_of_workers_women': 'number_of_workers_women_sum',
-        'median_weekly_earnings_women': 'median_weekly_earnings_women_mean',
-        'number_of_students_all': 'number_of_students_all_sum',
-        'number_of_students_men': 'number_of_students_men_sum',
-        'number_of_students_women': 'number_of_students_women_sum',
-        'number_of_students_unknown': 'number_of_students_unknown_sum'
-    }
-    df_merge_bls.rename(columns=new_column_names, inplace=True)
-
-    # Create a list of dataframes at the desired BLS aggregate level to feed treemap visuals.
-    df_level_list = []
+    return rollup_level_list(df_merge_bls, hierarchy=hierarchy)
+
+def _get_coded_bls_levels(df_bls_all, hierarchy):
+    """
+        Aggregate the BLS measures of every year and l1 group, with the years as integers
+        and the l1, l2 and l3 groups as node codes of the hierarchy.
+    """
+    # Code occupations as nodes of the hierarchy and years as integers, so the
+    # aggregations and the student join run on integer keys. Occupations outside of the
+    # mapping are excluded from the measureable dataset.
+    l0_codes = code(hierarchy, df_bls_all['occupation'], 'l0')
+    in_mapping = l0_codes >= 0
+    df_level = pd.DataFrame({
+        'year': code_years(df_bls_all['year'])[in_mapping],
+        'l1': ancestors(hierarchy, 'l0', l0_codes[in_mapping])['l1']})
+    for column in ['number_of_workers_all', 'median_weekly_earnings_all',
+                   'number_of_workers_men', 'median_weekly_earnings_men',
+                   'number_of_workers_women', 'median_weekly_earnings_women']:
+        df_level[column] = df_bls_all[column].to_numpy()[in_mapping]
+    # when aggregating, define aggregate function by field.
+    df_level = df_level.groupby(['year', 'l1'], sort=True).agg(
+        number_of_workers_all_sum=('number_of_workers_all', 'sum'),
+        median_weekly_earnings_all_mean=('median_weekly_earnings_all', 'mean'),
+        number_of_workers_men_sum=('number_of_workers_men', 'sum'),
+        median_weekly_earnings_men_mean=('median_weekly_earnings_men', 'mean'),
+        number_of_workers_women_sum=('number_of_workers_women', 'sum'),
+        median_weekly_earnings_women_mean=('median_weekly_earnings_women', 'mean')
+    ).reset_index()
+    ancestor_codes = ancestors(hierarchy, 'l1', df_level['l1'].to_numpy())
+    df_level.insert(2, 'l2', ancestor_codes['l2'])
+    df_level.insert(3, 'l3', ancestor_codes['l3'])
+
+    return df_level
+
+def _add_student_counts(df_level, df_students, hierarchy):
+    """
+        Add the student counts of every year and l1 group of coded BLS level data, in
+        place. Groups without students get missing counts.
+    """
+    # Look up the student counts of every year and l1 group from
+    # get_df_record_occupation_level_grouped_by_year_filtered(merge_record_df), with one
+    # integer key per year and l1 group.
+    n_l1 = len(hierarchy['names']['l1'])
+    student_l1_codes = code(hierarchy, df_students['l1'], 'l1')
+    df_students = df_students[student_l1_codes >= 0]
+    student_keys = code_years(df_students['MAJOR1_TERM_TERM_YEAR']) * n_l1 +\
+        student_l1_codes[student_l1_codes >= 0]
+    positions = pd.Index(student_keys).get_indexer(df_level['year'].to_numpy() * n_l1 +
+                                                   df_level['l1'].to_numpy())
+    for column in STUDENT_COUNT_COLUMNS:
+        df_level[column + '_sum'] = pd.api.extensions.take(df_students[column].to_numpy(),
+                                                           positions, allow_fill=True)
+
+def rollup_level_list(df_merge_bls, hierarchy=None):
+    """
+        Create a list of dataframes at the desired BLS aggregate level to feed treemap
+        visuals, from the BLS and student measures of every year and l1 group.
+        Each level is rolled up from the level below it in a single pass; the existing
+        level frames sum every measure, including the earnings means.
+        :param Dataframe df_merge_bls -> Columns 'year', 'l1', 'l2', 'l3' and
+                                         LEVEL_SUM_COLUMNS, one row per year and l1.
+        :param dict hierarchy -> Hierarchy from occupation_hierarchy when 'year' holds
+                                 integer years and the levels hold node codes, which are
+                                 decoded to labels in the level data.
+        :return List<Dataframe> -> Level data of l1, l2 and l3
+    """
     selected_levels = ['l1','l2','l3']
+    df_rollup = rollup_hierarchy(df_merge_bls,
+                                 levels=selected_levels,
+                                 keys=['year'],
+                                 sum_columns=LEVEL_SUM_COLUMNS)
+    df_level_list = []
     for level in selected_levels:
-
-        df_merge_bls_level = df_merge_bls[[level, 'year',
-                            'number_of_students_all_sum',
-                            'number_of_students_men_sum', 
-                            'number_of_students_women_sum', 
-                            'number_of_students_unknown_sum',
-                            'number_of_workers_all_sum', 
-                            'median_weekly_earnings_all_mean', 
-                            'number_of_workers_men_sum', 
-                            'median_weekly_earnings_men_mean', 
-                            'number_of_workers_women_sum', 
-                            'median_weekly_earnings_women_mean']
-                            ]
-        # Group by year and target level.
-        df_merge_bls_grouped = df_merge_bls_level.groupby(['year', level],\
-                                                            sort=True).sum().reset_index()
-        df_level_list.append(df_merge_bls_grouped)
+        df_level = get_rollup_level(df_rollup, level, keys=['year'])
+        if hierarchy is not None:
+            df_level['year'] = df_level['year'].astype(str)
+            df_level[level] = decode(hierarchy, df_level[level].to_numpy(dtype=np.int64),
+                                     level)
+        df_level_list.append(apply_dtype_policy(df_level))
 
     return df_level_list
 
-def get_df_list_final():
+def code_years(series) -> np.ndarray:
+    """
+        Convert year labels such as '2015' to integers, once per category for
+        categoricals.
+        :param Series series -> Year labels without missing values.
+        :return array -> Integer years
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.categories.astype(int).to_numpy()[series.cat.codes.to_numpy()]
+    return series.astype(int).to_numpy()
+
+@profile_stage
+def get_bls_hierarchy_rollup(levels=None, max_workers=None) -> pd.DataFrame:
+    """
+        Rolls BLS workers and earnings of every year up the occupational hierarchy, from
+        the detailed occupations (l0) to the total (l4). Numbers of workers are summed and
+        median weekly earnings are averaged weighted by the number of workers.
+        :param List<string> levels -> Levels from child to parent, defaults to l0 to l4.
+        :param int max_workers -> Number of processes parsing the year tabs.
+        :return Dataframe -> Tidy parent/child table from hierarchy_rollup.rollup_hierarchy
+    """
+    levels = levels or ['l0', 'l1', 'l2', 'l3', 'l4']
+    df_bls_all = get_bls_year_tabs(BLS_WORKBOOK_2011_TO_2015,
+                                   get_year_tabs(BLS_WORKBOOK_2011_TO_2015),
+                                   max_workers=max_workers, header=0)
+    df_occupation_level_mapping = apply_dtype_policy(
+          read_excel_sheet(BLS_WORKBOOK_2011_TO_2015,
+                           sheet_name=BLS_LEVEL_MAPPING_SHEET, header=0))
+    df_level = pd.merge(df_bls_all,
+                        df_occupation_level_mapping.drop(columns=['occupation']),
+                        how='inner',
+                        left_on='occupation',
+                        right_on='l0')
+
+    return rollup_hierarchy(df_level,
+                            levels=levels,
+                            keys=['year'],
+                            sum_columns=list(EARNINGS_WEIGHT_COLUMNS.values()),
+                            weighted_mean_columns=EARNINGS_WEIGHT_COLUMNS)
+
+@profile_stage
+@memoize_on_files([STUDENT_RECORD_CSV, TERM_TABLE, MAJORS_WORKBOOK, MAJORS_OCCUPATIONS_CSV,
+                   BLS_WORKBOOK_2011_TO_2015], env=MAJOR_ALLOCATION_ENV)
+def get_df_list_final(chunksize=None):
     """
         Combine the following data transformation methods into one dataframe output, 
         for analsis and visualization tasks:
             - get_student_record_df
             - get_df_record_occupation_level_grouped_by_year_filtered(
             - get_df_level_list
+        When chunksize (or BLS_STUDENT_CHUNKSIZE) is set, the student record is streamed
+        in chunks of that many rows instead of being loaded in memory at once.
+        With BLS_BACKEND=duckdb the pipeline runs out-of-core on DuckDB instead
+        (see duckdb_backend), chunksize is then ignored. When BLS_STORE_DIR is set, the
+        years that did not change are served from the incremental store of level_store.
+        BLS_MAJOR_MAPPING and BLS_MAJOR_WEIGHTING select how students are allocated to
+        occupations (see major_allocation).
     """
-
-    df_record_occupation_level_grouped_by_year_filtered, df_occupation_level_mapping =\
-          get_df_record_occupation_level_grouped_by_year_filtered(get_student_record_df())
+    if chunksize is None and os.environ.get('BLS_STUDENT_CHUNKSIZE'):
+        chunksize = int(os.environ['BLS_STUDENT_CHUNKSIZE'])
+
+    if os.environ.get('BLS_STORE_DIR'):
+        return importlib.import_module('level_store').get_df_list_from_store(
+            os.environ['BLS_STORE_DIR'], chunksize=chunksize)
+    if get_pipeline_backend() == 'duckdb':
+        return importlib.import_module('duckdb_backend').get_df_list_final_duckdb()
+
+    if chunksize:
+        df_record_occupation_level_grouped_by_year_filtered, df_occupation_level_mapping =\
+              get_df_record_occupation_level_grouped_by_year_filtered(
+                  None, get_student_occupation_counts_chunked(chunksize))
+    else:
+        # Only the term year of MAJOR1_TERM is used to aggregate the student record.
+        df_record_occupation_level_grouped_by_year_filtered, df_occupation_level_mapping =\
+              get_df_record_occupation_level_grouped_by_year_filtered(
+                  get_student_record_df(term_columns=STUDENT_TERM_VALIDATION_COLUMNS))
     return get_df_level_list(df_record_occupation_level_grouped_by_year_filtered,
                              df_occupation_level_mapping)
 
-def get_bls_data_2002_to_2015():
+@profile_stage
+def get_bls_data_2002_to_2015(max_workers=None):
     """
         Imports and manipulates BLS data from 2002 to 2015.
+        :param int max_workers -> Number of processes parsing the year tabs,
+                                  defaults to BLS_EXCEL_WORKERS.
     """
 
-    # Define target years to import.
-    tabs = ['2015', '2014', '2013', '2012', '2011', '2010', '2009',
-            '2008', '2007', '2006', '2005', '2004', '2003']
+    # Define target years to import, every year tab of the workbook.
+    tabs = get_year_tabs(BLS_WORKBOOK_2002_TO_2015)
 
     # Define column names for BLS dataset.
     columns = ['level',
@@ -498,14 +742,9 @@ def get_bls_data_2002_to_2015():
                 'female_20_years_and_over_py', 
                 'female_20_years_and_over']
 
-    # Loop through each tab representative of one year and append to a single dataframe.
-    df_bls_all = pd.DataFrame()
-    for tab in tabs:
-        df_bls_next = pd.read_excel('./data/bls_cpsaat09_2002_to_2015.xlsx',\
-                                     sheet_name=str(tab), header=3).fillna('Unknown')
-        df_bls_next.columns = columns
-        df_bls_next['year'] = str(tab)
-        df_bls_all = pd.concat([df_bls_all, df_bls_next])
+    # Import each tab representative of one year into a single dataframe.
+    df_bls_all = get_bls_year_tabs(BLS_WORKBOOK_2002_TO_2015, tabs, columns=columns,
+                                   max_workers=max_workers, header=3)
 
     # Filter out empty records labeled as 'Unknown'. This is due to
     # file format leaving gaps in records.
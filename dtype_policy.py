@@ -0,0 +1,87 @@
+"""
+    This module defines the compact dtypes used across the BLS project data pipeline.
+
+    Occupation hierarchy names, major names and years repeat thousands of times, so they
+    are stored as categoricals; 0/1 student flags are stored as int8 and counts as int32.
+    Categoricals are kept through the merges and groupbys (grouping with observed=True)
+    and decoded back to strings at the presentation boundary by decode_categoricals.
+"""
+import numpy as np
+import pandas as pd
+
+# Columns stored as categoricals wherever they appear.
+CATEGORICAL_COLUMNS = ['occupation', 'OCCUPATION', 'MAJOR', 'MAJOR1_DESCR', 'SEX',
+                       'l0', 'l1', 'l2', 'l3', 'l4', 'year', 'MAJOR1_TERM_TERM_YEAR']
+# Integer counts, stored as int8 when they only hold 0/1 flags and as int32 when they fit.
+COUNT_COLUMN_PREFIXES = ('number_of_students_', 'number_of_workers_')
+
+_INT32_INFO = np.iinfo(np.int32)
+
+
+def apply_dtype_policy(df) -> pd.DataFrame:
+    """
+        Convert the columns of a dataframe to the compact dtypes of the project.
+        Columns the policy does not know about, and count columns holding missing
+        values or non integer data, are left unchanged.
+        :param Dataframe df -> Dataframe to convert.
+        :return Dataframe -> Converted dataframe, df itself is not modified
+    """
+    df = df.copy(deep=False)
+    for column in df.columns:
+        series = df[column]
+        if column in CATEGORICAL_COLUMNS:
+            if not isinstance(series.dtype, pd.CategoricalDtype):
+                df[column] = series.astype('category')
+        elif str(column).startswith(COUNT_COLUMN_PREFIXES) and\
+                pd.api.types.is_integer_dtype(series.dtype) and len(series) > 0:
+            # Aggregated counts share the names of the flags, so the range decides.
+            minimum, maximum = series.min(), series.max()
+            if 0 <= minimum and maximum <= 1:
+                df[column] = series.astype('int8')
+            elif _INT32_INFO.min <= minimum and maximum <= _INT32_INFO.max:
+                df[column] = series.astype('int32')
+
+    return df
+
+def fillna_category(series, value) -> pd.Series:
+    """
+        Fill missing values of a series, adding value to the categories of a categorical.
+        :param Series series -> Series to fill.
+        :param string value -> Fill value.
+        :return Series -> Filled series
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype) and value not in series.cat.categories:
+        series = series.cat.add_categories([value])
+    return series.fillna(value)
+
+def decode_categoricals(df) -> pd.DataFrame:
+    """
+        Convert the categorical columns of a dataframe back to object columns, for the
+        label formatting steps that operate on plain strings.
+        :param Dataframe df -> Dataframe to convert.
+        :return Dataframe -> Dataframe without categorical columns
+    """
+    categorical_columns = [column for column in df.columns
+                           if isinstance(df[column].dtype, pd.CategoricalDtype)]
+    if not categorical_columns:
+        return df
+    return df.astype({column: object for column in categorical_columns})
+
+def get_memory_report(df_before, df_after) -> pd.DataFrame:
+    """
+        Compare the memory used by each column of a dataframe before and after a change
+        of dtypes, ex. get_memory_report(df, apply_dtype_policy(df)).
+        :param Dataframe df_before -> Dataframe before the change.
+        :param Dataframe df_after -> Dataframe after the change.
+        :return Dataframe -> dtypes, bytes and reduction ratio by column, with a 'Total' row
+    """
+    report = pd.DataFrame({
+        'dtype_before': df_before.dtypes.astype(str),
+        'dtype_after': df_after.dtypes.astype(str),
+        'bytes_before': df_before.memory_usage(index=False, deep=True),
+        'bytes_after': df_after.memory_usage(index=False, deep=True),
+    })
+    report.loc['Total'] = ['', '', report['bytes_before'].sum(), report['bytes_after'].sum()]
+    report['reduction'] = report['bytes_before'] / report['bytes_after']
+
+    return report
@@ -0,0 +1,232 @@
+"""
+    This module runs the merge-and-aggregate pipeline of the BLS project on DuckDB.
+
+    get_df_list_final chains pandas merges and groupbys that materialize a full frame at
+    every step. Here the same steps are expressed as one SQL query planned and executed
+    by DuckDB, an embedded columnar engine that uses every core and spills to disk when
+    a join or aggregation does not fit in memory. The student record is scanned from
+    ./data/student.record.csv by the engine and never loaded in pandas, so extracts
+    larger than RAM can be processed. The term table, majors and BLS workbooks are small
+    and are read through the pandas path (and its Arrow cache) and registered as views.
+
+    The query returns one row per year and l1 group with the same values and dtypes as
+    get_df_level_list, and the level list is rolled up by the same
+    data_manipulation.rollup_level_list, so both backends give equal results.
+
+    Students are allocated to occupations with the weights of
+    major_allocation.get_allocation_weights, registered as the majors view.
+
+    Select the backend with BLS_BACKEND=duckdb, or call get_df_list_final_duckdb.
+
+    Configuration (environment variables):
+        BLS_DUCKDB_THREADS      -> Number of threads, defaults to the number of cores.
+        BLS_DUCKDB_MEMORY_LIMIT -> Memory limit before spilling to disk, ex. '4GB',
+                                   defaults to 80% of the RAM.
+        BLS_DUCKDB_TEMP_DIR     -> Spill directory, default '<tmp>/bls_duckdb'.
+"""
+import os
+import tempfile
+import importlib
+import pandas as pd
+from workbook_cache import read_excel_sheet
+from dtype_policy import apply_dtype_policy, decode_categoricals
+from stage_profiler import profile_stage
+from major_allocation import get_allocation_weights
+import data_manipulation as dm
+
+DEFAULT_TEMP_DIR = os.path.join(tempfile.gettempdir(), 'bls_duckdb')
+# Strings read as missing values by pandas.read_csv.
+CSV_NULL_STRINGS = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan',
+                    '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a',
+                    'nan', 'null']
+
+# Student counts by occupation and year of MAJOR1_TERM, as get_student_occupation_counts.
+# Students are counted with the weight of their major in each occupation, {count_type} is
+# BIGINT for unit weights and DOUBLE for fractional weights.
+_STUDENT_COUNTS_QUERY = '''
+    WITH record AS (
+        SELECT SEX,
+               COALESCE(MAJOR1_DESCR, 'Undeclared') AS MAJOR1_DESCR,
+               TRY_CAST(MAJOR1_TERM AS DOUBLE) AS MAJOR1_TERM
+        FROM read_csv(?, header = true, all_varchar = true, nullstr = ?)
+    )
+    SELECT majors.OCCUPATION,
+           CAST(CAST(term.TERM_YEAR AS BIGINT) AS VARCHAR) AS MAJOR1_TERM_TERM_YEAR,
+           CAST(SUM(majors.WEIGHT) AS {count_type}) AS number_of_students_all,
+           CAST(SUM(CASE WHEN record.SEX = 'M' THEN majors.WEIGHT ELSE 0 END)
+               AS {count_type}) AS number_of_students_men,
+           CAST(SUM(CASE WHEN record.SEX = 'F' THEN majors.WEIGHT ELSE 0 END)
+               AS {count_type}) AS number_of_students_women,
+           CAST(SUM(CASE WHEN record.SEX IN ('M', 'F') THEN 0 ELSE majors.WEIGHT END)
+               AS {count_type}) AS number_of_students_unknown
+    FROM record
+    LEFT JOIN term ON record.MAJOR1_TERM = CAST(term.TERM_ID AS DOUBLE)
+    LEFT JOIN majors ON record.MAJOR1_DESCR = majors.MAJOR
+    WHERE majors.OCCUPATION IS NOT NULL AND term.TERM_YEAR IS NOT NULL
+    GROUP BY ALL
+'''
+
+# BLS measures joined to the student counts by year and l1, as get_df_level_list before
+# its roll-up. Levels above l1 are the same for every occupation of an l1 group.
+_LEVEL_MERGE_QUERY = '''
+    WITH student_counts AS ({student_counts}),
+    student_levels AS (
+        SELECT counts.MAJOR1_TERM_TERM_YEAR AS year, levels.l1,
+               CAST(SUM(number_of_students_all) AS {count_type})
+                   AS number_of_students_all_sum,
+               CAST(SUM(number_of_students_men) AS {count_type})
+                   AS number_of_students_men_sum,
+               CAST(SUM(number_of_students_women) AS {count_type})
+                   AS number_of_students_women_sum,
+               CAST(SUM(number_of_students_unknown) AS {count_type})
+                   AS number_of_students_unknown_sum
+        FROM student_counts AS counts
+        JOIN (SELECT DISTINCT l4, l3, l2, l1 FROM level_mapping) AS levels
+            ON counts.OCCUPATION = levels.l1
+        WHERE counts.MAJOR1_TERM_TERM_YEAR IN ({years})
+        GROUP BY ALL
+    ),
+    bls_levels AS (
+        SELECT bls.year, mapping.l1,
+               ANY_VALUE(mapping.l2) AS l2,
+               ANY_VALUE(mapping.l3) AS l3,
+               CAST(SUM(bls.number_of_workers_all) AS BIGINT) AS number_of_workers_all_sum,
+               AVG(bls.median_weekly_earnings_all) AS median_weekly_earnings_all_mean,
+               CAST(SUM(bls.number_of_workers_men) AS BIGINT) AS number_of_workers_men_sum,
+               AVG(bls.median_weekly_earnings_men) AS median_weekly_earnings_men_mean,
+               CAST(SUM(bls.number_of_workers_women) AS BIGINT)
+                   AS number_of_workers_women_sum,
+               AVG(bls.median_weekly_earnings_women) AS median_weekly_earnings_women_mean
+        FROM bls
+        JOIN level_mapping AS mapping ON bls.occupation = mapping.l0
+        WHERE mapping.l1 IS NOT NULL
+        GROUP BY ALL
+    )
+    SELECT bls_levels.year, bls_levels.l1, bls_levels.l2, bls_levels.l3,
+           {columns}
+    FROM bls_levels
+    LEFT JOIN student_levels
+        ON bls_levels.l1 = student_levels.l1 AND bls_levels.year = student_levels.year
+    ORDER BY bls_levels.year, bls_levels.l1
+'''
+
+# duckdb, imported on first use since it is an optional dependency.
+_duckdb = {}
+
+
+def _import_duckdb():
+    """
+        Import duckdb on first use.
+    """
+    if 'module' not in _duckdb:
+        try:
+            _duckdb['module'] = importlib.import_module('duckdb')
+        except ImportError as error:
+            raise ImportError('The duckdb backend requires duckdb: pip install duckdb')\
+                from error
+    return _duckdb['module']
+
+def get_connection():
+    """
+        Open an in-memory DuckDB database configured from the environment, spilling to
+        BLS_DUCKDB_TEMP_DIR.
+        :return DuckDBPyConnection -> Connection, to be closed by the caller
+    """
+    duckdb = _import_duckdb()
+    temp_dir = os.environ.get('BLS_DUCKDB_TEMP_DIR') or DEFAULT_TEMP_DIR
+    os.makedirs(temp_dir, exist_ok=True)
+    connection = duckdb.connect(':memory:')
+    connection.execute("SET temp_directory = '" + temp_dir.replace("'", "''") + "'")
+    connection.execute('SET preserve_insertion_order = false')
+    if os.environ.get('BLS_DUCKDB_THREADS'):
+        connection.execute('SET threads = ' + str(int(os.environ['BLS_DUCKDB_THREADS'])))
+    if os.environ.get('BLS_DUCKDB_MEMORY_LIMIT'):
+        connection.execute("SET memory_limit = '" +
+                           os.environ['BLS_DUCKDB_MEMORY_LIMIT'].replace("'", "''") + "'")
+    return connection
+
+def _register_inputs(connection):
+    """
+        Register the term table, the majors and the BLS data read by the pandas path as
+        views of the connection. Categoricals are decoded, so joins compare strings.
+    """
+    df_term = dm.get_term_df()[['TERM_ID', 'TERM_YEAR']]
+    connection.register('term', df_term)
+    connection.register('majors', get_allocation_weights(dm.get_major_mapping(),
+                                                         dm.get_major_weighting()))
+    connection.register('level_mapping', decode_categoricals(
+        read_excel_sheet(dm.BLS_WORKBOOK_2011_TO_2015,
+                         sheet_name=dm.BLS_LEVEL_MAPPING_SHEET, header=0)))
+    connection.register('bls', decode_categoricals(
+        dm.get_bls_year_tabs(dm.BLS_WORKBOOK_2011_TO_2015,
+                             dm.get_year_tabs(dm.BLS_WORKBOOK_2011_TO_2015), header=0)))
+
+def _get_count_type() -> str:
+    """
+        SQL type of the student counts for the major weighting.
+    """
+    return 'BIGINT' if dm.get_major_weighting() == 'unit' else 'DOUBLE'
+
+def _to_numpy_dtypes(df) -> pd.DataFrame:
+    """
+        Convert the nullable integer columns returned by DuckDB to the dtypes of the pandas
+        path: float64 when they hold missing values, int64 otherwise.
+    """
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.api.extensions.ExtensionDtype) and\
+                pd.api.types.is_integer_dtype(df[column].dtype):
+            df[column] = df[column].astype('float64' if df[column].isna().any() else 'int64')
+    return df
+
+@profile_stage
+def get_student_occupation_counts_duckdb() -> pd.DataFrame:
+    """
+        Count the students of ./data/student.record.csv by sex per occupation and
+        MAJOR1_TERM_TERM_YEAR, scanning the file with DuckDB.
+        The result equals get_student_occupation_counts(get_student_record_df()).
+        :return Dataframe -> Student counts by 'OCCUPATION' and 'MAJOR1_TERM_TERM_YEAR'
+    """
+    connection = get_connection()
+    try:
+        _register_inputs(connection)
+        df_counts = connection.execute(
+            _STUDENT_COUNTS_QUERY.format(count_type=_get_count_type()) +
+            ' ORDER BY OCCUPATION, MAJOR1_TERM_TERM_YEAR',
+            [dm.STUDENT_RECORD_CSV, CSV_NULL_STRINGS]).df()
+    finally:
+        connection.close()
+
+    return apply_dtype_policy(_to_numpy_dtypes(df_counts))
+
+@profile_stage
+def get_bls_level_merge_duckdb() -> pd.DataFrame:
+    """
+        Join the BLS measures and the student counts of every year and l1 group in one
+        DuckDB query, from the BLS workbook, the level mapping and the student record.
+        :return Dataframe -> Columns 'year', 'l1', 'l2', 'l3' and
+                             data_manipulation.LEVEL_SUM_COLUMNS, sorted by year and l1
+    """
+    count_type = _get_count_type()
+    query = _LEVEL_MERGE_QUERY.format(
+        student_counts=_STUDENT_COUNTS_QUERY.format(count_type=count_type),
+        count_type=count_type,
+        # Years with wages data in the BLS dataset, other student counts are dropped.
+        years=', '.join("'" + year + "'"
+                        for year in dm.get_year_tabs(dm.BLS_WORKBOOK_2011_TO_2015)),
+        columns=', '.join(dm.LEVEL_SUM_COLUMNS))
+    connection = get_connection()
+    try:
+        _register_inputs(connection)
+        df_merge_bls = connection.execute(
+            query, [dm.STUDENT_RECORD_CSV, CSV_NULL_STRINGS]).df()
+    finally:
+        connection.close()
+
+    return _to_numpy_dtypes(df_merge_bls)
+
+def get_df_list_final_duckdb():
+    """
+        DuckDB backend of data_manipulation.get_df_list_final.
+        :return List<Dataframe> -> Level data of l1, l2 and l3, equal to the pandas path
+    """
+    return dm.rollup_level_list(get_bls_level_merge_duckdb())
@@ -0,0 +1,164 @@
+"""
+    This module tests whether the share of women among students differs from their share
+    in the workforce, for every occupation and year of the BLS level data.
+
+    For each row of the level dataframes of get_df_list_final, the share of women among
+    the students (number_of_students_women_sum / number_of_students_all_sum) is compared
+    with their share among the workers (number_of_workers_women_sum /
+    number_of_workers_all_sum) by a pooled two-proportion z-test, as
+    statsmodels.stats.proportion.proportions_ztest. All the tests of all levels are
+    computed at once with array operations, and the p-values are adjusted for multiple
+    comparisons with the Holm and Benjamini-Hochberg procedures.
+
+    BLS worker counts are in thousands and are scaled by workers_scale before testing.
+    Rows without students or workers are not tested.
+
+    Ex.
+        df_tests = get_gender_share_tests(get_df_list_final())
+        df_tests[df_tests['reject_bh']]
+"""
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+from dtype_policy import apply_dtype_policy
+from occupation_hierarchy import HIERARCHY_LEVELS
+
+# Counts of women and totals compared by the tests.
+STUDENT_SHARE_COLUMNS = ('number_of_students_women_sum', 'number_of_students_all_sum')
+WORKER_SHARE_COLUMNS = ('number_of_workers_women_sum', 'number_of_workers_all_sum')
+# BLS worker counts are in thousands of workers.
+BLS_WORKERS_SCALE = 1000
+DEFAULT_ALPHA = 0.05
+
+
+def two_proportion_ztest(count1, nobs1, count2, nobs2):
+    """
+        Pooled two-sided two-proportion z-tests of arrays of samples.
+        :param array count1 -> Successes of the first samples.
+        :param array nobs1 -> Sizes of the first samples.
+        :param array count2 -> Successes of the second samples.
+        :param array nobs2 -> Sizes of the second samples.
+        :return array, array -> z statistics and p-values, NaN where a sample is empty or
+                                the pooled proportion is 0 or 1
+    """
+    count1, nobs1, count2, nobs2 = (np.asarray(values, dtype=float)
+                                    for values in (count1, nobs1, count2, nobs2))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pooled = (count1 + count2) / (nobs1 + nobs2)
+        standard_error = np.sqrt(pooled * (1 - pooled) * (1 / nobs1 + 1 / nobs2))
+        z = np.where((nobs1 > 0) & (nobs2 > 0) & (standard_error > 0),
+                     (count1 / nobs1 - count2 / nobs2) / standard_error, np.nan)
+    return z, 2 * norm.sf(np.abs(z))
+
+def _sort_by_family(p_values, families):
+    """
+        Order p-values by family and value, with the rank of each p-value in its family
+        and the size of its family. Missing p-values are left out.
+    """
+    valid = np.flatnonzero(~np.isnan(p_values))
+    family_codes = pd.factorize(np.asarray(families)[valid], sort=True)[0]\
+        if families is not None else np.zeros(len(valid), dtype=np.int64)
+    order = valid[np.lexsort((p_values[valid], family_codes))]
+    family_codes = np.sort(family_codes)
+    sizes = np.bincount(family_codes)
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    ranks = np.arange(1, len(order) + 1) - starts[family_codes]
+    return order, family_codes, ranks, sizes[family_codes]
+
+def holm_correction(p_values, families=None) -> np.ndarray:
+    """
+        Holm step-down adjustment of p-values, controlling the family-wise error rate.
+        :param array p_values -> P-values, NaN for tests not performed.
+        :param array families -> Family of each test, ex. the level, defaults to one family.
+        :return array -> Adjusted p-values, NaN for tests not performed
+    """
+    p_values = np.asarray(p_values, dtype=float)
+    order, family_codes, ranks, sizes = _sort_by_family(p_values, families)
+    adjusted = np.minimum((sizes - ranks + 1) * p_values[order], 1)
+    # Running maximum within each family: families are shifted apart so that the
+    # maximum restarts at every family.
+    adjusted = np.maximum.accumulate(adjusted + 2 * family_codes) - 2 * family_codes
+
+    result = np.full(len(p_values), np.nan)
+    result[order] = adjusted
+    return result
+
+def benjamini_hochberg_correction(p_values, families=None) -> np.ndarray:
+    """
+        Benjamini-Hochberg step-up adjustment of p-values, controlling the false
+        discovery rate.
+        :param array p_values -> P-values, NaN for tests not performed.
+        :param array families -> Family of each test, ex. the level, defaults to one family.
+        :return array -> Adjusted p-values, NaN for tests not performed
+    """
+    p_values = np.asarray(p_values, dtype=float)
+    order, family_codes, ranks, sizes = _sort_by_family(p_values, families)
+    adjusted = np.minimum(p_values[order] * sizes / ranks, 1)
+    # Running minimum from the largest p-value of each family down.
+    adjusted = (np.minimum.accumulate((adjusted + 2 * family_codes)[::-1]) -
+                2 * family_codes[::-1])[::-1]
+
+    result = np.full(len(p_values), np.nan)
+    result[order] = adjusted
+    return result
+
+def _get_level_column(df_level):
+    """
+        Name of the hierarchy level column of a level dataframe, ex. 'l1'.
+    """
+    return next(column for column in HIERARCHY_LEVELS if column in df_level.columns)
+
+def _stack_level_data(df_level_list):
+    """
+        Stack the labels and share counts of every level dataframe into flat arrays.
+        :return dict, dict -> Arrays of 'level', 'occupation' and 'year', and arrays of the
+                              counts by column
+    """
+    columns = {'level': [], 'occupation': [], 'year': []}
+    counts = {column: [] for column in STUDENT_SHARE_COLUMNS + WORKER_SHARE_COLUMNS}
+    for df_level in df_level_list:
+        level = _get_level_column(df_level)
+        columns['level'].append(np.full(len(df_level), level, dtype=object))
+        columns['occupation'].append(df_level[level].astype(str).to_numpy())
+        columns['year'].append(df_level['year'].astype(str).to_numpy())
+        for column in counts:
+            counts[column].append(df_level[column].to_numpy(dtype=float))
+    return ({column: np.concatenate(values) for column, values in columns.items()},
+            {column: np.concatenate(values) for column, values in counts.items()})
+
+def get_gender_share_tests(df_level_list, alpha=DEFAULT_ALPHA, workers_scale=BLS_WORKERS_SCALE,
+                           correct_by_level=False) -> pd.DataFrame:
+    """
+        Test the share of women among students against their share among workers for
+        every level, occupation and year at once.
+        :param List<Dataframe> df_level_list -> Level dataframes, ex. from get_df_list_final.
+        :param float alpha -> Significance level of the reject columns.
+        :param int workers_scale -> Workers per unit of the BLS worker counts.
+        :param bool correct_by_level -> Adjust the p-values of each level separately
+                                        instead of over all the tests.
+        :return Dataframe -> One row per level, occupation and year with the columns
+                             'level', 'occupation', 'year', 'student_share', 'worker_share',
+                             'share_difference', 'z', 'p_value', 'p_holm', 'p_bh',
+                             'reject_holm' and 'reject_bh'
+    """
+    columns, counts = _stack_level_data(df_level_list)
+
+    student_women, students = (counts[column] for column in STUDENT_SHARE_COLUMNS)
+    worker_women, workers = (counts[column] * workers_scale
+                             for column in WORKER_SHARE_COLUMNS)
+    z, p_value = two_proportion_ztest(student_women, students, worker_women, workers)
+    families = columns['level'] if correct_by_level else None
+
+    df_tests = pd.DataFrame(columns)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        df_tests['student_share'] = np.where(students > 0, student_women / students, np.nan)
+        df_tests['worker_share'] = np.where(workers > 0, worker_women / workers, np.nan)
+    df_tests['share_difference'] = df_tests['student_share'] - df_tests['worker_share']
+    df_tests['z'] = z
+    df_tests['p_value'] = p_value
+    df_tests['p_holm'] = holm_correction(p_value, families)
+    df_tests['p_bh'] = benjamini_hochberg_correction(p_value, families)
+    df_tests['reject_holm'] = df_tests['p_holm'] <= alpha
+    df_tests['reject_bh'] = df_tests['p_bh'] <= alpha
+
+    return apply_dtype_policy(df_tests)
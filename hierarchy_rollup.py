@@ -0,0 +1,110 @@
+"""
+    This module rolls BLS measures up the occupational hierarchy in one bottom-up pass.
+
+    The finest level is aggregated from the input rows once, and each parent level is
+    aggregated from the already aggregated level below it instead of from the raw rows.
+    Measures are either summed or averaged with weights (ex. median weekly earnings
+    weighted by number of workers). The result is a tidy parent/child table with one row
+    per node of every level, which feeds treemaps of any depth.
+
+    Ex. levels ['l0', 'l1', 'l2'] with keys ['year']:
+        year  level  node                         parent                       measures...
+        2015  l0     Chief executives             Management occupations       ...
+        2015  l1     Management occupations       Management, business, and... ...
+        2015  l2     Management, business, and... None                         ...
+"""
+import numpy as np
+import pandas as pd
+
+ROLLUP_COLUMNS = ['level', 'node', 'parent']
+_WEIGHTED_SUFFIX = '__weighted_sum'
+_WEIGHT_SUFFIX = '__weight'
+
+
+def _aggregate(df, group_columns, sum_columns, weighted_mean_columns):
+    """
+        Aggregate one level: sums of measures, plus the weighted sums and weights of the
+        weighted means so they can be rolled up further.
+    """
+    aggregations = {column: 'sum' for column in sum_columns}
+    for column in weighted_mean_columns:
+        aggregations[column + _WEIGHTED_SUFFIX] = 'sum'
+        aggregations[column + _WEIGHT_SUFFIX] = 'sum'
+    return df.groupby(group_columns, sort=True, observed=True).agg(aggregations).reset_index()
+
+def _get_rollup_rows(df_aggregated, keys, levels, sum_columns, weighted_mean_columns):
+    """
+        Rows of one aggregated level in the rollup layout, with the weighted means
+        computed from their weighted sums and weights. levels starts at the level.
+    """
+    df_level = df_aggregated[keys].copy()
+    df_level['level'] = levels[0]
+    df_level['node'] = df_aggregated[levels[0]].astype(object).to_numpy()
+    df_level['parent'] = df_aggregated[levels[1]].astype(object).to_numpy()\
+        if len(levels) > 1 else None
+    for column in sum_columns:
+        df_level[column] = df_aggregated[column].to_numpy()
+    for column in weighted_mean_columns:
+        weights = df_aggregated[column + _WEIGHT_SUFFIX].to_numpy(dtype=float)
+        weighted_sums = df_aggregated[column + _WEIGHTED_SUFFIX].to_numpy(dtype=float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            df_level[column] = np.where(weights > 0, weighted_sums / weights, np.nan)
+    return df_level
+
+def rollup_hierarchy(df,
+                     levels,
+                     keys=None,
+                     sum_columns=None,
+                     weighted_mean_columns=None) -> pd.DataFrame:
+    """
+        Aggregate measures at every level of a hierarchy in one bottom-up pass.
+        :param Dataframe df -> Rows at the finest level, with one column per level.
+        :param List<string> levels -> Level columns from child to parent,
+                                      ex. ['l0', 'l1', 'l2', 'l3', 'l4'].
+        :param List<string> keys -> Columns aggregated separately, ex. ['year'].
+        :param List<string> sum_columns -> Measures summed up the hierarchy.
+        :param dict<string, string> weighted_mean_columns -> Measures averaged up the
+                                      hierarchy by weight column, ex.
+                                      {'median_weekly_earnings_all': 'number_of_workers_all'}.
+                                      Missing values are left out of the weighted mean.
+        :return Dataframe -> keys, 'level', 'node', 'parent' and measure columns, with one
+                             row per node and key, ordered by level, keys and node
+    """
+    keys = list(keys or [])
+    sum_columns = list(sum_columns or [])
+    weighted_mean_columns = dict(weighted_mean_columns or {})
+
+    df_rows = df[keys + list(levels) + sum_columns].copy()
+    for column, weight_column in weighted_mean_columns.items():
+        values = pd.to_numeric(df[column], errors='coerce')
+        weights = pd.to_numeric(df[weight_column], errors='coerce').where(values.notna(), 0)
+        df_rows[column + _WEIGHTED_SUFFIX] = (values * weights).fillna(0)
+        df_rows[column + _WEIGHT_SUFFIX] = weights.fillna(0)
+
+    df_rollup_levels = []
+    df_aggregated = df_rows
+    for i in range(len(levels)):
+        # Grouping by the node and its ancestors keeps the parent of every node.
+        df_aggregated = _aggregate(df_aggregated, keys + list(levels[i:]),
+                                   sum_columns, weighted_mean_columns)
+        df_rollup_levels.append(_get_rollup_rows(df_aggregated, keys, levels[i:],
+                                                 sum_columns, weighted_mean_columns))
+
+    return pd.concat(df_rollup_levels, ignore_index=True)
+
+def get_rollup_level(df_rollup, level, keys=None) -> pd.DataFrame:
+    """
+        Select one level of a rollup in the layout of the BLS level dataframes,
+        ex. columns ['year', 'l2', measures...].
+        :param Dataframe df_rollup -> Rollup from rollup_hierarchy.
+        :param string level -> Level to select.
+        :param List<string> keys -> Key columns of the rollup.
+        :return Dataframe -> Level data
+    """
+    keys = list(keys or [])
+    df_level = df_rollup[df_rollup['level'] == level]
+    measures = [column for column in df_level.columns
+                if column not in keys + ROLLUP_COLUMNS]
+    df_level = df_level[keys + ['node'] + measures].rename(columns={'node': level})
+
+    return df_level.reset_index(drop=True)
@@ -0,0 +1,167 @@
+"""
+    This module benchmarks the import time of the BLS project modules.
+
+    Each module is imported in a fresh interpreter with python -X importtime. The report
+    gives the cold import time of the module, the time it adds on top of pandas and
+    numpy (imported beforehand, so only the project code and its other dependencies
+    are timed) and the third-party packages it loads beyond pandas and numpy.
+    The data pipeline is expected to load none; visualization dependencies such as
+    Bokeh are imported lazily by the functions that render treemaps.
+
+    Run -> python import_benchmark.py data_manipulation refactored_notebook --max-ms 100
+    The run fails when a module loads extra third-party packages or when the time it
+    adds on top of pandas and numpy exceeds --max-ms.
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+import pandas as pd
+
+DATA_PATH_MODULES = ['data_manipulation', 'refactored_notebook']
+BASE_PACKAGES = ['numpy', 'pandas']
+
+_PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Lists the top level third-party packages loaded by an import, beyond the preloaded ones.
+_PACKAGES_SCRIPT = '''
+import sys, json, site
+import {base}
+before = set(sys.modules)
+import {module}
+site_dirs = tuple(site.getsitepackages() + [site.getusersitepackages()])
+packages = set()
+for name in set(sys.modules) - before:
+    path = getattr(sys.modules[name], '__file__', None) or ''
+    if path.startswith(site_dirs):
+        packages.add(name.split('.')[0])
+print(json.dumps(sorted(packages)))
+'''
+
+
+def parse_importtime(output) -> pd.DataFrame:
+    """
+        Parse the report of python -X importtime.
+        :param string output -> Standard error of the interpreter.
+        :return Dataframe -> One row per imported module with the columns 'module',
+                             'depth', 'self_us' and 'cumulative_us', in import order
+    """
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        stripped = name.lstrip(' ')
+        rows.append({'module': stripped,
+                     'depth': (len(name) - len(stripped) - 1) // 2,
+                     'self_us': int(fields[0]),
+                     'cumulative_us': int(fields[1])})
+
+    return pd.DataFrame(rows, columns=['module', 'depth', 'self_us', 'cumulative_us'])
+
+def measure_import_time(module_name, preload=(), runs=5) -> pd.DataFrame:
+    """
+        Import a module in fresh interpreters and keep the fastest run.
+        :param string module_name -> Module to import.
+        :param List<string> preload -> Modules imported beforehand, left out of the timings.
+        :param int runs -> Number of interpreters started.
+        :return Dataframe -> Parsed importtime report of the fastest run
+    """
+    if runs < 1:
+        raise ValueError('At least one run is needed to measure an import, got ' + str(runs))
+    statement = 'import ' + module_name
+    if preload:
+        statement = 'import ' + ', '.join(preload) + '; ' + statement
+    reports = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                                cwd=_PROJECT_DIR, capture_output=True, text=True, check=True)
+        reports.append(parse_importtime(result.stderr))
+
+    return min(reports, key=lambda report: report.loc[report['module'] == module_name,
+                                                       'cumulative_us'].iloc[0])
+
+def get_import_subtree(report, module_name) -> pd.DataFrame:
+    """
+        Select the imports made by a module from an importtime report. importtime lists
+        the imports of a module before the module itself.
+        :param Dataframe report -> Report from parse_importtime.
+        :param string module_name -> Imported module.
+        :return Dataframe -> Rows of the module and of the imports it made
+    """
+    position = report.index[report['module'] == module_name][0]
+    top_level = report.index[(report['depth'] == 0) & (report.index < position)]
+    start = top_level[-1] + 1 if len(top_level) else 0
+
+    return report.loc[start:position]
+
+def get_imported_packages(module_name, preload=None) -> list:
+    """
+        List the third-party packages loaded by importing a module.
+        :param string module_name -> Module to import.
+        :param List<string> preload -> Packages imported beforehand and left out of the
+                                       list, defaults to BASE_PACKAGES.
+        :return List<string> -> Top level package names
+    """
+    preload = BASE_PACKAGES if preload is None else preload
+    script = _PACKAGES_SCRIPT.format(base=', '.join(preload or ['sys']), module=module_name)
+    result = subprocess.run([sys.executable, '-c', script], cwd=_PROJECT_DIR,
+                            capture_output=True, text=True, check=True)
+
+    return json.loads(result.stdout)
+
+def benchmark_imports(module_names, runs=5, top=5) -> pd.DataFrame:
+    """
+        Benchmark the import of project modules.
+        :param List<string> module_names -> Modules to benchmark.
+        :param int runs -> Interpreters started per measure, the fastest run is kept.
+        :param int top -> Number of slowest imports listed per module.
+        :return Dataframe -> One row per module with 'cold_ms' (import in a fresh
+                             interpreter), 'overhead_ms' (import after pandas and
+                             numpy), 'extra_packages' and 'slowest' (module: self ms)
+    """
+    rows = []
+    for module_name in module_names:
+        cold = measure_import_time(module_name, runs=runs)
+        warm = measure_import_time(module_name, preload=BASE_PACKAGES, runs=runs)
+        slowest = get_import_subtree(warm, module_name).nlargest(top, 'self_us')
+        rows.append({
+            'module': module_name,
+            'cold_ms': cold.loc[cold['module'] == module_name, 'cumulative_us'].iloc[0] / 1000,
+            'overhead_ms': warm.loc[warm['module'] == module_name,
+                                    'cumulative_us'].iloc[0] / 1000,
+            'extra_packages': get_imported_packages(module_name),
+            'slowest': ', '.join(name + ': ' + str(round(self_us / 1000, 1)) for name, self_us
+                                 in zip(slowest['module'], slowest['self_us'])),
+        })
+
+    return pd.DataFrame(rows).set_index('module')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('modules', type=str, nargs='*', default=DATA_PATH_MODULES,
+                        help='Modules to benchmark, defaults to the data path modules.')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='Interpreters started per measure, the fastest run is kept.')
+    parser.add_argument('--top', type=int, default=5,
+                        help='Number of slowest imports listed per module.')
+    parser.add_argument('--max-ms', type=float, default=None,
+                        help='Budget of the import time added on top of pandas and numpy.')
+    args = parser.parse_args()
+
+    df_report = benchmark_imports(args.modules, runs=args.runs, top=args.top)
+    print(df_report.to_string())
+
+    failures = []
+    for module, row in df_report.iterrows():
+        if row['extra_packages']:
+            failures.append(module + ' imports ' + ', '.join(row['extra_packages']))
+        if args.max_ms is not None and row['overhead_ms'] > args.max_ms:
+            failures.append(f"{module} adds {row['overhead_ms']:.1f} ms to the import of pandas "
+                            f"and numpy, over the budget of {args.max_ms} ms")
+    for failure in failures:
+        print('FAIL:', failure)
+    sys.exit(1 if failures else 0)
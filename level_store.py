@@ -0,0 +1,311 @@
+"""
+    This module materializes the level data of get_df_list_final in an incremental store.
+
+    The level data is partitioned by year and level. Each year is computed from its BLS
+    year tab, the level mapping and the student counts of that year, so a partition is
+    only recomputed when one of these inputs changed: adding a year tab to the BLS
+    workbook computes the new year and serves the other years from the store.
+
+    Student counts by occupation and year are stored as well. When records are appended
+    to ./data/student.record.csv, only the appended bytes are read and counted, and the
+    counts are added to the stored ones; the years whose counts changed are recomputed.
+    Any other change of the student record, the term table, the major mapping or its
+    weighting counts the whole student record again.
+
+    Run -> python level_store.py
+    Prints the years recomputed and served from the store.
+
+    Configuration (environment variables):
+        BLS_STORE_DIR -> Store directory, default './.bls_store'. When set,
+                         get_df_list_final serves the level data from the store.
+"""
+import os
+import json
+import hashlib
+import argparse
+import importlib
+import pandas as pd
+from workbook_cache import read_excel_sheet, read_excel_sheets, get_file_fingerprint
+from dtype_policy import decode_categoricals, apply_dtype_policy
+from pipeline_cache import get_memo_key, read_pickle, write_pickle
+from stage_profiler import profile_stage
+import data_manipulation as dm
+
+DEFAULT_STORE_DIR = './.bls_store'
+# Version of the stored data, bumped when the computation of the partitions changes.
+STORE_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+STUDENT_COUNTS_FILE = 'student_counts.pkl'
+LEVELS = ['l1', 'l2', 'l3']
+DEFAULT_APPEND_CHUNKSIZE = 1000000
+
+
+def get_store_dir():
+    """
+        Get the store directory from the environment.
+        :return string -> Store directory.
+    """
+    return os.environ.get('BLS_STORE_DIR') or DEFAULT_STORE_DIR
+
+def _get_partition_path(store_dir, level, year):
+    """
+        Path of the partition of one level and year.
+    """
+    return os.path.join(store_dir, level + '-' + str(year) + '.pkl')
+
+def read_manifest(store_dir=None) -> dict:
+    """
+        Read the manifest of the store, describing the inputs of the stored data.
+        :param string store_dir -> Store directory, defaults to BLS_STORE_DIR.
+        :return dict -> Manifest, empty when the store is missing or of another version
+    """
+    path = os.path.join(store_dir or get_store_dir(), MANIFEST_FILE)
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    return manifest if manifest.get('version') == STORE_VERSION else {}
+
+def _write_manifest(store_dir, manifest):
+    """
+        Write the manifest last, once the data it describes is stored.
+    """
+    path = os.path.join(store_dir, MANIFEST_FILE)
+    tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def _hash_file(filepath, prefix_size=None):
+    """
+        Hash a file, and its first prefix_size bytes in the same pass.
+        :return string, string -> Digest of the prefix (None without prefix_size) and of
+                                  the whole file
+    """
+    hasher = hashlib.sha256()
+    prefix_digest = None
+    position = 0
+    with open(filepath, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            if prefix_size is not None and position <= prefix_size < position + len(block):
+                hasher.update(block[:prefix_size - position])
+                prefix_digest = hasher.hexdigest()
+                hasher.update(block[prefix_size - position:])
+            else:
+                hasher.update(block)
+            position += len(block)
+    if prefix_size is not None and prefix_size == position:
+        prefix_digest = hasher.hexdigest()
+    return prefix_digest, hasher.hexdigest()
+
+def _ends_with_newline(filepath, size):
+    """
+        Check that the first size bytes of a file end a line, so appended bytes start
+        with a new record.
+    """
+    if size == 0:
+        return False
+    with open(filepath, 'rb') as file:
+        file.seek(size - 1)
+        return file.read(1) == b'\n'
+
+def _count_all_students(chunksize):
+    """
+        Count the whole student record with the backend and chunk size of
+        get_df_list_final.
+    """
+    if dm.get_pipeline_backend() == 'duckdb':
+        return importlib.import_module('duckdb_backend').get_student_occupation_counts_duckdb()
+    if chunksize:
+        return dm.get_student_occupation_counts_chunked(chunksize)
+    return dm.get_student_occupation_counts(
+        dm.get_student_record_df(term_columns=dm.STUDENT_TERM_VALIDATION_COLUMNS))
+
+def _count_appended_students(offset, chunksize):
+    """
+        Count the student records written after the first offset bytes of the file.
+        :return List<Dataframe> -> Counts of every chunk of appended records
+    """
+    columns = list(pd.read_csv(dm.STUDENT_RECORD_CSV, nrows=0).columns)
+    df_term = dm.get_term_df()
+    df_partial_counts = []
+    with open(dm.STUDENT_RECORD_CSV, 'rb') as file:
+        file.seek(offset)
+        try:
+            for df_record_chunk in pd.read_csv(file, header=None, names=columns,
+                                               dtype=dm.STUDENT_RECORD_DTYPES,
+                                               chunksize=chunksize):
+                merge_record_chunk = dm.enrich_student_record(
+                    df_record_chunk, df_term, term_columns=dm.STUDENT_TERM_VALIDATION_COLUMNS)
+                df_partial_counts.append(dm.get_student_occupation_counts(merge_record_chunk))
+        except pd.errors.EmptyDataError:
+            pass
+    return df_partial_counts
+
+@profile_stage
+def update_student_counts(store_dir, manifest, chunksize=None):
+    """
+        Bring the stored student counts up to date with the student record.
+        :param string store_dir -> Store directory.
+        :param dict manifest -> Manifest of the store, updated in place.
+        :param int chunksize -> Number of student records read at a time.
+        :return Dataframe, string -> Student counts by 'OCCUPATION' and
+                                     'MAJOR1_TERM_TERM_YEAR', and how they were updated:
+                                     'unchanged', 'append' or 'full'
+    """
+    counts_path = os.path.join(store_dir, STUDENT_COUNTS_FILE)
+    stored = manifest.get('student', {})
+    source, weighting = dm.get_major_mapping_source(), dm.get_major_weighting()
+    inputs = [get_file_fingerprint(dm.TERM_TABLE),
+              get_file_fingerprint(dm.MAJOR_MAPPING_FILES[source]), source, weighting]
+    size = os.path.getsize(dm.STUDENT_RECORD_CSV)
+    df_counts = read_pickle(counts_path) if stored.get('inputs') == inputs else None
+
+    mode = 'full'
+    if df_counts is not None and stored.get('size', 0) <= size:
+        prefix_digest, digest = _hash_file(dm.STUDENT_RECORD_CSV, stored['size'])
+        if digest == stored.get('sha256'):
+            mode = 'unchanged'
+        elif prefix_digest == stored.get('sha256') and\
+                _ends_with_newline(dm.STUDENT_RECORD_CSV, stored['size']):
+            mode = 'append'
+    else:
+        digest = _hash_file(dm.STUDENT_RECORD_CSV)[1]
+
+    if mode == 'append':
+        df_counts = dm.add_student_occupation_counts(
+            [df_counts] + _count_appended_students(stored['size'],
+                                                   chunksize or DEFAULT_APPEND_CHUNKSIZE))
+    elif mode == 'full':
+        df_counts = _count_all_students(chunksize)
+    if mode != 'unchanged':
+        write_pickle(counts_path, df_counts)
+        manifest['student'] = {'inputs': inputs, 'size': size, 'sha256': digest}
+
+    return df_counts, mode
+
+def _get_partition_digests(years, df_students):
+    """
+        Digest of the inputs of the partitions of every year: its BLS tab, the level
+        mapping and its student counts.
+    """
+    df_students_by_year = decode_categoricals(df_students)
+    df_bls_tabs = read_excel_sheets(dm.BLS_WORKBOOK_2011_TO_2015, years, header=0)
+    mapping_digest = get_memo_key('level_mapping', [], (read_excel_sheet(
+        dm.BLS_WORKBOOK_2011_TO_2015, sheet_name=dm.BLS_LEVEL_MAPPING_SHEET, header=0),), {})
+
+    digests = {}
+    for year in years:
+        df_students_year = df_students_by_year[
+            df_students_by_year['MAJOR1_TERM_TERM_YEAR'] == year].reset_index(drop=True)
+        digests[year] = get_memo_key('partition', [],
+                                     (df_bls_tabs[year], mapping_digest, df_students_year), {})
+    return digests
+
+def _write_partitions(store_dir, df_level_list, years):
+    """
+        Store the partitions of the years of the level data.
+    """
+    for level, df_level in zip(LEVELS, df_level_list):
+        for year in years:
+            write_pickle(_get_partition_path(store_dir, level, year),
+                         df_level[df_level['year'] == year].reset_index(drop=True))
+
+def _remove_partitions(store_dir, years):
+    """
+        Remove the partitions of the years from the store.
+    """
+    for year in years:
+        for level in LEVELS:
+            path = _get_partition_path(store_dir, level, year)
+            if os.path.exists(path):
+                os.remove(path)
+
+@profile_stage
+def update_level_store(store_dir=None, chunksize=None) -> dict:
+    """
+        Recompute the partitions of the years whose BLS tab, level mapping or student
+        counts changed since they were stored, and drop the years no longer in the
+        BLS workbook.
+        :param string store_dir -> Store directory, defaults to BLS_STORE_DIR.
+        :param int chunksize -> Number of student records read at a time.
+        :return dict -> 'years' of the store, 'recomputed' and 'served' years, 'removed'
+                        years and 'student_update' ('unchanged', 'append' or 'full')
+    """
+    store_dir = store_dir or get_store_dir()
+    os.makedirs(store_dir, exist_ok=True)
+    manifest = read_manifest(store_dir)
+    manifest['version'] = STORE_VERSION
+    df_counts, student_update = update_student_counts(store_dir, manifest, chunksize)
+
+    years = sorted(dm.get_year_tabs(dm.BLS_WORKBOOK_2011_TO_2015))
+    df_students, df_occupation_level_mapping =\
+        dm.get_df_record_occupation_level_grouped_by_year_filtered(None, df_counts)
+
+    # A partition is up to date when the digest of its inputs is unchanged.
+    stored_digests = manifest.get('partitions', {})
+    digests = _get_partition_digests(years, df_students)
+    recomputed = [year for year in years if stored_digests.get(year) != digests[year] or
+                  not all(os.path.exists(_get_partition_path(store_dir, level, year))
+                          for level in LEVELS)]
+
+    if recomputed:
+        _write_partitions(store_dir, dm.get_df_level_list(df_students,
+                                                          df_occupation_level_mapping,
+                                                          years=recomputed), recomputed)
+
+    removed = sorted(set(stored_digests) - set(years))
+    _remove_partitions(store_dir, removed)
+    manifest['partitions'] = digests
+    _write_manifest(store_dir, manifest)
+
+    return {'years': years,
+            'recomputed': recomputed,
+            'served': [year for year in years if year not in recomputed],
+            'removed': removed,
+            'student_update': student_update}
+
+def read_level_store(store_dir=None, years=None) -> list:
+    """
+        Read the level data from the store.
+        :param string store_dir -> Store directory, defaults to BLS_STORE_DIR.
+        :param List<string> years -> Years to read, defaults to every stored year.
+        :return List<Dataframe> -> Level data of l1, l2 and l3, as get_df_list_final
+    """
+    store_dir = store_dir or get_store_dir()
+    if years is None:
+        years = read_manifest(store_dir).get('partitions', {})
+    years = sorted(str(year) for year in years)
+    df_level_list = []
+    for level in LEVELS:
+        # Partitions have their own categories, so they are merged as plain strings.
+        df_partitions = [decode_categoricals(read_pickle(_get_partition_path(store_dir,
+                                                                              level, year)))
+                         for year in years]
+        df_level_list.append(apply_dtype_policy(pd.concat(df_partitions, ignore_index=True)))
+
+    return df_level_list
+
+def get_df_list_from_store(store_dir=None, chunksize=None) -> list:
+    """
+        Update the store and read the level data from it, equal to the result of
+        get_df_list_final.
+        :param string store_dir -> Store directory, defaults to BLS_STORE_DIR.
+        :param int chunksize -> Number of student records read at a time.
+        :return List<Dataframe> -> Level data of l1, l2 and l3
+    """
+    update_level_store(store_dir, chunksize=chunksize)
+    return read_level_store(store_dir)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--store-dir', type=str, default=None,
+                        help='Store directory, defaults to BLS_STORE_DIR or ./.bls_store.')
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help='Number of student records read at a time.')
+    args = parser.parse_args()
+
+    report = update_level_store(args.store_dir, chunksize=args.chunksize)
+    for key, value in report.items():
+        print(key + ':', value if isinstance(value, str) else ', '.join(value) or '-')
@@ -0,0 +1,212 @@
+"""
+    This module computes longitudinal analytics of the BLS 2002 to 2015 data.
+
+    get_bls_data_2002_to_2015 returns one row per occupation and year. The data is pivoted
+    once into a dense occupation x year x measure array, the female shares are added as
+    derived measures, and every metric is computed for all the occupations of every level
+    (L0 to L3), years and measures at once by array operations along the year axis:
+        value          -> Measure of the year.
+        yoy_change     -> Change from the previous year.
+        yoy_pct_change -> Relative change from the previous year.
+        cagr           -> Compound annual growth rate since the first year of the
+                          occupation.
+        rolling_mean   -> Mean of the last ROLLING_WINDOW years, missing until the window
+                          is full.
+        trend          -> Least squares slope over all the years of the occupation, per
+                          year, ex. the trend of the female share in share points per year.
+
+    The metrics are returned as one long frame, queried without loops over occupations
+    and years, ex.
+        df_trends = get_bls_trends()
+        df_trends.query("level == 'L1' and measure == 'female_share_16_years_and_over'")
+        get_trend_view(df_trends, 'female_share_16_years_and_over', 'yoy_change', 'L2')
+"""
+import numpy as np
+import pandas as pd
+from dtype_policy import apply_dtype_policy
+from pipeline_cache import memoize_on_files
+from stage_profiler import profile_stage
+import data_manipulation as dm
+
+# Measures of the BLS 2002 to 2015 data, in thousands of workers.
+BLS_MEASURE_COLUMNS = ['total_16_years_and_over_py', 'total_16_years_and_over',
+                       'male_16_years_and_over_py', 'male_16_years_and_over',
+                       'male_20_years_and_over_py', 'male_20_years_and_over',
+                       'female_16_years_and_over_py', 'female_16_years_and_over',
+                       'female_20_years_and_over_py', 'female_20_years_and_over']
+# Female shares derived from the measures: numerator and columns of the denominator.
+FEMALE_SHARE_MEASURES = {
+    'female_share_16_years_and_over': ('female_16_years_and_over',
+                                       ['total_16_years_and_over']),
+    'female_share_20_years_and_over': ('female_20_years_and_over',
+                                       ['male_20_years_and_over', 'female_20_years_and_over'])}
+TREND_METRICS = ['value', 'yoy_change', 'yoy_pct_change', 'cagr', 'rolling_mean', 'trend']
+SERIES_COLUMNS = ['level', 'occupation', 'l3', 'l2', 'l1', 'l0']
+ROLLING_WINDOW = 3
+
+
+def build_measure_cube(df_bls, measures=None):
+    """
+        Pivot the BLS data into a dense occupation x year x measure array.
+        :param Dataframe df_bls -> Data from get_bls_data_2002_to_2015.
+        :param List<string> measures -> Measure columns, defaults to BLS_MEASURE_COLUMNS.
+        :return array, Dataframe, array -> Values with NaN for missing data, the
+                                           SERIES_COLUMNS of every occupation and the
+                                           sorted years
+    """
+    measures = list(measures or BLS_MEASURE_COLUMNS)
+    # An occupation is identified by its level and name, names repeat across levels.
+    df_keys = df_bls[['level', 'occupation']].astype(str)
+    series_codes, series_keys = pd.factorize(pd.MultiIndex.from_frame(df_keys), sort=True)
+    year_codes, years = pd.factorize(df_bls['year'].astype(str).astype(int), sort=True)
+
+    cube = np.full((len(series_keys), len(years), len(measures)), np.nan)
+    cube[series_codes, year_codes] = df_bls[measures].apply(
+        pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+
+    # Hierarchy columns of an occupation, from its most recent year.
+    latest = np.lexsort((year_codes, series_codes))
+    latest = latest[np.r_[series_codes[latest][1:] != series_codes[latest][:-1], True]]
+    df_series = pd.DataFrame(
+        {column: df_bls[column].astype(str).to_numpy()[latest] for column in SERIES_COLUMNS})
+
+    return cube, df_series, np.asarray(years)
+
+def add_female_shares(cube, measures):
+    """
+        Append the FEMALE_SHARE_MEASURES to the measure axis of a cube.
+        :param array cube -> Cube from build_measure_cube.
+        :param List<string> measures -> Measures of the cube.
+        :return array, List<string> -> Cube and measures with the female shares
+    """
+    positions = {measure: i for i, measure in enumerate(measures)}
+    shares = []
+    for numerator, denominators in FEMALE_SHARE_MEASURES.values():
+        denominator = cube[:, :, [positions[column] for column in denominators]].sum(axis=2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            shares.append(np.where(denominator > 0,
+                                   cube[:, :, positions[numerator]] / denominator, np.nan))
+
+    return np.concatenate([cube, np.stack(shares, axis=2)], axis=2),\
+        list(measures) + list(FEMALE_SHARE_MEASURES)
+
+def _get_previous_values(cube, years):
+    """
+        Values of the previous year along the year axis, missing after a gap in the years.
+    """
+    previous = np.concatenate([np.full_like(cube[:, :1], np.nan), cube[:, :-1]], axis=1)
+    consecutive = np.r_[False, np.diff(years) == 1]
+    previous[:, ~consecutive] = np.nan
+    return previous
+
+def _get_rolling_means(values, present, years, window):
+    """
+        Means of the last window years, missing until the window is full, from
+        cumulative sums of the values and of the years with data.
+    """
+    n_years = values.shape[1]
+    cumulative = np.concatenate([np.zeros_like(values[:, :1]), np.cumsum(values, axis=1)],
+                                axis=1)
+    counts = np.concatenate([np.zeros_like(values[:, :1]),
+                             np.cumsum(present, axis=1, dtype=float)], axis=1)
+    start = np.maximum(np.arange(1, n_years + 1) - window, 0)
+    window_counts = counts[:, 1:] - counts[:, start]
+    window_sums = cumulative[:, 1:] - cumulative[:, start]
+    full_window = (window_counts == window) &\
+        (years - years[np.minimum(start, n_years - 1)] == window - 1)[None, :, None]
+    return np.where(full_window, window_sums / window, np.nan)
+
+def _get_trend_slopes(values, present, years):
+    """
+        Least squares slopes against the year over the years with data, shaped as the
+        cube without the year axis.
+    """
+    x = np.where(present, years[None, :, None], 0.0)
+    n = present.sum(axis=1)
+    sum_x, sum_y = x.sum(axis=1), values.sum(axis=1)
+    sum_xx, sum_xy = (x * x).sum(axis=1), (x * values).sum(axis=1)
+    denominator = n * sum_xx - sum_x * sum_x
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where((n > 1) & (denominator != 0),
+                        (n * sum_xy - sum_x * sum_y) / denominator, np.nan)
+
+def get_trend_metrics(cube, years, window=ROLLING_WINDOW) -> dict:
+    """
+        Compute the TREND_METRICS of every occupation, year and measure of a cube.
+        Changes are only computed between consecutive years.
+        :param array cube -> Cube from build_measure_cube.
+        :param array years -> Years of the year axis, sorted.
+        :param int window -> Number of years of the rolling mean.
+        :return dict<string, array> -> Arrays shaped as the cube, by metric
+    """
+    years = np.asarray(years, dtype=float)
+    present = ~np.isnan(cube)
+    values = np.where(present, cube, 0.0)
+    previous = _get_previous_values(cube, years)
+
+    # First year with data of every occupation and measure.
+    first = np.argmax(present, axis=1)
+    base = np.take_along_axis(cube, first[:, None], axis=1)
+    elapsed = years[None, :, None] - years[first][:, None]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        metrics = {
+            'value': cube,
+            'yoy_change': cube - previous,
+            'yoy_pct_change': np.where(previous != 0, cube / previous - 1, np.nan),
+            'cagr': np.where((elapsed > 0) & (base > 0) & (cube > 0),
+                             np.power(cube / base, 1 / np.where(elapsed > 0, elapsed, 1)) - 1,
+                             np.nan),
+            'rolling_mean': _get_rolling_means(values, present, years, window),
+            'trend': np.broadcast_to(_get_trend_slopes(values, present, years)[:, None, :],
+                                     cube.shape)}
+
+    return metrics
+
+@profile_stage
+def get_trend_frame(df_bls, window=ROLLING_WINDOW) -> pd.DataFrame:
+    """
+        Compute the longitudinal analytics of BLS data as a long frame.
+        :param Dataframe df_bls -> Data from get_bls_data_2002_to_2015.
+        :param int window -> Number of years of the rolling mean.
+        :return Dataframe -> SERIES_COLUMNS, 'year', 'measure' and TREND_METRICS, one row
+                             per occupation, year and measure with a value
+    """
+    cube, df_series, years = build_measure_cube(df_bls)
+    cube, measures = add_female_shares(cube, BLS_MEASURE_COLUMNS)
+    metrics = get_trend_metrics(cube, years, window=window)
+
+    series_codes, year_codes, measure_codes = np.nonzero(~np.isnan(cube))
+    df_trends = df_series.iloc[series_codes].reset_index(drop=True)
+    df_trends['year'] = pd.Categorical(years.astype(str)[year_codes],
+                                       categories=years.astype(str))
+    df_trends['measure'] = pd.Categorical.from_codes(measure_codes, categories=measures)
+    for metric in TREND_METRICS:
+        df_trends[metric] = metrics[metric][series_codes, year_codes, measure_codes]
+
+    return apply_dtype_policy(df_trends)
+
+@memoize_on_files([dm.BLS_WORKBOOK_2002_TO_2015])
+def get_bls_trends(window=ROLLING_WINDOW) -> pd.DataFrame:
+    """
+        Longitudinal analytics of every occupation of ./data/bls_cpsaat09_2002_to_2015.xlsx.
+        :param int window -> Number of years of the rolling mean.
+        :return Dataframe -> Trends from get_trend_frame
+    """
+    return get_trend_frame(dm.get_bls_data_2002_to_2015(), window=window)
+
+def get_trend_view(df_trends, measure, metric='value', level=None) -> pd.DataFrame:
+    """
+        Pivot one metric of one measure to an occupation x year view.
+        :param Dataframe df_trends -> Trends from get_trend_frame.
+        :param string measure -> Measure, ex. 'female_share_16_years_and_over'.
+        :param string metric -> One of TREND_METRICS.
+        :param string level -> Level of the occupations, ex. 'L1', defaults to all levels.
+        :return Dataframe -> Metric indexed by 'level' and 'occupation', one column per year
+    """
+    selected = df_trends['measure'] == measure
+    if level is not None:
+        selected &= df_trends['level'] == level
+    return df_trends[selected].pivot_table(index=['level', 'occupation'], columns='year',
+                                           values=metric, aggfunc='first', observed=True,
+                                           dropna=False)
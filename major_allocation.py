@@ -0,0 +1,173 @@
+"""
+    This module allocates student counts from majors to BLS occupations.
+
+    Students are first counted by major, year of MAJOR1_TERM and sex, then the counts
+    are multiplied by a sparse major x occupation weight matrix built from a major
+    mapping (the 'majors' sheet of ./data/majors.xlsx or
+    ./data/majors_occupations_map.csv). Student rows are never copied per occupation.
+
+    Weightings:
+        unit       -> A student counts once in every occupation of their major, as a
+                      row-level merge with the mapping.
+        fractional -> A student is split across the occupations of their major, by the
+                      WEIGHT column of the mapping when it has one and evenly otherwise,
+                      so the weights of a major add up to 1.
+
+    Ex.
+        df_weights = get_allocation_weights(df_mapping, weighting='fractional')
+        df_major_counts = count_students_by_major(merge_record_df, df_weights['MAJOR'])
+        df_counts = allocate_student_counts(df_major_counts, df_weights)
+"""
+import importlib
+import numpy as np
+import pandas as pd
+
+MAJOR_WEIGHTINGS = ('unit', 'fractional')
+ALLOCATION_COUNT_COLUMNS = ['number_of_students_all', 'number_of_students_men',
+                            'number_of_students_women', 'number_of_students_unknown']
+
+# scipy.sparse, imported on first use so the data pipeline only loads pandas and numpy.
+_sparse = {}
+
+
+def _import_sparse():
+    """
+        Import scipy.sparse on first use.
+    """
+    if 'module' not in _sparse:
+        _sparse['module'] = importlib.import_module('scipy.sparse')
+    return _sparse['module']
+
+def get_allocation_weights(df_mapping, weighting='unit') -> pd.DataFrame:
+    """
+        Get the weight of every major -> occupation pair of a major mapping.
+        Pairs listed several times are counted several times, as by a merge.
+        :param Dataframe df_mapping -> Columns 'MAJOR', 'OCCUPATION' and optionally
+                                       'WEIGHT'.
+        :param string weighting -> 'unit' or 'fractional'.
+        :return Dataframe -> Columns 'MAJOR', 'OCCUPATION' and 'WEIGHT', one row per pair
+    """
+    if weighting not in MAJOR_WEIGHTINGS:
+        raise ValueError('Unknown major weighting: ' + str(weighting))
+    df_mapping = df_mapping.dropna(subset=['MAJOR', 'OCCUPATION'])
+    df_weights = pd.DataFrame({'MAJOR': df_mapping['MAJOR'].astype(str).to_numpy(),
+                               'OCCUPATION': df_mapping['OCCUPATION'].astype(str).to_numpy()})
+    if weighting == 'unit':
+        df_weights['WEIGHT'] = np.int64(1)
+    else:
+        # Weights are read from the rows kept, mappings may have blank rows.
+        df_weights['WEIGHT'] = pd.to_numeric(df_mapping['WEIGHT']).to_numpy(dtype=float)\
+            if 'WEIGHT' in df_mapping.columns else 1.0
+        df_weights['WEIGHT'] /= df_weights.groupby('MAJOR')['WEIGHT'].transform('sum')
+
+    return df_weights.groupby(['MAJOR', 'OCCUPATION'], sort=True)['WEIGHT'].sum().\
+        reset_index()
+
+def build_allocation_matrix(df_weights):
+    """
+        Build the sparse major x occupation weight matrix.
+        :param Dataframe df_weights -> Weights from get_allocation_weights.
+        :return csr_matrix, Index, Index -> Matrix, majors of its rows and occupations of
+                                            its columns, both sorted
+    """
+    majors = pd.Index(np.sort(df_weights['MAJOR'].unique()))
+    occupations = pd.Index(np.sort(df_weights['OCCUPATION'].unique()))
+    matrix = _import_sparse().csr_matrix(
+        (df_weights['WEIGHT'].to_numpy(),
+         (majors.get_indexer(df_weights['MAJOR']),
+          occupations.get_indexer(df_weights['OCCUPATION']))),
+        shape=(len(majors), len(occupations)))
+
+    return matrix, majors, occupations
+
+def _code_values(series, index):
+    """
+        Positions of the values of a series in an index, -1 for other values and missing
+        values. Categoricals are looked up once per category.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        category_codes = np.append(index.get_indexer(series.cat.categories.astype(str)), -1)
+        return category_codes[series.cat.codes.to_numpy()]
+    return index.get_indexer(pd.Index(series).astype(object))
+
+def count_students_by_major(merge_record_df, majors, term='MAJOR1_TERM_TERM_YEAR'
+                            ) -> pd.DataFrame:
+    """
+        Count students by major, term year and sex in one pass over the student record.
+        Students with a major outside of majors or without a term year are left out.
+        :param Dataframe merge_record_df -> Student record with 'MAJOR1_DESCR', 'SEX' and
+                                            the numeric term year.
+        :param List<string> majors -> Majors to count.
+        :param string term -> Column of the term year.
+        :return Dataframe -> Columns 'MAJOR', term and ALLOCATION_COUNT_COLUMNS, one row per
+                             major and year with students, sorted by major and year
+    """
+    majors = pd.Index(np.sort(pd.unique(np.asarray(majors, dtype=object))))
+    major_codes = _code_values(merge_record_df['MAJOR1_DESCR'], majors)
+    year_values = merge_record_df[term].to_numpy(dtype=float)
+    years, year_codes = np.unique(year_values, return_inverse=True)
+    year_codes = year_codes.reshape(-1)
+    # Missing years sort last in np.unique.
+    n_years = int(np.count_nonzero(~np.isnan(years)))
+    sex_codes = _code_values(merge_record_df['SEX'], pd.Index(['M', 'F']))
+    sex_codes = np.where(sex_codes < 0, 2, sex_codes)
+
+    keep = (major_codes >= 0) & (year_codes < n_years)
+    cells = (major_codes[keep] * n_years + year_codes[keep]) * 3 + sex_codes[keep]
+    counts = np.bincount(cells, minlength=len(majors) * n_years * 3).\
+        reshape(len(majors) * n_years, 3)
+    totals = counts.sum(axis=1)
+    cell_rows = np.flatnonzero(totals)
+
+    return pd.DataFrame({
+        'MAJOR': majors.to_numpy()[cell_rows // n_years] if n_years else
+                 np.array([], dtype=object),
+        term: years[cell_rows % n_years] if n_years else np.array([], dtype=float),
+        'number_of_students_all': totals[cell_rows],
+        'number_of_students_men': counts[cell_rows, 0],
+        'number_of_students_women': counts[cell_rows, 1],
+        'number_of_students_unknown': counts[cell_rows, 2]})
+
+def _get_major_count_matrix(df_major_counts, majors, term):
+    """
+        Lay out student counts by major as a dense major x (year, count column) matrix.
+        :return array, array -> Matrix and the sorted years of its column blocks
+    """
+    years, year_codes = np.unique(df_major_counts[term].to_numpy(dtype=float),
+                                  return_inverse=True)
+    year_codes = year_codes.reshape(-1)
+    major_codes = majors.get_indexer(df_major_counts['MAJOR'])
+    keep = major_codes >= 0
+
+    n_counts = len(ALLOCATION_COUNT_COLUMNS)
+    major_counts = np.zeros((len(majors), len(years) * n_counts), dtype=np.int64)
+    for i, column in enumerate(ALLOCATION_COUNT_COLUMNS):
+        major_counts[major_codes[keep], year_codes[keep] * n_counts + i] =\
+            df_major_counts[column].to_numpy()[keep]
+    return major_counts, years
+
+def allocate_student_counts(df_major_counts, df_weights, term='MAJOR1_TERM_TERM_YEAR'
+                            ) -> pd.DataFrame:
+    """
+        Allocate student counts by major and year to occupations with the sparse weight
+        matrix: counts by occupation = weights^T x counts by major, for every year and
+        count column at once.
+        :param Dataframe df_major_counts -> Counts from count_students_by_major.
+        :param Dataframe df_weights -> Weights from get_allocation_weights.
+        :param string term -> Column of the term year.
+        :return Dataframe -> Columns 'OCCUPATION', term and ALLOCATION_COUNT_COLUMNS, one
+                             row per occupation and year with students, sorted by
+                             occupation and year. Counts are integers with unit weights.
+    """
+    matrix, majors, occupations = build_allocation_matrix(df_weights)
+    major_counts, years = _get_major_count_matrix(df_major_counts, majors, term)
+    occupation_counts = np.asarray(matrix.T @ major_counts).\
+        reshape(len(occupations) * len(years), len(ALLOCATION_COUNT_COLUMNS))
+
+    cell_rows = np.flatnonzero(occupation_counts[:, 0])
+    df_counts = pd.DataFrame({'OCCUPATION': occupations.to_numpy()[cell_rows // len(years)],
+                              term: years[cell_rows % len(years)]})
+    for i, column in enumerate(ALLOCATION_COUNT_COLUMNS):
+        df_counts[column] = occupation_counts[cell_rows, i]
+
+    return df_counts
@@ -0,0 +1,247 @@
+"""
+    This module holds the BLS occupational hierarchy as integer-coded arrays.
+
+    The hierarchy is built once from the level mapping sheet. The nodes of each level
+    are numbered in name order, each node keeps the code of its parent in the level
+    above, and a name -> code dictionary and hash index per level turn names into codes.
+    Lookups of ancestors, children and codes are array operations instead of merges on
+    long occupation names.
+
+    Names repeat across levels (ex. 'Sales and related occupations' is both an l1 and an
+    l2 group), so a node is identified by its level and its code.
+
+    Ex.
+        hierarchy = get_occupation_hierarchy(BLS_WORKBOOK_2011_TO_2015, 'level_mapping_l0')
+        l1_codes = code(hierarchy, df['OCCUPATION'], 'l1')      # -1 for unknown names
+        l2_codes = ancestors(hierarchy, 'l1', l1_codes)['l2']
+        decode(hierarchy, children(hierarchy, 'l2', 'Professional and related occupations'),
+               'l1')
+
+    Hierarchies are cached next to the sheets of workbook_cache, as numpy archives keyed
+    by the workbook version.
+"""
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from workbook_cache import read_excel_sheet, get_cache_dir, get_file_fingerprint
+
+# Levels of the hierarchy from child to parent.
+HIERARCHY_LEVELS = ['l0', 'l1', 'l2', 'l3', 'l4']
+HIERARCHY_FILE_PREFIX = 'hierarchy-'
+HIERARCHY_FILE_SUFFIX = '.npz'
+
+# Hierarchies already loaded in this process by (workbook fingerprint, sheet name).
+_hierarchies = {}
+
+
+def _index_hierarchy(levels, names, parents, rows):
+    """
+        Assemble a hierarchy and derive its lookup structures: name -> code dictionaries,
+        hash indexes and the children of every node as contiguous slices.
+    """
+    child_slices = {}
+    for child_level, level in zip(levels[:-1], levels[1:]):
+        # Child codes grouped by parent, with the slice of every parent in offsets.
+        child_parents = parents[child_level]
+        order = np.argsort(child_parents, kind='stable')
+        counts = np.bincount(child_parents, minlength=len(names[level]))
+        offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int32)
+        child_slices[level] = (offsets, order.astype(np.int32))
+
+    return {'levels': list(levels),
+            'names': names,
+            'parents': parents,
+            'rows': rows,
+            'ids': {level: {name: i for i, name in enumerate(names[level])}
+                    for level in levels},
+            'index': {level: pd.Index(names[level]) for level in levels},
+            'children': child_slices}
+
+def build_hierarchy(df_mapping, levels=None) -> dict:
+    """
+        Build the integer-coded hierarchy of a level mapping.
+        Rows with a missing level are left out of the hierarchy.
+        :param Dataframe df_mapping -> Level mapping with one column per level, ex. the
+                                       'level_mapping_l0' sheet.
+        :param List<string> levels -> Level columns from child to parent, defaults to
+                                      HIERARCHY_LEVELS.
+        :return dict -> Hierarchy with by level:
+                            'names'   -> Array of node names, by code.
+                            'parents' -> Array of parent codes by code, -1 at the top level.
+                            'ids'     -> Dictionary of codes by name.
+                            'rows'    -> Array of the codes of the mapping rows.
+    """
+    levels = list(levels or HIERARCHY_LEVELS)
+    df_mapping = df_mapping[levels].dropna().astype(str)
+
+    names, rows, parents = {}, {}, {}
+    for level in levels:
+        names[level] = np.sort(df_mapping[level].unique()).astype(str)
+        rows[level] = pd.Index(names[level]).get_indexer(df_mapping[level]).astype(np.int32)
+    for level, parent_level in zip(levels, levels[1:] + [None]):
+        parents[level] = np.full(len(names[level]), -1, dtype=np.int32)
+        if parent_level is None:
+            continue
+        pairs = np.unique(np.stack([rows[level], rows[parent_level]], axis=1), axis=0)
+        if len(pairs) != len(names[level]):
+            several = pairs[np.flatnonzero(np.diff(pairs[:, 0]) == 0), 0]
+            raise ValueError('Nodes of ' + level + ' with several parents: ' +
+                             ', '.join(names[level][several]))
+        parents[level][pairs[:, 0]] = pairs[:, 1]
+
+    return _index_hierarchy(levels, names, parents, rows)
+
+def code(hierarchy, series, level) -> np.ndarray:
+    """
+        Convert node names to codes with a hash lookup.
+        :param dict hierarchy -> Hierarchy from build_hierarchy.
+        :param Series series -> Node names, categoricals are converted once per category.
+        :param string level -> Level of the names.
+        :return array -> Codes, -1 for names not in the level
+    """
+    index = hierarchy['index'][level]
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        category_codes = np.append(index.get_indexer(series.cat.categories.astype(str)), -1)
+        return category_codes[series.cat.codes.to_numpy()].astype(np.int32)
+    return index.get_indexer(pd.Index(series).astype(object)).astype(np.int32)
+
+def decode(hierarchy, codes, level) -> np.ndarray:
+    """
+        Convert node codes to names.
+        :param dict hierarchy -> Hierarchy from build_hierarchy.
+        :param array codes -> Codes of nodes of the level, -1 for missing nodes.
+        :param string level -> Level of the codes.
+        :return array -> Names as objects, None for missing nodes
+    """
+    codes = np.asarray(codes)
+    names = np.append(hierarchy['names'][level].astype(object), None)
+    return names[np.where(codes < 0, len(names) - 1, codes)]
+
+def ancestors(hierarchy, level, codes=None) -> dict:
+    """
+        Get the ancestors of nodes at every level above theirs.
+        :param dict hierarchy -> Hierarchy from build_hierarchy.
+        :param string level -> Level of the nodes.
+        :param array codes -> Codes of the nodes, defaults to every node of the level.
+                              Codes of -1 have ancestors of -1.
+        :return dict<string, array> -> Codes of the ancestors by ancestor level
+    """
+    levels = hierarchy['levels']
+    codes = np.arange(len(hierarchy['names'][level]), dtype=np.int32) if codes is None\
+        else np.asarray(codes, dtype=np.int32)
+    ancestor_codes = {}
+    position = levels.index(level)
+    for child_level, parent_level in zip(levels[position:], levels[position + 1:]):
+        parents = np.append(hierarchy['parents'][child_level], -1)
+        codes = parents[np.where(codes < 0, len(parents) - 1, codes)]
+        ancestor_codes[parent_level] = codes
+    return ancestor_codes
+
+def children(hierarchy, level, node) -> np.ndarray:
+    """
+        Get the children of a node.
+        :param dict hierarchy -> Hierarchy from build_hierarchy.
+        :param string level -> Level of the node, above the lowest level.
+        :param object node -> Name or code of the node.
+        :return array -> Codes of the children, in the level below
+    """
+    node_code = hierarchy['ids'][level][node] if isinstance(node, str) else int(node)
+    offsets, child_codes = hierarchy['children'][level]
+    return child_codes[offsets[node_code]:offsets[node_code + 1]]
+
+def get_level_frame(hierarchy, levels) -> pd.DataFrame:
+    """
+        List the distinct combinations of some levels of the mapping, in the order of
+        their first row in the mapping, ex. the l1 groups with their l2, l3 and l4
+        ancestors for levels ['l4', 'l3', 'l2', 'l1'].
+        :param dict hierarchy -> Hierarchy from build_hierarchy.
+        :param List<string> levels -> Level columns of the frame, in any order.
+        :return Dataframe -> One row per node of the lowest of the levels
+    """
+    lowest = min(levels, key=hierarchy['levels'].index)
+    first_rows = np.unique(hierarchy['rows'][lowest], return_index=True)[1]
+    node_codes = hierarchy['rows'][lowest][np.sort(first_rows)]
+    ancestor_codes = ancestors(hierarchy, lowest, node_codes)
+    ancestor_codes[lowest] = node_codes
+    return pd.DataFrame({level: decode(hierarchy, ancestor_codes[level], level)
+                         for level in levels})
+
+def save_hierarchy(hierarchy, path):
+    """
+        Write a hierarchy to a numpy archive, loaded back by load_hierarchy.
+        :param dict hierarchy -> Hierarchy from build_hierarchy.
+        :param string path -> Archive path, ex. 'hierarchy.npz'.
+    """
+    arrays = {'levels': np.array(hierarchy['levels'])}
+    for level in hierarchy['levels']:
+        arrays['names_' + level] = hierarchy['names'][level]
+        arrays['parents_' + level] = hierarchy['parents'][level]
+        arrays['rows_' + level] = hierarchy['rows'][level]
+    tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        np.savez(file, **arrays)
+    os.replace(tmp_path, path)
+
+def load_hierarchy(path) -> dict:
+    """
+        Read a hierarchy written by save_hierarchy.
+        :param string path -> Archive path.
+        :return dict -> Hierarchy
+    """
+    with np.load(path, allow_pickle=False) as archive:
+        levels = [str(level) for level in np.asarray(archive['levels']).tolist()]
+        return _index_hierarchy(levels,
+                                {level: archive['names_' + level] for level in levels},
+                                {level: archive['parents_' + level] for level in levels},
+                                {level: archive['rows_' + level] for level in levels})
+
+def get_occupation_hierarchy(filepath, sheet_name, levels=None) -> dict:
+    """
+        Get the hierarchy of a level mapping sheet, built once per version of the
+        workbook and cached in memory and in the workbook_cache directory.
+        :param string filepath -> Filepath to the BLS excel file.
+        :param string sheet_name -> Name of the level mapping sheet.
+        :param List<string> levels -> Level columns from child to parent, defaults to
+                                      HIERARCHY_LEVELS.
+        :return dict -> Hierarchy from build_hierarchy
+    """
+    levels = list(levels or HIERARCHY_LEVELS)
+    fingerprint = get_file_fingerprint(filepath)
+    key = (fingerprint, str(sheet_name), tuple(levels))
+    if key in _hierarchies:
+        return _hierarchies[key]
+
+    cache_dir = get_cache_dir()
+    cache_path = None
+    if cache_dir is not None:
+        # One entry per sheet and levels, older workbook versions are replaced.
+        prefix = HIERARCHY_FILE_PREFIX + hashlib.sha256(json.dumps(
+            [os.path.abspath(filepath), str(sheet_name), levels]).encode('utf-8')).\
+            hexdigest()[:32]
+        cache_path = os.path.join(cache_dir, prefix + '-' + fingerprint[:32] +
+                                  HIERARCHY_FILE_SUFFIX)
+    hierarchy = None
+    if cache_path is not None and os.path.exists(cache_path):
+        try:
+            hierarchy = load_hierarchy(cache_path)
+        except (OSError, KeyError, ValueError):
+            hierarchy = None
+    if hierarchy is None:
+        hierarchy = build_hierarchy(read_excel_sheet(filepath, sheet_name=sheet_name,
+                                                     header=0), levels)
+        if cache_path is not None:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                save_hierarchy(hierarchy, cache_path)
+                for file_name in os.listdir(cache_dir):
+                    if file_name.startswith(prefix) and\
+                            os.path.join(cache_dir, file_name) != cache_path:
+                        os.remove(os.path.join(cache_dir, file_name))
+            except OSError:
+                # The cache is an optimization only.
+                pass
+
+    _hierarchies[key] = hierarchy
+    return hierarchy
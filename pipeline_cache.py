@@ -0,0 +1,192 @@
+"""
+    This module memoizes the stages of the BLS data pipeline.
+
+    A memoized stage declares the files it reads. Results are keyed by the fingerprints
+    of those files (path, modification time, size and content hash), by the stage
+    arguments and by the environment variables that change its result, so editing a
+    source file or a setting invalidates every result computed from it. A declared file
+    that does not exist is keyed as missing.
+
+    Results are kept in an in-process LRU tier and, when BLS_PIPELINE_CACHE_DIR is set,
+    in an on-disk tier shared between processes. Callers always receive deep copies, so
+    functions that modify their frames in place cannot corrupt the cache.
+
+    Configuration (environment variables):
+        BLS_PIPELINE_CACHE_DIR -> Directory of the on-disk tier, disabled by default.
+        BLS_MEMO_MAXSIZE       -> Number of results kept in memory per stage, default 4.
+                                  Set to 0 to disable the in-process tier.
+"""
+import os
+import copy
+import pickle
+import hashlib
+import functools
+from collections import OrderedDict
+import pandas as pd
+from workbook_cache import get_file_fingerprint
+
+DEFAULT_MEMO_MAXSIZE = 4
+
+# In-process LRU tiers by stage name.
+_memo_tiers = {}
+
+
+def get_memo_maxsize():
+    """
+        Get the number of results kept in memory per stage from the environment.
+        :return int -> LRU size of the in-process tier.
+    """
+    return int(os.environ.get('BLS_MEMO_MAXSIZE', DEFAULT_MEMO_MAXSIZE))
+
+def get_disk_cache_dir():
+    """
+        Get the directory of the on-disk tier from the environment.
+        :return string -> Directory or None when the on-disk tier is disabled.
+    """
+    return os.environ.get('BLS_PIPELINE_CACHE_DIR') or None
+
+def _update_hash(hasher, value):
+    """
+        Feed a stage argument into the key hash. Dataframes and series are hashed by
+        content, containers recursively and anything else through pickle.
+    """
+    if isinstance(value, pd.DataFrame):
+        hasher.update(b'DataFrame')
+        hasher.update(repr(list(value.columns)).encode('utf-8'))
+        hasher.update(repr(list(value.dtypes.astype(str))).encode('utf-8'))
+        hasher.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, pd.Series):
+        hasher.update(b'Series')
+        hasher.update(repr((value.name, str(value.dtype))).encode('utf-8'))
+        hasher.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, (list, tuple)):
+        hasher.update(type(value).__name__.encode('utf-8'))
+        for item in value:
+            _update_hash(hasher, item)
+    elif isinstance(value, dict):
+        hasher.update(b'dict')
+        for key in sorted(value, key=repr):
+            _update_hash(hasher, key)
+            _update_hash(hasher, value[key])
+    else:
+        hasher.update(pickle.dumps(value))
+
+def get_memo_key(name, filepaths, args, kwargs, env=()):
+    """
+        Key of a stage result.
+        :param string name -> Stage name.
+        :param List<string> filepaths -> Files read by the stage.
+        :param tuple args -> Positional arguments of the call.
+        :param dict kwargs -> Keyword arguments of the call.
+        :param List<string> env -> Environment variables read by the stage.
+        :return string -> Hex digest
+    """
+    hasher = hashlib.sha256(name.encode('utf-8'))
+    for filepath in filepaths:
+        if os.path.exists(filepath):
+            hasher.update(get_file_fingerprint(filepath).encode('utf-8'))
+        else:
+            hasher.update(b'missing')
+    if env:
+        _update_hash(hasher, [os.environ.get(variable) for variable in env])
+    _update_hash(hasher, args)
+    _update_hash(hasher, kwargs)
+    return hasher.hexdigest()
+
+def _copy_result(result):
+    """
+        Deep copy a stage result, ex. a dataframe, a list of dataframes or a tuple.
+    """
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        return result.copy(deep=True)
+    if isinstance(result, (list, tuple)):
+        return type(result)(_copy_result(item) for item in result)
+    return copy.deepcopy(result)
+
+def read_pickle(path):
+    """
+        Read a pickled object, or None when it is missing or corrupted.
+        :param string path -> Path of the pickle file.
+        :return object -> Object, or None
+    """
+    try:
+        with open(path, 'rb') as file:
+            return pickle.load(file)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+def write_pickle(path, obj):
+    """
+        Pickle an object to a file through a temporary file for atomicity.
+        :param string path -> Path of the pickle file.
+        :param object obj -> Object to write.
+    """
+    tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        pickle.dump(obj, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+def _read_disk_tier(cache_dir, key):
+    """
+        Read a result from the on-disk tier, or None on a miss.
+    """
+    return read_pickle(os.path.join(cache_dir, key + '.pkl'))
+
+def _write_disk_tier(cache_dir, key, result):
+    """
+        Write a result to the on-disk tier.
+    """
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        write_pickle(os.path.join(cache_dir, key + '.pkl'), result)
+    except OSError:
+        # The cache is an optimization only, a read-only filesystem should not fail the stage.
+        pass
+
+def memoize_on_files(filepaths, env=()):
+    """
+        Decorator memoizing a pipeline stage on the fingerprints of the files it reads.
+        :param List<string> filepaths -> Files read by the stage, directly or through the
+                                         stages it calls.
+        :param List<string> env -> Environment variables changing the result of the stage.
+        :return function -> Decorator
+    """
+    def decorator(func):
+        name = func.__module__ + '.' + func.__qualname__
+        tier = _memo_tiers.setdefault(name, OrderedDict())
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            maxsize = get_memo_maxsize()
+            cache_dir = get_disk_cache_dir()
+            if maxsize <= 0 and cache_dir is None:
+                return func(*args, **kwargs)
+
+            key = get_memo_key(name, filepaths, args, kwargs, env)
+            if key in tier:
+                tier.move_to_end(key)
+                return _copy_result(tier[key])
+
+            result = _read_disk_tier(cache_dir, key) if cache_dir is not None else None
+            if result is None:
+                result = func(*args, **kwargs)
+                if cache_dir is not None:
+                    _write_disk_tier(cache_dir, key, result)
+
+            if maxsize > 0:
+                tier[key] = _copy_result(result)
+                while len(tier) > maxsize:
+                    tier.popitem(last=False)
+
+            return result
+
+        return wrapper
+
+    return decorator
+
+def clear_memoized():
+    """
+        Drop every result of the in-process tier.
+    """
+    for tier in _memo_tiers.values():
+        tier.clear()
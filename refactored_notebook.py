@@ -15,9 +15,16 @@
 """
 import sys
 import os
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
-from data_manipulation import get_short_names, get_df_list_final
+from data_manipulation import get_short_names, get_base_metric, get_df_list_final
+from occupation_hierarchy import get_occupation_hierarchy, get_level_frame
+from dtype_policy import decode_categoricals
+from stage_profiler import profile_stage, enable_profiling, write_profile, PROFILE_FORMATS
 
+@profile_stage
 def get_distinct_hierarchical_mappings(hierarchical_levels,
                                         filepath_excel_heirarchy,
                                         sheet_name):
@@ -28,41 +35,55 @@ def get_distinct_hierarchical_mappings(hierarchical_levels,
         :param string sheet_name -> Name of the sheet were BLS levels are stored.
         :return Dataframe -> BLS Occupational Hierarchy
     """
-    df_occupation_level_mapping = pd.read_excel(
-                                    filepath_excel_heirarchy,
-                                    sheet_name=sheet_name,
-                                    header=0)
-    df_occupation_level_mapping_distinct =\
-          df_occupation_level_mapping[hierarchical_levels].drop_duplicates().reset_index()
-    df_occupation_level_mapping_distinct =\
-          df_occupation_level_mapping_distinct[hierarchical_levels]
+    # The distinct combinations are read from the hierarchy built once per workbook.
+    hierarchy = get_occupation_hierarchy(filepath_excel_heirarchy, sheet_name)
 
-    return df_occupation_level_mapping_distinct
+    return get_level_frame(hierarchy, hierarchical_levels)
 
+def create_hierarchy_levels(df_level_data,
+                            df_hierarchical_map,
+                            level_names) -> list:
+    """
+        Create groupings for treemap block levels, for hierarchies of any depth.
+        Each grouping except the top one gets the names of its ancestor levels.
+        :param Dataframe df_level_data -> Transactional BLS level data, one dataframe
+                                          per level from child to parent.
+        :param Dataframe df_hierarchical_map -> BLS Hieracrchy map.
+        :param List<string> level_names -> List of selected level names, from child to
+                                           parent, ex. ['l1', 'l2', 'l3'].
+        :return List<Dataframe> -> Groupings for teemap blocks, one per level
+    """
+    groupings = []
+    for i, level_name in enumerate(level_names):
+        grouping = df_level_data[i]
+        if i + 1 < len(level_names):
+            # Merge hiearchny mapping of the ancestor levels to the block grouping.
+            grouping = pd.merge(grouping,
+                                df_hierarchical_map[level_names[i:]].drop_duplicates(),
+                                how='left',
+                                left_on=[level_name],
+                                right_on=[level_name])
+        groupings.append(grouping)
+
+    return groupings
+
+@profile_stage
 def create_treemap_levels(df_level_data,
                           df_hierarchical_map,
                           level_names):
     """
-        Create groupings for treemap block levels. This function only allows for 
-        2 levels deep.
+        Create groupings for treemap block levels. This function only allows for
+        2 levels deep, see create_hierarchy_levels for deeper hierarchies.
         :param Dataframe df_level_data -> Transactional BLS level data.
         :param Dataframe df_hierarchical_map -> BLS Hieracrchy map.
-        :param List<string> level_names -> List of selected level names.
+        :param List<string> level_names -> List of selected level names, ex. ['l1', 'l2'].
         :return Dataframe, Dataframe -> Groupings for teemap blocks
     """
-    # Create level 1 and level 2 dataframes for treemap block data objects.
-    l1_grouping = df_level_data[0]
-    l2_grouping = df_level_data[1]
-
-    # Merge hiearchny mapping to level 1 block grouping.
-    l1_grouping = pd.merge(l1_grouping,
-                            df_hierarchical_map[level_names],
-                            how='left',
-                            left_on=[level_names[0]],
-                            right_on=[level_names[0]])
+    groupings = create_hierarchy_levels(df_level_data, df_hierarchical_map, level_names[:2])
 
-    return l1_grouping, l2_grouping
+    return groupings[0], groupings[1]
 
+@profile_stage
 def filter_by_year_and_metric(l1_grouping,
                               l2_grouping,
                               level_names,
@@ -78,12 +99,13 @@ def filter_by_year_and_metric(l1_grouping,
         :return Dataframe, Dataframe -> Filtered groupings for teemap blocks
     """
     l1_grouping = l1_grouping[l1_grouping['year'] == str(year)]
-    l1_grouping = l1_grouping[level_names + [metric]]
+    l1_grouping = decode_categoricals(l1_grouping[level_names + [metric]])
     l2_grouping = l2_grouping[l2_grouping['year'] == str(year)]
-    l2_grouping = l2_grouping[[level_names[1]] + [metric]]
+    l2_grouping = decode_categoricals(l2_grouping[[level_names[1]] + [metric]])
 
     return l1_grouping, l2_grouping
 
+@profile_stage
 def apply_short_names(l1_grouping,
                       l2_grouping,
                       level_names,
@@ -99,24 +121,31 @@ def apply_short_names(l1_grouping,
     """
     l1 = level_names[0]
     l2 = level_names[1]
-     # Extract base metric exclusive of sex to be used by the
-     # get_short_names(level, metric) formatting function.
-    base_metric = metric.replace('_sum', '').replace('_women', '').\
-        replace('_men', '').replace('_all', '')
+    # Base metric exclusive of sex to be used by the
+    # get_short_names(level, metric) formatting function.
+    base_metric = get_base_metric(metric)
     # Get short name dictionary mapper
     short_name_l2 = get_short_names(l2, base_metric)
-    # Transform BLS long name to short name for readability in treemap visual.
-    l1_grouping[l2] = l1_grouping[l2].\
-        apply(lambda x: short_name_l2[x] if x in short_name_l2.keys() else x)
-    l2_grouping[l2] = l2_grouping[l2].\
-        apply(lambda x: short_name_l2[x] if x in short_name_l2.keys() else x)
+    # Transform BLS long name to short name for readability in treemap visual,
+    # names without a short name are kept as is.
+    l1_grouping[l2] = l1_grouping[l2].map(short_name_l2).fillna(l1_grouping[l2])
+    l2_grouping[l2] = l2_grouping[l2].map(short_name_l2).fillna(l2_grouping[l2])
     # Transform BLS long name to short name for readability in treemap visual.
     short_name_l1 = get_short_names(l1, base_metric)
-    l1_grouping[l1] = l1_grouping[l1].\
-        apply(lambda x: short_name_l1[x] if x in short_name_l1.keys() else x)
+    l1_grouping[l1] = l1_grouping[l1].map(short_name_l1).fillna(l1_grouping[l1])
 
     return l1_grouping, l2_grouping
 
+def _percentage_of_total(values, total):
+    """
+        Format values as whole percentages of total, ex. '24%'.
+        :param Series values -> Metric values
+        :param number total -> Total of the metric
+        :return Series -> Percentage labels
+    """
+    return (values / total * 100).round(0).astype(int).astype(str) + '%'
+
+@profile_stage
 def create_labels_for_treemap(l1_grouping,
                               l2_grouping,
                               level_names,
@@ -134,18 +163,313 @@ def create_labels_for_treemap(l1_grouping,
     l2 = level_names[1]
     total = l2_grouping[metric].sum() # total seems low, validate later on
     # Concat percentage of workers to level labels for visual.
-    l1_grouping[l1] = l1_grouping.\
-        apply(lambda x: x[l1] + ' | ' + str(int(round(x[metric]/total*100, 0))) + '%', axis=1)
-    l2_grouping[l2] = l2_grouping.\
-        apply(lambda x: x[l2] + ' | ' + str(int(round(x[metric]/total*100, 0))) + '%', axis=1)
-    l2_lookup = {k: k + " | " + v for k, v in (x.split(" | ") for x in l2_grouping[l2].to_list())}
-    l1_grouping[l2] = l1_grouping.apply(lambda x: l2_lookup[x[l2]], axis=1)
+    l1_grouping[l1] = l1_grouping[l1] + ' | ' + _percentage_of_total(l1_grouping[metric], total)
+    l2_labels = l2_grouping[l2] + ' | ' + _percentage_of_total(l2_grouping[metric], total)
+    # Join the labeled level 2 names to level 1 blocks on the unlabeled level 2 name.
+    l2_lookup = pd.Series(l2_labels.to_numpy(), index=l2_grouping[l2].to_numpy())
+    l2_lookup = l2_lookup[~l2_lookup.index.duplicated(keep='last')]
+    l1_grouping[l2] = l1_grouping[l2].map(l2_lookup)
+    l2_grouping[l2] = l2_labels
     # keep only records with non-zero values, otherwise treemap will throw a divide by zero error
     l1_grouping = l1_grouping[l1_grouping[metric] > 0]
     l2_grouping = l2_grouping[l2_grouping[metric] > 0]
 
     return l1_grouping, l2_grouping
 
+TREEMAP_OUTPUT_FORMATS = ('json', 'csv', 'html')
+TREEMAP_SEXES = ('all', 'men', 'women')
+# Size of the rendered treemaps in pixels.
+TREEMAP_WIDTH = 2000
+TREEMAP_HEIGHT = 1125
+# Options of run_treemap_batch and their defaults.
+TREEMAP_BATCH_OPTIONS = {'years': None, 'metrics': None, 'output_formats': ('json',),
+                         'max_workers': None}
+
+# Treemap groupings shared by the batch jobs of a worker process, see _init_batch_worker.
+_batch_groupings = {}
+
+
+def get_treemap_sum_metrics(df_level_data):
+    """
+        List the summed metrics of the BLS level data split into all, men and women,
+        ex. 'number_of_workers_women_sum'.
+        :param List<Dataframe> df_level_data -> Level data from get_df_list_final.
+        :return List<string> -> Metric column names
+    """
+    suffixes = tuple('_' + sex + '_sum' for sex in TREEMAP_SEXES)
+    return [column for column in df_level_data[0].columns if column.endswith(suffixes)]
+
+def _layout_treemap_blocks(l1_grouping, level_names, metric):
+    """
+        Lay out the treemap blocks of both levels, with the top edge of the l1 blocks.
+        :return Dataframe, Dataframe -> Blocks of the l1 and of the l2 level
+    """
+    # pylint: disable=import-outside-toplevel
+    from treemap_layout import layout_hierarchy
+
+    l1 = level_names[0]
+    l2 = level_names[1]
+    blocks = layout_hierarchy(l1_grouping, [l1, l2], metric,
+                              rect=(0, 0, TREEMAP_WIDTH, TREEMAP_HEIGHT))
+    blocks_by_l1 = blocks[blocks['level'] == l1].copy()
+    blocks_by_l1['ytop'] = blocks_by_l1['y'] + blocks_by_l1['dy']
+
+    return blocks_by_l1, blocks[blocks['level'] == l2]
+
+def _draw_labels(p, blocks, y, params, **text_options):
+    """
+        Draw the labels of one level of treemap blocks, with the format parameters of
+        the level.
+    """
+    p.text('x', y, x_offset=params['x_offset'], y_offset=params['y_offset'], source=blocks,
+           text_font_size=params['text_font_size'], text_color=params['text_color'],
+           **text_options)
+
+def _draw_treemap(l1_grouping, l2_grouping, level_names, metric):
+    """
+        Draw labeled treemap groupings on a Bokeh figure.
+    """
+    # pylint: disable=import-outside-toplevel
+    from bokeh.plotting import figure
+    from bokeh.transform import factor_cmap
+    from treemap_format import get_format_parameters
+
+    l1 = level_names[0]
+    l2 = level_names[1]
+    blocks_by_l1, blocks_by_l2 = _layout_treemap_blocks(l1_grouping, level_names, metric)
+    param_set = get_format_parameters(metric=get_base_metric(metric),
+                                      number_of_groups=len(l2_grouping))
+    block_params = param_set['block']
+    palette = block_params['palette']
+    if 'women' in metric or 'all' in metric:
+        palette = palette[::-1]
+
+    p = figure(width=TREEMAP_WIDTH, height=TREEMAP_HEIGHT, tooltips='@' + l1,
+               toolbar_location=None, x_axis_location=None, y_axis_location=None)
+    p.x_range.range_padding = p.y_range.range_padding = 0
+    p.grid.grid_line_color = None
+    p.block('x', 'y', 'dx', 'dy', source=blocks_by_l1, line_width=block_params['line_width'],
+            line_color=block_params['line_color'], fill_alpha=block_params['fill_alpha'],
+            fill_color=factor_cmap(l2, palette, tuple(l2_grouping[l2].unique())))
+    _draw_labels(p, blocks_by_l2, 'y', param_set[l2], text=l2)
+    _draw_labels(p, blocks_by_l1, 'ytop', param_set[l1], text=l1,
+                 text_baseline=param_set[l1]['text_baseline'])
+
+    return p
+
+def render_treemap_html(l1_grouping,
+                        l2_grouping,
+                        level_names,
+                        metric,
+                        title=None) -> str:
+    """
+        Render labeled treemap groupings as a standalone Bokeh HTML document.
+        Bokeh is only imported when a treemap is rendered.
+        :param Dataframe l1_grouping -> Labeled treemap block 1 df
+        :param Dataframe l2_grouping -> Labeled treemap block 2 df
+        :param List<string> level_names -> List of selected level names.
+        :param string metric -> Selected metric
+        :param string title -> Title of the HTML document.
+        :return string -> HTML document
+    """
+    # pylint: disable=import-outside-toplevel
+    from bokeh.embed import file_html
+    from bokeh.resources import CDN
+
+    return file_html(_draw_treemap(l1_grouping, l2_grouping, level_names, metric), CDN,
+                     title or metric)
+
+def get_treemap_payload(l1_grouping,
+                        l2_grouping,
+                        level_names,
+                        year,
+                        metric) -> dict:
+    """
+        JSON document of the labeled treemap groupings of one year and metric.
+        :param Dataframe l1_grouping -> Labeled treemap block 1 df
+        :param Dataframe l2_grouping -> Labeled treemap block 2 df
+        :param List<string> level_names -> List of selected level names.
+        :param string year -> Selected year
+        :param string metric -> Selected metric
+        :return dict -> Year, metric, level names and the records of each grouping
+    """
+    return {'year': str(year), 'metric': metric, 'level_names': list(level_names),
+            level_names[0]: l1_grouping.to_dict(orient='records'),
+            level_names[1]: l2_grouping.to_dict(orient='records')}
+
+def _write_treemap_output(l1_grouping, l2_grouping, job, output_format, path):
+    """
+        Write the labeled treemap groupings of a job in one output format.
+    """
+    l1 = job['level_names'][0]
+    l2 = job['level_names'][1]
+    if output_format == 'json':
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(get_treemap_payload(l1_grouping, l2_grouping, job['level_names'],
+                                          job['year'], job['metric']), file, indent=1)
+    elif output_format == 'csv':
+        # One tidy table of blocks, child blocks reference their parent label.
+        pd.concat([pd.DataFrame({'level': l1, 'label': l1_grouping[l1],
+                                 'parent': l1_grouping[l2],
+                                 'value': l1_grouping[job['metric']]}),
+                   pd.DataFrame({'level': l2, 'label': l2_grouping[l2],
+                                 'parent': None, 'value': l2_grouping[job['metric']]})],
+                  ignore_index=True).to_csv(path, index=False)
+    elif output_format == 'html':
+        html = render_treemap_html(l1_grouping, l2_grouping, job['level_names'], job['metric'],
+                                   title=f"{job['metric']} {job['year']}")
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(html)
+    else:
+        raise ValueError('Unknown treemap output format: ' + str(output_format))
+
+@profile_stage
+def write_treemap_outputs(l1_grouping,
+                          l2_grouping,
+                          job) -> list:
+    """
+        Write the labeled treemap groupings of one year and metric to the output
+        directory of a job.
+        :param Dataframe l1_grouping -> Labeled treemap block 1 df
+        :param Dataframe l2_grouping -> Labeled treemap block 2 df
+        :param dict job -> 'year', 'metric', 'level_names', 'output_dir' and
+                           'output_formats' (any of 'json', 'csv' and 'html').
+        :return List<string> -> Names of the written files
+    """
+    filenames = []
+    for output_format in job['output_formats']:
+        filename = f"treemap_{job['year']}_{job['metric']}.{output_format}"
+        _write_treemap_output(l1_grouping, l2_grouping, job, output_format,
+                              os.path.join(job['output_dir'], filename))
+        filenames.append(filename)
+
+    return filenames
+
+def _init_batch_worker(l1_grouping, l2_grouping):
+    """
+        Keep the treemap groupings in the worker process, so they are sent once per
+        worker instead of once per job.
+    """
+    _batch_groupings['l1'] = l1_grouping
+    _batch_groupings['l2'] = l2_grouping
+
+def run_treemap_job(job) -> dict:
+    """
+        Filter, shorten, label and write the treemap of one year and metric, from the
+        groupings of _init_batch_worker.
+        :param dict job -> 'year', 'metric', 'level_names', 'output_dir' and
+                           'output_formats', as write_treemap_outputs.
+        :return dict -> Job entry of the run manifest, with timings in seconds
+    """
+    level_names, metric = job['level_names'], job['metric']
+    stamps = [time.perf_counter()]
+    l1_grouping, l2_grouping = filter_by_year_and_metric(_batch_groupings['l1'],
+                                                         _batch_groupings['l2'],
+                                                         level_names, job['year'], metric)
+    stamps.append(time.perf_counter())
+    l1_grouping, l2_grouping = apply_short_names(l1_grouping, l2_grouping, level_names, metric)
+    stamps.append(time.perf_counter())
+    l1_grouping, l2_grouping = create_labels_for_treemap(l1_grouping, l2_grouping,
+                                                         level_names, metric)
+    stamps.append(time.perf_counter())
+    outputs = write_treemap_outputs(l1_grouping, l2_grouping, job)
+    stamps.append(time.perf_counter())
+    timings = {stage: stamps[i + 1] - stamps[i] for i, stage in
+               enumerate(['filter', 'short_names', 'labels', 'write'])}
+    timings['total'] = stamps[-1] - stamps[0]
+
+    return {'year': str(job['year']), 'metric': metric, 'pid': os.getpid(),
+            'rows': {level_names[0]: len(l1_grouping), level_names[1]: len(l2_grouping)},
+            'outputs': outputs, 'seconds': timings}
+
+def _run_treemap_jobs(l1_grouping, l2_grouping, jobs, workers):
+    """
+        Run treemap jobs in this process, or spread them over a process pool when more
+        than one worker is requested.
+        :return List<dict> -> Job entries of the run manifest, in the order of the jobs
+    """
+    if workers <= 1 or len(jobs) <= 1:
+        _init_batch_worker(l1_grouping, l2_grouping)
+        return [run_treemap_job(job) for job in jobs]
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs)),
+                             initializer=_init_batch_worker,
+                             initargs=(l1_grouping, l2_grouping)) as executor:
+        futures = [executor.submit(run_treemap_job, job) for job in jobs]
+        return [future.result() for future in futures]
+
+def _get_batch_options(df_level_data, options):
+    """
+        Check the options of a treemap batch and fill in their defaults.
+        :return dict -> Every option of TREEMAP_BATCH_OPTIONS, with lists of years,
+                        metrics and output formats
+    """
+    for option in options or {}:
+        if option not in TREEMAP_BATCH_OPTIONS:
+            raise ValueError('Unknown treemap batch option: ' + str(option))
+    options = dict(TREEMAP_BATCH_OPTIONS, **(options or {}))
+    for output_format in options['output_formats']:
+        if output_format not in TREEMAP_OUTPUT_FORMATS:
+            raise ValueError('Unknown treemap output format: ' + str(output_format))
+    if options['years'] is None:
+        options['years'] = sorted(str(year) for year in df_level_data[0]['year'].unique())
+    if options['metrics'] is None:
+        options['metrics'] = get_treemap_sum_metrics(df_level_data)
+    options['years'] = [str(year) for year in options['years']]
+    options['metrics'] = list(options['metrics'])
+    options['output_formats'] = list(options['output_formats'])
+
+    return options
+
+def run_treemap_batch(df_level_data,
+                      df_hierarchical_map,
+                      level_names,
+                      output_dir,
+                      options=None) -> dict:
+    """
+        Write the treemaps of every year and metric to output_dir with a run manifest.
+        The hierarchy merge is done once, and the year x metric jobs are spread over a
+        process pool.
+        :param List<Dataframe> df_level_data -> Level data from get_df_list_final.
+        :param Dataframe df_hierarchical_map -> BLS Hieracrchy map.
+        :param List<string> level_names -> List of selected level names, ex. ['l1', 'l2'].
+        :param string output_dir -> Output directory, created when missing.
+        :param dict options -> Any of TREEMAP_BATCH_OPTIONS:
+                                   'years'          -> Years to render, defaults to every
+                                                       year of the data.
+                                   'metrics'        -> Metrics to render, defaults to
+                                                       get_treemap_sum_metrics.
+                                   'output_formats' -> Any of 'json', 'csv' and 'html'.
+                                   'max_workers'    -> Worker processes, 1 runs the jobs in
+                                                       this process and None uses the
+                                                       number of CPUs.
+        :return dict -> Run manifest, also written to output_dir/manifest.json
+    """
+    start = time.perf_counter()
+    options = _get_batch_options(df_level_data, options)
+    os.makedirs(output_dir, exist_ok=True)
+
+    l1_grouping, l2_grouping = create_treemap_levels(df_level_data=df_level_data,
+                                                     df_hierarchical_map=df_hierarchical_map,
+                                                     level_names=level_names)
+    # Jobs only need the years and metrics they render.
+    columns = ['year'] + options['metrics']
+    jobs = [{'year': year, 'metric': metric, 'level_names': list(level_names),
+             'output_dir': output_dir, 'output_formats': options['output_formats']}
+            for year in options['years'] for metric in options['metrics']]
+    workers = options['max_workers'] or os.cpu_count() or 1
+    job_entries = _run_treemap_jobs(l1_grouping[level_names + columns],
+                                    l2_grouping[[level_names[1]] + columns], jobs, workers)
+
+    manifest = {'level_names': list(level_names), 'years': options['years'],
+                'metrics': options['metrics'], 'formats': options['output_formats'],
+                'workers': workers, 'jobs': job_entries,
+                'seconds': time.perf_counter() - start}
+    with open(os.path.join(output_dir, 'manifest.json'), 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=1)
+
+    return manifest
+
 if __name__ == '__main__':
     import argparse
     # Add custom py file to directory to import functions
@@ -157,7 +481,27 @@ if __name__ == '__main__':
     parser.add_argument('file', type=str, help='The name of the BLS excel data file.')
     parser.add_argument('sheet_name', type=str, help='The the name of the sheet to '
     '                    extract the BLS hierarchy.')
+    parser.add_argument('--batch', action='store_true', help='Write the treemaps of every '
+                        'year and metric to --output-dir instead of printing one.')
+    parser.add_argument('--output-dir', type=str, default='./treemaps',
+                        help='Output directory of the batch mode.')
+    parser.add_argument('--format', type=str, nargs='+', default=['json'],
+                        choices=TREEMAP_OUTPUT_FORMATS, dest='output_formats',
+                        help='Output formats of the batch mode.')
+    parser.add_argument('--years', type=str, nargs='+', default=None,
+                        help='Years of the batch mode, defaults to every year.')
+    parser.add_argument('--metrics', type=str, nargs='+', default=None,
+                        help='Metrics of the batch mode, defaults to the all/men/women '
+                        '*_sum metrics.')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes of the batch mode, defaults to the CPU count.')
+    parser.add_argument('--profile', type=str, default=None,
+                        help='Profile the pipeline stages and write the trace to this file.')
+    parser.add_argument('--profile-format', type=str, default='json', choices=PROFILE_FORMATS,
+                        help='Trace format, json records or chrome trace events.')
     args = parser.parse_args()
+    if args.profile:
+        enable_profiling()
 
     levels = ['l4', 'l3', 'l2', 'l1']
     hierarchical_map = get_distinct_hierarchical_mappings(
@@ -167,6 +511,22 @@ if __name__ == '__main__':
 
     target_levels = ['l1', 'l2']
     df_data = get_df_list_final()
+
+    if args.batch:
+        run_manifest = run_treemap_batch(df_level_data=df_data,
+                                         df_hierarchical_map=hierarchical_map,
+                                         level_names=target_levels,
+                                         output_dir=args.output_dir,
+                                         options={'years': args.years,
+                                                  'metrics': args.metrics,
+                                                  'output_formats': args.output_formats,
+                                                  'max_workers': args.workers})
+        print('Wrote', len(run_manifest['jobs']), 'treemaps to', args.output_dir,
+              'in', round(run_manifest['seconds'], 2), 'seconds')
+        if args.profile:
+            write_profile(args.profile, args.profile_format)
+        sys.exit(0)
+
     tgt_l1_grouping, tgt_l2_grouping = create_treemap_levels(
                                             df_level_data=df_data,
                                             df_hierarchical_map=hierarchical_map,
@@ -196,3 +556,5 @@ if __name__ == '__main__':
     # Print treemap hierarchical blocks to be used in treemap visual
     print('l1_grouping_treemap:', l1_grouping_treemap)
     print('l2_grouping_treemap', l2_grouping_treemap)
+    if args.profile:
+        write_profile(args.profile, args.profile_format)
@@ -0,0 +1,280 @@
+"""
+    This module profiles the stages of the BLS data pipeline.
+
+    Stages are functions decorated with profile_stage or blocks of code run inside
+    profile_block. When profiling is enabled, every run of a stage records its wall
+    time, CPU time, tracemalloc peak above the memory held on entry, the peak RSS of the
+    process, and the rows and memory of the dataframes it receives and returns. The
+    records can be written as a JSON trace or as a Chrome trace-event file, which opens
+    in chrome://tracing or https://ui.perfetto.dev with nested stages shown as a flame
+    chart.
+
+    Profiling is off by default and a disabled stage costs one dictionary lookup.
+    Stages run in worker processes are not recorded.
+
+    Configuration (environment variables):
+        BLS_PROFILE        -> Trace file written when the process exits, enables profiling.
+        BLS_PROFILE_FORMAT -> 'json' (default) or 'chrome'.
+"""
+import os
+import sys
+import time
+import atexit
+import json
+import functools
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - resource is not available on Windows
+    resource = None
+
+PROFILE_FORMATS = ('json', 'chrome')
+
+# Profiling state: enabled flag, trace origin and whether this module started tracemalloc.
+_state = {'enabled': False, 'origin': 0.0, 'started_tracemalloc': False}
+# Records of the finished stages, in order of completion.
+_records = []
+# Stages currently running, with the highest tracemalloc peak of their nested stages.
+_stack = []
+_NULL_BLOCK = nullcontext()
+
+
+def is_profiling_enabled():
+    """
+        Check whether stages are being profiled.
+        :return bool -> True when profiling is enabled.
+    """
+    return _state['enabled']
+
+def enable_profiling(trace_memory=True):
+    """
+        Start recording the stages of this process.
+        :param bool trace_memory -> Trace Python allocations with tracemalloc, which
+                                    slows down allocation heavy stages.
+    """
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _state['started_tracemalloc'] = True
+    if not _state['enabled']:
+        _state['origin'] = time.perf_counter()
+    _state['enabled'] = True
+
+def disable_profiling():
+    """
+        Stop recording stages. Records are kept until clear_profile is called.
+    """
+    _state['enabled'] = False
+    if _state['started_tracemalloc']:
+        tracemalloc.stop()
+        _state['started_tracemalloc'] = False
+
+def clear_profile():
+    """
+        Drop the recorded stages.
+    """
+    del _records[:]
+
+def get_profile_records() -> list:
+    """
+        Get the records of the finished stages.
+        :return List<dict> -> One record per stage run, in order of completion
+    """
+    return list(_records)
+
+def get_profile_summary() -> pd.DataFrame:
+    """
+        Summarize the recorded stages.
+        :return Dataframe -> Number of runs, total wall and CPU seconds and highest
+                             tracemalloc peak by stage, slowest stages first
+    """
+    df_records = pd.DataFrame(_records, columns=['name', 'wall_seconds', 'cpu_seconds',
+                                                 'tracemalloc_peak_bytes'])
+    return df_records.groupby('name').agg(
+        runs=('wall_seconds', 'size'),
+        wall_seconds=('wall_seconds', 'sum'),
+        cpu_seconds=('cpu_seconds', 'sum'),
+        tracemalloc_peak_bytes=('tracemalloc_peak_bytes', 'max')).\
+        sort_values('wall_seconds', ascending=False)
+
+def _get_max_rss_bytes():
+    """
+        Peak resident set size of the process, or None when it is not available.
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+def describe_frames(value):
+    """
+        Count the rows and memory of the dataframes and series in a value, looking into
+        lists, tuples and dict values.
+        :param object value -> Value, ex. the arguments or the result of a stage.
+        :return int, int -> Rows and bytes, or None, None without any frame
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        memory = value.memory_usage(index=True, deep=True)
+        return len(value), int(memory.sum() if isinstance(value, pd.DataFrame) else memory)
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        rows, nbytes = None, None
+        for item in value:
+            item_rows, item_bytes = describe_frames(item)
+            if item_rows is not None:
+                rows = (rows or 0) + item_rows
+                nbytes = (nbytes or 0) + item_bytes
+        return rows, nbytes
+    return None, None
+
+def _start_record(name, inputs):
+    """
+        Open the record of a stage run.
+    """
+    record = {'name': name, 'pid': os.getpid(), 'depth': len(_stack)}
+    record['input_rows'], record['input_bytes'] = describe_frames(inputs)
+    record['output_rows'], record['output_bytes'] = None, None
+    record['tracemalloc_start_bytes'] = None
+    if tracemalloc.is_tracing():
+        record['tracemalloc_start_bytes'] = tracemalloc.get_traced_memory()[0]
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+    record['max_rss_start_bytes'] = _get_max_rss_bytes()
+    _stack.append({'nested_peak': 0})
+    record['start'] = time.perf_counter()
+    record['cpu_start'] = time.process_time()
+    return record
+
+def _finish_record(record):
+    """
+        Close the record of a stage run and store it.
+    """
+    wall_end = time.perf_counter()
+    cpu_end = time.process_time()
+    frame = _stack.pop()
+    record['wall_seconds'] = wall_end - record['start']
+    record['cpu_seconds'] = cpu_end - record.pop('cpu_start')
+    record['start'] = record['start'] - _state['origin']
+
+    start_bytes = record.pop('tracemalloc_start_bytes')
+    record['tracemalloc_peak_bytes'] = None
+    if start_bytes is not None and tracemalloc.is_tracing():
+        # Nested stages reset the peak, so the highest peak among them is kept aside.
+        peak = max(tracemalloc.get_traced_memory()[1], frame['nested_peak'])
+        record['tracemalloc_peak_bytes'] = max(peak - start_bytes, 0)
+        if _stack:
+            _stack[-1]['nested_peak'] = max(_stack[-1]['nested_peak'], peak)
+
+    max_rss_start = record.pop('max_rss_start_bytes')
+    record['max_rss_bytes'] = _get_max_rss_bytes()
+    record['max_rss_delta_bytes'] = record['max_rss_bytes'] - max_rss_start\
+        if max_rss_start is not None else None
+    _records.append(record)
+
+def record_frames(record, outputs):
+    """
+        Set the output rows and memory of a profile_block run.
+        :param dict record -> Record yielded by profile_block, None when profiling is off.
+        :param object outputs -> Dataframes produced by the block.
+    """
+    if record is not None:
+        record['output_rows'], record['output_bytes'] = describe_frames(outputs)
+
+@contextmanager
+def _profiled_block(name, inputs):
+    """
+        Record the run of a block of code.
+    """
+    record = _start_record(name, inputs)
+    try:
+        yield record
+    finally:
+        _finish_record(record)
+
+def profile_block(name, inputs=None):
+    """
+        Context manager profiling a block of code as a stage, ex.
+            with profile_block('term merge', inputs=df_record) as record:
+                ...
+                record_frames(record, df_record)
+        :param string name -> Stage name.
+        :param object inputs -> Dataframes received by the block.
+        :return context manager -> Yields the record of the run, or None when profiling
+                                   is off
+    """
+    if not _state['enabled']:
+        return _NULL_BLOCK
+    return _profiled_block(name, inputs)
+
+def profile_stage(func=None, name=None):
+    """
+        Decorator profiling every call of a function as a stage. The dataframes among the
+        arguments and in the result are counted as the stage inputs and outputs.
+        :param function func -> Decorated function.
+        :param string name -> Stage name, defaults to the function name.
+        :return function -> Decorated function, or a decorator when func is not given
+    """
+    if func is None:
+        return functools.partial(profile_stage, name=name)
+    stage_name = name or func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _state['enabled']:
+            return func(*args, **kwargs)
+        record = _start_record(stage_name, (args, kwargs))
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            _finish_record(record)
+        record['output_rows'], record['output_bytes'] = describe_frames(result)
+        return result
+
+    return wrapper
+
+def get_chrome_trace() -> dict:
+    """
+        Convert the records to the Chrome trace-event format, one complete event per
+        stage run with the measures as arguments.
+        :return dict -> Trace with a 'traceEvents' list
+    """
+    events = []
+    for record in _records:
+        args = {key: value for key, value in record.items()
+                if key not in ('name', 'pid', 'start', 'wall_seconds')}
+        events.append({'name': record['name'], 'cat': 'stage', 'ph': 'X',
+                       'ts': record['start'] * 1e6, 'dur': record['wall_seconds'] * 1e6,
+                       'pid': record['pid'], 'tid': record['pid'], 'args': args})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+def write_profile(path, profile_format='json'):
+    """
+        Write the recorded stages to a file.
+        :param string path -> Trace file.
+        :param string profile_format -> 'json' for a list of records or 'chrome' for a
+                                        Chrome trace-event file.
+    """
+    if profile_format == 'chrome':
+        trace = get_chrome_trace()
+    elif profile_format == 'json':
+        trace = {'stages': get_profile_records()}
+    else:
+        raise ValueError('Unknown profile format: ' + str(profile_format))
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(trace, file, indent=1)
+
+def _write_profile_at_exit(path, profile_format, pid):
+    """
+        Write the trace requested by BLS_PROFILE, only from the process that enabled it.
+    """
+    if os.getpid() == pid:
+        write_profile(path, profile_format)
+
+if os.environ.get('BLS_PROFILE'):
+    enable_profiling()
+    atexit.register(_write_profile_at_exit, os.environ['BLS_PROFILE'],
+                    os.environ.get('BLS_PROFILE_FORMAT', 'json'), os.getpid())
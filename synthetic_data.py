@@ -0,0 +1,296 @@
+"""
+    This module generates synthetic inputs for the BLS project data pipeline.
+
+    The generated files follow the schemas of the files in ./data, so the pipeline runs on
+    them unchanged:
+        student.record.csv               -> One row per student with SEX, the ADMIT_TERM and
+                                            MAJOR1_TERM to MAJOR3_TERM ids and MAJOR1_DESCR.
+        term.table.txt                   -> Tab separated MOOCterm (TERM_ID) and Term.Descr.
+        majors.xlsx                      -> Sheet 'majors' mapping MAJOR to OCCUPATION (l1).
+        majors_occupations_map.csv       -> UTF-8 with BOM MAJOR, OCCUPATION pairs: the
+                                            majors sheet, with a second occupation for
+                                            some majors.
+        bls_cpsaat39_2011_to_2015.xlsx   -> Sheet 'level_mapping_l0' with the occupation,
+                                            l4 to l0 hierarchy, and one sheet per year with
+                                            the number_of_workers_* and
+                                            median_weekly_earnings_* columns.
+        bls_cpsaat09_2002_to_2015.xlsx   -> One sheet per year 2003 to 2015 with the header
+                                            on the fourth row and the level, L3 to L0,
+                                            occupation and ten worker count columns.
+
+    Every table is drawn from a seeded generator, so the same arguments always produce the
+    same files. Student records are generated and written in chunks, which keeps memory
+    flat from 10k to 50M rows.
+
+    Run -> python synthetic_data.py ./bench/data --rows 1000000
+"""
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+TERM_NAMES = ['Winter', 'Spring', 'Summer', 'Fall']
+WORKER_COLUMNS = ['number_of_workers_all', 'median_weekly_earnings_all',
+                  'number_of_workers_men', 'median_weekly_earnings_men',
+                  'number_of_workers_women', 'median_weekly_earnings_women']
+YEARS_2011_TO_2015 = ['2015', '2014', '2013', '2012', '2011']
+YEARS_2003_TO_2015 = [str(year) for year in range(2015, 2002, -1)]
+SYNTHETIC_DATA_FILES = ['student.record.csv', 'term.table.txt', 'majors.xlsx',
+                        'majors_occupations_map.csv', 'bls_cpsaat39_2011_to_2015.xlsx',
+                        'bls_cpsaat09_2002_to_2015.xlsx']
+
+
+def _get_rng(seed, *stream):
+    """
+        Seeded generator of one table, or of one chunk of a table.
+    """
+    return np.random.default_rng([seed] + list(stream))
+
+def generate_term_table(first_year=1980, last_year=2016, seed=0) -> pd.DataFrame:
+    """
+        Generate the term table, four terms per year with a few combined terms and a
+        missing description at the end, as in term.table.txt.
+        :param int first_year -> Year of the first term.
+        :param int last_year -> Year of the last terms.
+        :param int seed -> Random seed.
+        :return Dataframe -> Columns 'MOOCterm' and 'Term.Descr'
+    """
+    rng = _get_rng(seed, 1)
+    years = np.repeat(np.arange(first_year, last_year + 1), len(TERM_NAMES))
+    names = np.tile(TERM_NAMES, last_year - first_year + 1).astype(object)
+    # Some summer terms are recorded as combined spring and summer terms.
+    combined = (names == 'Summer') & (rng.random(len(names)) < 0.1)
+    names[combined] = 'Spring/Summer'
+    descriptions = list(names + ' ' + years.astype(str)) + [np.nan]
+
+    return pd.DataFrame({'MOOCterm': np.arange(1, len(descriptions) + 1),
+                         'Term.Descr': descriptions})
+
+def generate_bls_hierarchy(n_occupations=500, n_l1=22, n_l2=14, n_l3=6,
+                           seed=0) -> pd.DataFrame:
+    """
+        Generate the BLS occupational hierarchy of the level_mapping_l0 sheet.
+        :param int n_occupations -> Number of detailed occupations (l0).
+        :param int n_l1 -> Number of l1 groups, ex. 'Management occupations'.
+        :param int n_l2 -> Number of l2 groups.
+        :param int n_l3 -> Number of l3 groups.
+        :param int seed -> Random seed.
+        :return Dataframe -> Columns 'occupation', 'l4', 'l3', 'l2', 'l1' and 'l0'
+    """
+    rng = _get_rng(seed, 2)
+    # Every group has at least one child, the remaining children are spread at random.
+    def assign(n_children, n_parents):
+        parents = np.concatenate([np.arange(n_parents),
+                                  rng.integers(0, n_parents, n_children - n_parents)])
+        return np.sort(parents)
+
+    l2_of_l1 = assign(n_l1, n_l2)
+    l3_of_l2 = assign(n_l2, n_l3)
+    l1_of_l0 = assign(n_occupations, n_l1)
+    l0 = np.array([f'Occupation {i:05d}' for i in range(n_occupations)], dtype=object)
+    l1_names = np.array([f'L1 group {i:02d} occupations' for i in range(n_l1)], dtype=object)
+    l2_names = np.array([f'L2 group {i:02d} occupations' for i in range(n_l2)], dtype=object)
+    l3_names = np.array([f'L3 group {i:02d} occupations' for i in range(n_l3)], dtype=object)
+
+    return pd.DataFrame({'occupation': l0,
+                         'l4': 'Total',
+                         'l3': l3_names[l3_of_l2[l2_of_l1[l1_of_l0]]],
+                         'l2': l2_names[l2_of_l1[l1_of_l0]],
+                         'l1': l1_names[l1_of_l0],
+                         'l0': l0})
+
+def generate_bls_year_sheet(df_hierarchy, year, seed=0) -> pd.DataFrame:
+    """
+        Generate the workers and earnings sheet of one year of the 2011 to 2015 workbook:
+        one row per node of the hierarchy, groups before their children.
+        :param Dataframe df_hierarchy -> Hierarchy from generate_bls_hierarchy.
+        :param string year -> Year of the sheet.
+        :param int seed -> Random seed.
+        :return Dataframe -> Columns 'occupation' and WORKER_COLUMNS
+    """
+    rng = _get_rng(seed, 3, int(year))
+    n = len(df_hierarchy)
+    men = rng.integers(5, 2000, n)
+    women = rng.integers(5, 2000, n)
+    earnings = rng.integers(400, 2200, n)
+    df_occupations = pd.DataFrame({
+        'occupation': df_hierarchy['l0'].to_numpy(),
+        'number_of_workers_all': men + women,
+        'median_weekly_earnings_all': earnings,
+        'number_of_workers_men': men,
+        'median_weekly_earnings_men': earnings + rng.integers(0, 200, n),
+        'number_of_workers_women': women,
+        'median_weekly_earnings_women': earnings - rng.integers(0, 200, n),
+    })
+
+    # Group rows hold the totals of their occupations, as in the BLS tables.
+    df_groups = []
+    for level in ['l4', 'l3', 'l2', 'l1']:
+        df_group = df_occupations.groupby(df_hierarchy[level].to_numpy(), sort=False).agg(
+            {column: 'sum' if column.startswith('number_of_workers') else 'median'
+             for column in WORKER_COLUMNS})
+        df_group[WORKER_COLUMNS] = df_group[WORKER_COLUMNS].astype('int64')
+        df_groups.append(df_group.rename_axis('occupation').reset_index())
+
+    return pd.concat(df_groups + [df_occupations], ignore_index=True)[
+        ['occupation'] + WORKER_COLUMNS]
+
+def generate_bls_2002_to_2015_sheet(df_hierarchy, year, seed=0) -> pd.DataFrame:
+    """
+        Generate the sheet of one year of the 2002 to 2015 workbook: three title rows, a
+        header row and one row per l1 group with blank rows between l3 groups.
+        :param Dataframe df_hierarchy -> Hierarchy from generate_bls_hierarchy.
+        :param string year -> Year of the sheet.
+        :param int seed -> Random seed.
+        :return Dataframe -> Sheet cells, without header
+    """
+    rng = _get_rng(seed, 4, int(year))
+    title = [[None] * 5 + ['Occupation', 'Total', None, 'Men', None, None, None, 'Women',
+                           None, None, None],
+             [None] * 6 + ['16 years', None, '16 years', None, '20 years', None,
+                           '16 years', None, '20 years', None],
+             [None] * 6 + ['and over', None] * 5,
+             ['Level', 'L3', 'L2', 'L1', 'L0', None] + [int(year) - 1, int(year)] * 5]
+    rows = []
+    df_groups = df_hierarchy[['l3', 'l2', 'l1']].drop_duplicates()
+    for l3, df_l3 in df_groups.groupby('l3', sort=False):
+        rows.append([None] * 16)
+        for l2, l1 in zip(df_l3['l2'], df_l3['l1']):
+            counts = rng.integers(100, 20000, 10)
+            rows.append(['L0', 'Total', l3, l2, l1, l1] + counts.tolist())
+
+    return pd.DataFrame(title + rows)
+
+def generate_majors(occupations, n_majors=350, seed=0) -> pd.DataFrame:
+    """
+        Generate the majors sheet mapping majors to l1 occupations.
+        :param List<string> occupations -> l1 occupation names.
+        :param int n_majors -> Number of majors.
+        :param int seed -> Random seed.
+        :return Dataframe -> Columns 'MAJOR' and 'OCCUPATION'
+    """
+    rng = _get_rng(seed, 5)
+    return pd.DataFrame({'MAJOR': [f'Major {i:04d} BS' for i in range(n_majors)],
+                         'OCCUPATION': rng.choice(np.asarray(occupations, dtype=object),
+                                                  n_majors)})
+
+def generate_major_occupation_map(df_majors, occupations, seed=0) -> pd.DataFrame:
+    """
+        Generate the many to many major -> occupation map of majors_occupations_map.csv:
+        the pairs of the majors sheet, and a second occupation for about one major in ten.
+        :param Dataframe df_majors -> Majors sheet from generate_majors.
+        :param List<string> occupations -> l1 occupation names.
+        :param int seed -> Random seed.
+        :return Dataframe -> Columns 'MAJOR' and 'OCCUPATION', sorted by major
+    """
+    rng = _get_rng(seed, 7)
+    second = rng.random(len(df_majors)) < 0.1
+    df_second = pd.DataFrame({'MAJOR': df_majors['MAJOR'].to_numpy()[second],
+                              'OCCUPATION': rng.choice(np.asarray(occupations, dtype=object),
+                                                       int(second.sum()))})
+
+    return pd.concat([df_majors[['MAJOR', 'OCCUPATION']], df_second]).drop_duplicates().\
+        sort_values('MAJOR', kind='stable').reset_index(drop=True)
+
+def _get_term_ids(df_term, first_year, last_year):
+    """
+        Ids of the terms of a range of years.
+    """
+    term_years = pd.to_numeric(df_term['Term.Descr'].str[-4:], errors='coerce').to_numpy()
+    return df_term['MOOCterm'].to_numpy()[(term_years >= first_year) &
+                                          (term_years <= last_year)]
+
+def generate_student_records(student_ids, majors, df_term, seed=0, chunk=0) -> pd.DataFrame:
+    """
+        Generate student records. Most MAJOR1_TERM ids fall in 2011 to 2015, the years
+        with BLS data, and a few records miss a major or have one outside the majors sheet.
+        :param range student_ids -> STUDENT_ID of the records, ex. range(0, 1000).
+        :param List<string> majors -> Major names of the majors sheet.
+        :param Dataframe df_term -> Term table from generate_term_table.
+        :param int seed -> Random seed.
+        :param int chunk -> Chunk number, each chunk draws from its own generator.
+        :return Dataframe -> Student records
+    """
+    rng = _get_rng(seed, 6, chunk)
+    n_rows = len(student_ids)
+    term_ids = df_term['MOOCterm'].to_numpy()
+    recent = _get_term_ids(df_term, 2011, 2015)
+    admit = _get_term_ids(df_term, 2005, 2015)
+    major_names = np.asarray(list(majors) + ['Unmapped Major BA'], dtype=object)
+
+    major1_term = np.where(rng.random(n_rows) < 0.9, rng.choice(recent, n_rows),
+                           rng.choice(term_ids, n_rows))
+    major2_term = np.where(rng.random(n_rows) < 0.3, rng.choice(term_ids, n_rows),
+                           np.nan)
+    major3_term = np.where(rng.random(n_rows) < 0.05, rng.choice(term_ids, n_rows),
+                           np.nan)
+    major1_descr = rng.choice(major_names, n_rows)
+    major1_descr[rng.random(n_rows) < 0.02] = None
+
+    return pd.DataFrame({
+        'STUDENT_ID': np.asarray(student_ids, dtype=np.int64),
+        'SEX': rng.choice(np.array(['M', 'F', 'U'], dtype=object), n_rows, p=[0.48, 0.48, 0.04]),
+        'ADMIT_TERM': rng.choice(admit, n_rows),
+        'MAJOR1_TERM': major1_term,
+        'MAJOR2_TERM': major2_term,
+        'MAJOR3_TERM': major3_term,
+        'MAJOR1_DESCR': major1_descr,
+    })
+
+def write_synthetic_data(data_dir, n_rows, n_occupations=500, seed=0,
+                         chunksize=1000000) -> dict:
+    """
+        Write a complete synthetic data directory for the pipeline.
+        :param string data_dir -> Output directory, ex. './bench/data'.
+        :param int n_rows -> Number of student records.
+        :param int n_occupations -> Number of detailed BLS occupations.
+        :param int seed -> Random seed.
+        :param int chunksize -> Student records generated and written at a time.
+        :return dict -> Paths of the written files by file name
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    paths = {name: os.path.join(data_dir, name) for name in SYNTHETIC_DATA_FILES}
+
+    df_term = generate_term_table(seed=seed)
+    df_term.to_csv(paths['term.table.txt'], sep='\t', index=False)
+
+    df_hierarchy = generate_bls_hierarchy(n_occupations=n_occupations, seed=seed)
+    with pd.ExcelWriter(paths['bls_cpsaat39_2011_to_2015.xlsx']) as writer:
+        df_hierarchy.to_excel(writer, sheet_name='level_mapping_l0', index=False)
+        for year in YEARS_2011_TO_2015:
+            generate_bls_year_sheet(df_hierarchy, year, seed=seed).\
+                to_excel(writer, sheet_name=year, index=False)
+    with pd.ExcelWriter(paths['bls_cpsaat09_2002_to_2015.xlsx']) as writer:
+        for year in YEARS_2003_TO_2015:
+            generate_bls_2002_to_2015_sheet(df_hierarchy, year, seed=seed).\
+                to_excel(writer, sheet_name=year, index=False, header=False)
+
+    df_majors = generate_majors(df_hierarchy['l1'].unique(), seed=seed)
+    df_majors.to_excel(paths['majors.xlsx'], sheet_name='majors', index=False)
+    # The BOM matches the exported mapping read by get_major_mapping.
+    generate_major_occupation_map(df_majors, df_hierarchy['l1'].unique(), seed=seed).\
+        to_csv(paths['majors_occupations_map.csv'], index=False, encoding='utf-8-sig')
+
+    for chunk, first_id in enumerate(range(0, n_rows, chunksize)):
+        df_records = generate_student_records(range(first_id, min(first_id + chunksize,
+                                                                   n_rows)),
+                                              df_majors['MAJOR'], df_term, seed=seed,
+                                              chunk=chunk)
+        df_records.to_csv(paths['student.record.csv'], mode='w' if chunk == 0 else 'a',
+                          header=chunk == 0, index=False)
+
+    return paths
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('data_dir', type=str, help='Output directory of the data files.')
+    parser.add_argument('--rows', type=int, default=10000, help='Number of student records.')
+    parser.add_argument('--occupations', type=int, default=500,
+                        help='Number of detailed BLS occupations.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+    args = parser.parse_args()
+
+    for written_path in write_synthetic_data(args.data_dir, args.rows,
+                                             n_occupations=args.occupations,
+                                             seed=args.seed).values():
+        print(written_path)
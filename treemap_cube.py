@@ -0,0 +1,120 @@
+"""
+    This module precomputes the treemap groupings of every year and metric into one cube.
+
+    The refactored_notebook pipeline (create_treemap_levels -> filter_by_year_and_metric ->
+    apply_short_names -> create_labels_for_treemap) renders one year and one metric at a
+    time. build_treemap_cube runs it once for every year x metric combination and stores
+    the labeled blocks in a single frame indexed by (year, metric, level), so switching
+    the year or metric of a treemap is an index lookup with get_treemap_slice.
+"""
+import pandas as pd
+from refactored_notebook import create_treemap_levels, filter_by_year_and_metric,\
+    apply_short_names, create_labels_for_treemap
+
+CUBE_INDEX_NAMES = ['year', 'metric', 'level']
+
+
+def get_treemap_metrics(df_level_data):
+    """
+        List the metrics available for treemaps in the BLS level data.
+        :param List<Dataframe> df_level_data -> Level data from get_df_list_final.
+        :return List<string> -> Metric column names, ex. 'number_of_workers_all_sum'
+    """
+    return [column for column in df_level_data[0].columns
+            if column.endswith(('_sum', '_mean'))]
+
+def _get_cube_blocks(l1_treemap, l2_treemap, level_names, year, metric):
+    """
+        Blocks of the labeled groupings of one year and metric in the layout of the cube.
+        :return List<Dataframe> -> Blocks of the child and of the parent level
+    """
+    l1 = level_names[0]
+    l2 = level_names[1]
+    return [pd.DataFrame({'year': str(year), 'metric': metric, 'level': l1,
+                          'label': l1_treemap[l1].to_numpy(),
+                          'parent': l1_treemap[l2].to_numpy(),
+                          'value': l1_treemap[metric].to_numpy(dtype=float)}),
+            pd.DataFrame({'year': str(year), 'metric': metric, 'level': l2,
+                          'label': l2_treemap[l2].to_numpy(),
+                          'parent': None,
+                          'value': l2_treemap[metric].to_numpy(dtype=float)})]
+
+def build_treemap_cube(df_level_data,
+                       df_hierarchical_map,
+                       level_names,
+                       years=None,
+                       metrics=None) -> pd.DataFrame:
+    """
+        Build the labeled treemap blocks of every year and metric.
+        :param List<Dataframe> df_level_data -> Level data from get_df_list_final.
+        :param Dataframe df_hierarchical_map -> BLS Hieracrchy map.
+        :param List<string> level_names -> Child and parent level names, ex. ['l1', 'l2'].
+        :param List<string> years -> Years to include, defaults to every year of the data.
+        :param List<string> metrics -> Metrics to include, defaults to get_treemap_metrics.
+        :return Dataframe -> Blocks indexed by (year, metric, level) with the columns
+                             'label', 'parent' (parent label of child blocks) and 'value'
+    """
+    if years is None:
+        years = sorted(str(year) for year in df_level_data[0]['year'].unique())
+    if metrics is None:
+        metrics = get_treemap_metrics(df_level_data)
+
+    # The hierarchy merge does not depend on the year or metric, so it is done once.
+    l1_grouping, l2_grouping = create_treemap_levels(df_level_data=df_level_data,
+                                                     df_hierarchical_map=df_hierarchical_map,
+                                                     level_names=level_names)
+    blocks = []
+    metric_dtypes = {}
+    for metric in metrics:
+        for year in years:
+            l1_treemap, l2_treemap = filter_by_year_and_metric(l1_grouping, l2_grouping,
+                                                               level_names, year, metric)
+            l1_treemap, l2_treemap = apply_short_names(l1_treemap, l2_treemap,
+                                                       level_names, metric)
+            l1_treemap, l2_treemap = create_labels_for_treemap(l1_treemap, l2_treemap,
+                                                               level_names, metric)
+            metric_dtypes[metric] = str(l2_treemap[metric].dtype)
+            blocks.extend(_get_cube_blocks(l1_treemap, l2_treemap, level_names, year, metric))
+
+    cube = pd.concat(blocks, ignore_index=True).set_index(CUBE_INDEX_NAMES).sort_index()
+    cube.attrs['level_names'] = list(level_names)
+    cube.attrs['metric_dtypes'] = metric_dtypes
+
+    return cube
+
+def _get_level_blocks(cube, year, metric, level):
+    """
+        Blocks of one level of a year and metric, empty when the level has no blocks.
+    """
+    key = (str(year), metric, level)
+    return cube.loc[key] if key in cube.index else cube.iloc[:0]
+
+def get_treemap_slice(cube, year, metric):
+    """
+        Get the treemap blocks of one year and metric from the cube, in the format of
+        create_labels_for_treemap.
+        :param Dataframe cube -> Cube from build_treemap_cube.
+        :param string year -> Selected year
+        :param string metric -> Selected metric
+        :return Dataframe, Dataframe -> Labeled groupings for teemap blocks, empty when
+                                        no block of the year and metric has a value
+    """
+    years = list(cube.index.unique('year'))
+    if str(year) not in years:
+        raise ValueError('Unknown treemap year: ' + str(year) + ', expected one of ' +
+                         ', '.join(years))
+    if metric not in cube.attrs['metric_dtypes']:
+        raise ValueError('Unknown treemap metric: ' + str(metric) + ', expected one of ' +
+                         ', '.join(cube.attrs['metric_dtypes']))
+    l1, l2 = cube.attrs['level_names']
+    dtype = cube.attrs['metric_dtypes'][metric]
+    l1_blocks = _get_level_blocks(cube, year, metric, l1)
+    l2_blocks = _get_level_blocks(cube, year, metric, l2)
+
+    l1_grouping = pd.DataFrame({l1: l1_blocks['label'].to_numpy(),
+                                l2: l1_blocks['parent'].to_numpy(),
+                                metric: l1_blocks['value'].to_numpy().astype(dtype)})
+    l2_grouping = pd.DataFrame({l2: l2_blocks['label'].to_numpy(),
+                                metric: l2_blocks['value'].to_numpy().astype(dtype)})
+
+    return l1_grouping, l2_grouping
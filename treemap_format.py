@@ -0,0 +1,107 @@
+"""
+    This module holds the visualization parameters of the BLS project treemaps.
+
+    The color palettes are slices of Bokeh's Cividis256 palette, precomputed as hex
+    constants so that neither this module nor the data pipeline imports Bokeh.
+    data_manipulation re-exports get_palette and get_format_parameters lazily.
+
+    The palettes and format parameters are built once as read-only mappings, so the
+    per year and metric render loop only looks them up.
+"""
+from types import MappingProxyType
+
+# Cividis256[0:3] + [64:67] + [128:131] + [192:195] + [252:255]
+CIVIDIS_15 = ('#00204C', '#00204E', '#002150', '#414D6B', '#424E6B', '#434E6B',
+              '#7C7B78', '#7D7C78', '#7E7D78', '#BDAF6E', '#BEB06E', '#BFB16D',
+              '#FFE642', '#FFE743', '#FFE844')
+# Cividis256[0], [64], [192] and [252]
+CIVIDIS_4 = ('#00204C', '#414D6B', '#BDAF6E', '#FFE642')
+# Cividis256[0] and [255]
+CIVIDIS_2 = ('#00204C', '#FFE945')
+
+# Palettes by number of treemap groups.
+PALETTES = MappingProxyType({
+    'default': CIVIDIS_15,
+    14: CIVIDIS_15,
+    4: CIVIDIS_4,
+    2: CIVIDIS_2
+})
+
+# Block and label parameters by base metric, the block palette is added by group count.
+_LABEL_OFFSETS = {
+    'default': {
+        'block': {'line_width': 1,
+                  'line_color': 'white',
+                  'fill_alpha': 0.80},
+        'l2': {'x_offset': 2,
+               'y_offset': -35,
+               'text_font_size': "30pt",
+               'text_baseline': "top",
+               'text_color': 'black'},
+        'l1': {'x_offset': 2,
+               'y_offset': 35,
+               'text_font_size': "18pt",
+               'text_baseline': "top",
+               'text_color': 'black'},
+    },
+    'number_of_workers': {
+        'block': {'line_width': 10,
+                  'line_color': 'white',
+                  'fill_alpha': 0.80},
+        'l2': {'x_offset': 8,
+               'y_offset': -15,
+               'text_font_size': "23pt",
+               'text_baseline': "top",
+               'text_color': 'black'},
+        'l1': {'x_offset': 8,
+               'y_offset': 4,
+               'text_font_size': "17pt",
+               'text_baseline': "top",
+               'text_color': 'white'},
+    },
+    'number_of_students': {
+        'block': {'line_width': 10,
+                  'line_color': 'white',
+                  'fill_alpha': 0.80},
+        'l2': {'x_offset': 10,
+               'y_offset': -35,
+               'text_font_size': "30pt",
+               'text_baseline': "top",
+               'text_color': 'black'},
+        'l1': {'x_offset': 10,
+               'y_offset': 4,
+               'text_font_size': "18pt",
+               'text_baseline': "top",
+               'text_color': 'white'},
+    },
+}
+
+# Read-only format parameters by (base metric, palette key), built once.
+FORMAT_PARAMETERS = MappingProxyType({
+    (metric, palette_key): MappingProxyType({
+        part: MappingProxyType(dict(parameters, palette=palette) if part == 'block'
+                               else parameters)
+        for part, parameters in label_offsets.items()})
+    for metric, label_offsets in _LABEL_OFFSETS.items()
+    for palette_key, palette in PALETTES.items()
+})
+
+
+def get_palette(number_of_groups) -> tuple:
+    """
+        Used to break the larger Cividis color palette into smaller paletted 
+        schemes for visualization purposes.
+    """
+    return PALETTES.get(number_of_groups, PALETTES['default'])
+
+def get_format_parameters(metric, number_of_groups) -> MappingProxyType:
+    """
+        Get visualization configuration for treemap, as a read-only view.
+        Metrics without parameters of their own get the default parameters.
+    """
+    if metric not in _LABEL_OFFSETS:
+        metric = 'default'
+    if number_of_groups not in PALETTES:
+        number_of_groups = 'default'
+
+    return FORMAT_PARAMETERS[(metric, number_of_groups)]
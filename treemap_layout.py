@@ -0,0 +1,165 @@
+"""
+    This module computes squarified treemap layouts for the BLS occupational hierarchy.
+
+    It implements the squarified treemap algorithm of Bruls, Huizing and van Wijk, as in
+    the squarify package used by the main-project-notebook, with the rectangle geometry
+    held in NumPy arrays. layout_hierarchy lays out every level of a hierarchy in one
+    call: each node is placed inside the rectangle of its parent. The resulting block
+    table can be passed to Bokeh's ColumnDataSource as is.
+
+    Ex.
+        blocks = layout_hierarchy(l1_grouping, ['l1', 'l2'], 'number_of_workers_all_sum')
+        p.block('x', 'y', 'dx', 'dy', source=ColumnDataSource(blocks[blocks.level == 'l1']))
+"""
+import numpy as np
+import pandas as pd
+
+BLOCK_COLUMNS = ['x', 'y', 'dx', 'dy']
+
+
+def normalize_sizes(sizes, dx, dy):
+    """
+        Scale sizes so they add up to the area of a dx by dy rectangle.
+        :param array sizes -> Positive sizes.
+        :param float dx -> Width of the rectangle.
+        :param float dy -> Height of the rectangle.
+        :return array -> Normalized sizes
+    """
+    sizes = np.asarray(sizes, dtype=float)
+    total = sizes.sum()
+    if total <= 0:
+        return np.zeros_like(sizes)
+    return sizes * (dx * dy / total)
+
+def _worst_ratios(sizes, side):
+    """
+        Worst aspect ratio of the row made of the first i sizes, for every i.
+        Sizes are sorted in descending order, so the largest size of every row is
+        sizes[0] and the smallest is the last one.
+    """
+    row_areas = np.cumsum(sizes)
+    side_squared = side * side
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.maximum(side_squared * sizes[0] / (row_areas * row_areas),
+                          (row_areas * row_areas) / (side_squared * sizes))
+
+def _layout_row(row, rect):
+    """
+        Lay out one row of a squarified treemap along the shorter side of a rectangle.
+        :return array, tuple -> (x, y, dx, dy) of the sizes of the row, and the rectangle
+                                left for the next rows
+    """
+    x, y, dx, dy = rect
+    offsets = np.concatenate(([0.0], np.cumsum(row)[:-1]))
+    if dx >= dy:
+        # The row fills the height of the rectangle, stacked bottom to top.
+        width = row.sum() / dy
+        return np.column_stack((np.full(len(row), x), y + offsets / width,
+                                np.full(len(row), width), row / width)),\
+            (x + width, y, dx - width, dy)
+    # The row fills the width of the rectangle, stacked left to right.
+    height = row.sum() / dx
+    return np.column_stack((x + offsets / height, np.full(len(row), y), row / height,
+                            np.full(len(row), height))),\
+        (x, y + height, dx, dy - height)
+
+def squarify(sizes, rect):
+    """
+        Compute the rectangles of a squarified treemap.
+        :param array sizes -> Positive sizes sorted in descending order, normalized to
+                              the area of the rectangle (see normalize_sizes).
+        :param tuple rect -> Rectangle (x, y, dx, dy): left, bottom, width and height.
+        :return array -> One row of (x, y, dx, dy) per size, in the order of sizes
+    """
+    sizes = np.asarray(sizes, dtype=float)
+    rects = np.empty((len(sizes), 4))
+    start = 0
+    while start < len(sizes):
+        # Grow the row while its worst aspect ratio does not get worse.
+        worst = _worst_ratios(sizes[start:], min(rect[2], rect[3]))
+        getting_worse = np.nonzero(worst[:-1] < worst[1:])[0]
+        stop = start + getting_worse[0] + 1 if len(getting_worse) else len(sizes)
+        rects[start:stop], rect = _layout_row(sizes[start:stop], rect)
+        start = stop
+
+    return rects
+
+def _get_level_nodes(df, group_columns, value_column, top_n):
+    """
+        Sum the values of the nodes of one level, largest nodes first within each parent
+        as the squarified layout requires, keeping the top_n largest when set.
+    """
+    nodes = df.groupby(group_columns, sort=False, observed=True)[value_column].sum().\
+        reset_index()
+    nodes = nodes.sort_values(group_columns[:-1] + [value_column],
+                              ascending=[True] * (len(group_columns) - 1) + [False],
+                              kind='stable')
+    if top_n is not None:
+        nodes = nodes.groupby(group_columns[:-1], sort=False, observed=True).head(top_n)\
+            if len(group_columns) > 1 else nodes.head(top_n)
+    return nodes.reset_index(drop=True)
+
+def _place_nodes(nodes, group_columns, value_column, parent_rects):
+    """
+        Lay out the nodes of one level inside the rectangles of their parents.
+        :return array -> (x, y, dx, dy) of every node, NaN for the nodes of parents
+                         without a rectangle
+    """
+    geometry = np.full((len(nodes), 4), np.nan)
+    values = nodes[value_column].to_numpy(dtype=float)
+    if len(group_columns) > 1:
+        ancestor_keys = list(nodes[group_columns[:-1]].itertuples(index=False, name=None))
+        parent_codes = nodes.groupby(group_columns[:-1], sort=False, observed=True).\
+            ngroup().to_numpy()
+    else:
+        ancestor_keys = [()] * len(nodes)
+        parent_codes = np.zeros(len(nodes), dtype=int)
+    # Nodes are sorted by parent, so each parent owns a contiguous slice of rows.
+    boundaries = np.concatenate(([0], np.flatnonzero(np.diff(parent_codes)) + 1,
+                                 [len(nodes)]))
+    for start, stop in zip(boundaries[:-1], boundaries[1:]):
+        parent_rect = parent_rects.get(ancestor_keys[start])
+        if parent_rect is not None:
+            geometry[start:stop] = squarify(normalize_sizes(values[start:stop], parent_rect[2],
+                                                            parent_rect[3]), parent_rect)
+    return geometry
+
+def layout_hierarchy(df,
+                     levels,
+                     value_column,
+                     rect=(0, 0, 2000, 1125),
+                     top_n=None) -> pd.DataFrame:
+    """
+        Lay out every level of a hierarchy as nested squarified treemaps.
+        :param Dataframe df -> Rows at the finest level with one column per level and a
+                               value column, ex. the l1 grouping with columns l1, l2.
+        :param List<string> levels -> Level columns from child to parent, ex. ['l1', 'l2'].
+        :param string value_column -> Column sizing the blocks, parents are sized by the
+                                      sum of their children.
+        :param tuple rect -> Rectangle (x, y, dx, dy) of the whole treemap.
+        :param int top_n -> Keep only the top_n largest nodes inside each parent.
+        :return Dataframe -> One block per node with the columns 'level', 'depth',
+                             the level columns (the node and its ancestors), value_column
+                             and the block geometry 'x', 'y', 'dx', 'dy'
+    """
+    levels = list(levels)
+    df = df[df[value_column] > 0]
+    blocks = []
+    # Rectangles of the nodes of the previous (parent) level, keyed by ancestor names.
+    parent_rects = {(): tuple(rect)}
+    for depth, level in enumerate(reversed(levels)):
+        group_columns = levels[len(levels) - depth - 1:][::-1]
+        nodes = _get_level_nodes(df, group_columns, value_column, top_n)
+        geometry = _place_nodes(nodes, group_columns, value_column, parent_rects)
+
+        nodes[BLOCK_COLUMNS] = geometry
+        nodes = nodes[~np.isnan(geometry[:, 0])]
+        parent_rects = {tuple(key): tuple(block) for key, block in
+                        zip(nodes[group_columns].itertuples(index=False, name=None),
+                            nodes[BLOCK_COLUMNS].to_numpy())}
+        nodes.insert(0, 'level', level)
+        nodes.insert(1, 'depth', depth)
+        blocks.append(nodes)
+
+    return pd.concat(blocks, ignore_index=True)[
+        ['level', 'depth'] + levels[::-1] + [value_column] + BLOCK_COLUMNS]
@@ -0,0 +1,368 @@
+"""
+    This module serves the treemap groupings of the BLS level data over HTTP.
+
+    The pipeline output is loaded once at startup and the l1/l2 groupings are built once
+    by create_treemap_levels. A treemap is then filtered, shortened and labeled by the
+    refactored_notebook functions (filter_by_year_and_metric -> apply_short_names ->
+    create_labels_for_treemap) in an executor, so the event loop keeps answering while
+    pandas works. Payloads are cached by year and metric, concurrent requests of a
+    payload being computed wait for the same computation, and every year x metric payload
+    can be precomputed at startup.
+
+    Responses carry an ETag, requests with a matching If-None-Match get a 304 response
+    without a body.
+
+    Executor workers are spawned as fresh processes rather than forked, since a worker
+    forked by the first request would inherit the listening socket and the open client
+    connections of the service. Scripts creating a service state with several workers
+    need an if __name__ == '__main__' guard, as spawned workers import their main module.
+
+    Endpoints (GET):
+        /health                                 -> {"status": "ok"}
+        /metadata                               -> Years, metrics and level names.
+        /treemap?year=2015&metric=<metric>      -> Treemap of both levels, as the json
+                                                   output of write_treemap_outputs.
+        /treemap?year=2015&metric=<metric>&level=l2 -> Treemap of one level.
+
+    Run -> python treemap_service.py bls_cpsaat39_2011_to_2015.xlsx level_mapping_l0
+           curl 'http://127.0.0.1:8050/treemap?year=2015&metric=number_of_workers_all_sum'
+"""
+import os
+import json
+import asyncio
+import hashlib
+import argparse
+import functools
+import multiprocessing
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from data_manipulation import get_df_list_final, BLS_LEVEL_MAPPING_SHEET
+from refactored_notebook import get_distinct_hierarchical_mappings, create_treemap_levels,\
+    filter_by_year_and_metric, apply_short_names, create_labels_for_treemap,\
+    get_treemap_payload, get_treemap_sum_metrics
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8050
+DEFAULT_LEVEL_NAMES = ['l1', 'l2']
+HIERARCHICAL_LEVELS = ['l4', 'l3', 'l2', 'l1']
+# Seconds to wait for the request line and headers of a keep-alive connection.
+REQUEST_TIMEOUT = 30
+MAX_HEADER_LINES = 100
+_REASONS = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found',
+            405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+# Treemap groupings of an executor worker, see _init_payload_worker.
+_worker_groupings = {}
+
+
+def _init_payload_worker(l1_grouping, l2_grouping):
+    """
+        Keep the treemap groupings in the executor worker, so they are sent once per
+        worker instead of once per payload.
+    """
+    _worker_groupings['l1'] = l1_grouping
+    _worker_groupings['l2'] = l2_grouping
+
+def _encode_body(document):
+    """
+        Encode a JSON response body with its ETag.
+    """
+    body = json.dumps(document, separators=(',', ':')).encode('utf-8')
+    return body, '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+def build_payload_bodies(year, metric, level_names) -> dict:
+    """
+        Filter, shorten and label the treemap of one year and metric from the groupings
+        of _init_payload_worker and encode its responses, run in the executor.
+        :param string year -> Selected year
+        :param string metric -> Selected metric
+        :param List<string> level_names -> List of selected level names.
+        :return dict -> Body and ETag of the responses by level, None for both levels
+    """
+    l1_grouping, l2_grouping = filter_by_year_and_metric(_worker_groupings['l1'],
+                                                         _worker_groupings['l2'],
+                                                         level_names, year, metric)
+    l1_grouping, l2_grouping = apply_short_names(l1_grouping, l2_grouping, level_names, metric)
+    l1_grouping, l2_grouping = create_labels_for_treemap(l1_grouping, l2_grouping,
+                                                         level_names, metric)
+    payload = get_treemap_payload(l1_grouping, l2_grouping, level_names, year, metric)
+
+    bodies = {None: _encode_body(payload)}
+    for level in level_names:
+        bodies[level] = _encode_body({'year': payload['year'], 'metric': metric,
+                                      'level_names': payload['level_names'],
+                                      level: payload[level]})
+    return bodies
+
+def create_service_state(df_level_data,
+                         df_hierarchical_map,
+                         level_names=None,
+                         max_workers=None) -> dict:
+    """
+        Build the groupings and the executor of the service.
+        :param List<Dataframe> df_level_data -> Level data from get_df_list_final.
+        :param Dataframe df_hierarchical_map -> BLS Hieracrchy map.
+        :param List<string> level_names -> Child and parent level names, ex. ['l1', 'l2'].
+        :param int max_workers -> Worker processes, 1 computes payloads in a thread of
+                                  this process and None uses the number of CPUs.
+        :return dict -> Service state, closed by close_service_state
+    """
+    level_names = list(level_names or DEFAULT_LEVEL_NAMES)
+    l1_grouping, l2_grouping = create_treemap_levels(df_level_data=df_level_data,
+                                                     df_hierarchical_map=df_hierarchical_map,
+                                                     level_names=level_names)
+    years = sorted(str(year) for year in df_level_data[0]['year'].unique())
+    metrics = get_treemap_sum_metrics(df_level_data)
+    # Workers only need the years and metrics they serve.
+    columns = ['year'] + metrics
+    l1_grouping = l1_grouping[level_names + columns]
+    l2_grouping = l2_grouping[[level_names[1]] + columns]
+
+    workers = max_workers or os.cpu_count() or 1
+    if workers <= 1:
+        executor = ThreadPoolExecutor(max_workers=1, initializer=_init_payload_worker,
+                                      initargs=(l1_grouping, l2_grouping))
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers,
+                                       mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=_init_payload_worker,
+                                       initargs=(l1_grouping, l2_grouping))
+
+    return {'level_names': level_names, 'years': years, 'metrics': metrics,
+            'executor': executor, 'payloads': {}, 'pending': {},
+            'metadata': _encode_body({'level_names': level_names, 'years': years,
+                                      'metrics': metrics})}
+
+def close_service_state(state):
+    """
+        Shut down the executor of the service.
+        :param dict state -> State from create_service_state.
+    """
+    state['executor'].shutdown(wait=True)
+
+async def _compute_payload_bodies(state, year, metric) -> dict:
+    """
+        Compute the responses of one year and metric in the executor and cache them.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        bodies = await loop.run_in_executor(
+            state['executor'],
+            functools.partial(build_payload_bodies, year, metric, state['level_names']))
+        state['payloads'][(year, metric)] = bodies
+        return bodies
+    finally:
+        del state['pending'][(year, metric)]
+
+async def get_payload_bodies(state, year, metric) -> dict:
+    """
+        Get the responses of one year and metric from the cache, computing them in the
+        executor on a miss. Concurrent misses of the same payload share one computation.
+        :param dict state -> State from create_service_state.
+        :param string year -> Selected year
+        :param string metric -> Selected metric
+        :return dict -> Bodies and ETags from build_payload_bodies
+    """
+    key = (year, metric)
+    if key in state['payloads']:
+        return state['payloads'][key]
+    if key not in state['pending']:
+        state['pending'][key] = asyncio.ensure_future(
+            _compute_payload_bodies(state, year, metric))
+    # A cancelled request does not cancel the computation shared with other requests.
+    return await asyncio.shield(state['pending'][key])
+
+async def precompute_payloads(state):
+    """
+        Compute the responses of every year and metric.
+        :param dict state -> State from create_service_state.
+    """
+    await asyncio.gather(*[get_payload_bodies(state, year, metric)
+                           for year in state['years'] for metric in state['metrics']])
+
+def _error(status, message):
+    """
+        Response of an error, as a JSON body.
+    """
+    return status, json.dumps({'error': message}).encode('utf-8'), None
+
+def _check_parameter(name, value, expected, optional=False):
+    """
+        Error message of a query parameter not in the expected values, or None.
+    """
+    if (optional and value is None) or value in expected:
+        return None
+    return f"Unknown {name}, expected one of {', '.join(expected)}"
+
+async def _get_treemap_response(state, query):
+    """
+        Response of a /treemap request, from the query string of its target.
+    """
+    query = {name: values[-1] for name, values in parse_qs(query).items()}
+    year, metric, level = query.get('year'), query.get('metric'), query.get('level')
+    errors = [error for error in (
+        _check_parameter('year', year, state['years']),
+        _check_parameter('metric', metric, state['metrics']),
+        _check_parameter('level', level, state['level_names'], optional=True)) if error]
+    if errors:
+        return _error(400, errors[0])
+    body, etag = (await get_payload_bodies(state, year, metric))[level]
+    return 200, body, etag
+
+async def handle_request(state, method, target, headers):
+    """
+        Answer one request.
+        :param dict state -> State from create_service_state.
+        :param string method -> HTTP method.
+        :param string target -> Request target, ex. '/treemap?year=2015&metric=...'.
+        :param dict headers -> Request headers, with lower case names.
+        :return int, bytes, string -> Status, body and ETag of the response
+    """
+    url = urlsplit(target)
+    if method not in ('GET', 'HEAD'):
+        response = _error(405, 'Only GET requests are supported')
+    elif url.path == '/health':
+        response = (200, b'{"status":"ok"}', None)
+    elif url.path == '/metadata':
+        response = (200,) + state['metadata']
+    elif url.path == '/treemap':
+        response = await _get_treemap_response(state, url.query)
+    else:
+        response = _error(404, 'Unknown path ' + url.path)
+
+    etag = response[2]
+    if etag is not None and\
+            etag in [tag.strip() for tag in headers.get('if-none-match', '').split(',')]:
+        return 304, b'', etag
+    return response
+
+async def _read_request(reader):
+    """
+        Read the request line and headers of a request, or None at the end of the
+        connection. The body of a request is skipped.
+    """
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    parts = request_line.decode('latin-1').split()
+    if len(parts) != 3:
+        raise ValueError('Malformed request line')
+    headers = {}
+    for _ in range(MAX_HEADER_LINES):
+        line = await reader.readline()
+        if not line.strip():
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    else:
+        raise ValueError('Too many headers')
+    if int(headers.get('content-length', 0) or 0) > 0:
+        await reader.readexactly(int(headers['content-length']))
+    return parts[0].upper(), parts[1], parts[2].upper(), headers
+
+async def _write_response(writer, response, keep_alive, send_body=True):
+    """
+        Write a JSON response, given as its status, body and ETag. HEAD responses have
+        the headers of the GET response only.
+    """
+    status, body, etag = response
+    response_headers = [f'HTTP/1.1 {status} {_REASONS[status]}',
+                        'Content-Type: application/json',
+                        f'Content-Length: {len(body)}',
+                        'Cache-Control: no-cache',
+                        'Connection: ' + ('keep-alive' if keep_alive else 'close')]
+    if etag is not None:
+        response_headers.append('ETag: ' + etag)
+    writer.write(('\r\n'.join(response_headers) + '\r\n\r\n').encode('latin-1'))
+    if send_body:
+        writer.write(body)
+    await writer.drain()
+
+async def handle_connection(state, reader, writer):
+    """
+        Serve the requests of one connection, keeping HTTP/1.1 connections alive.
+        :param dict state -> State from create_service_state.
+        :param StreamReader reader -> Connection reader.
+        :param StreamWriter writer -> Connection writer.
+    """
+    try:
+        while True:
+            try:
+                request = await asyncio.wait_for(_read_request(reader), REQUEST_TIMEOUT)
+            except asyncio.TimeoutError:
+                break
+            except (ValueError, asyncio.IncompleteReadError):
+                await _write_response(writer, _error(400, 'Malformed request'),
+                                      keep_alive=False)
+                break
+            if request is None:
+                break
+
+            method, target, version, headers = request
+            try:
+                response = await handle_request(state, method, target, headers)
+            except Exception as error:  # pylint: disable=broad-except
+                response = _error(500, str(error))
+            connection = headers.get('connection', '').lower()
+            keep_alive = connection == 'keep-alive' or\
+                (version == 'HTTP/1.1' and connection != 'close')
+            await _write_response(writer, response, keep_alive, send_body=method != 'HEAD')
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+async def start_service(state, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """
+        Start listening for requests.
+        :param dict state -> State from create_service_state.
+        :param string host -> Interface to listen on.
+        :param int port -> Port to listen on, 0 picks a free port.
+        :return Server -> asyncio server, its sockets give the bound port
+    """
+    return await asyncio.start_server(functools.partial(handle_connection, state), host, port)
+
+async def serve(state, host=DEFAULT_HOST, port=DEFAULT_PORT, precompute=True):
+    """
+        Precompute the payloads and serve requests until cancelled.
+        :param dict state -> State from create_service_state.
+        :param string host -> Interface to listen on.
+        :param int port -> Port to listen on.
+        :param bool precompute -> Compute every payload before accepting requests.
+    """
+    if precompute:
+        await precompute_payloads(state)
+    server = await start_service(state, host, port)
+    print('Serving treemaps on', ', '.join(str(sock.getsockname()) for sock in server.sockets))
+    async with server:
+        await server.serve_forever()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('file', type=str, nargs='?', default='bls_cpsaat39_2011_to_2015.xlsx',
+                        help='The name of the BLS excel data file.')
+    parser.add_argument('sheet_name', type=str, nargs='?', default=BLS_LEVEL_MAPPING_SHEET,
+                        help='The the name of the sheet to extract the BLS hierarchy.')
+    parser.add_argument('--host', type=str, default=DEFAULT_HOST, help='Interface to listen on.')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='Port to listen on.')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes computing payloads, defaults to the CPU count.')
+    parser.add_argument('--no-precompute', action='store_true',
+                        help='Compute payloads on first request instead of at startup.')
+    args = parser.parse_args()
+
+    service_state = create_service_state(
+        get_df_list_final(),
+        get_distinct_hierarchical_mappings(hierarchical_levels=HIERARCHICAL_LEVELS,
+                                           filepath_excel_heirarchy='./data/' + args.file,
+                                           sheet_name=args.sheet_name),
+        max_workers=args.workers)
+    try:
+        asyncio.run(serve(service_state, args.host, args.port,
+                          precompute=not args.no_precompute))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        close_service_state(service_state)
@@ -0,0 +1,407 @@
+"""
+    This module caches the sheets of the BLS excel workbooks as columnar Arrow files.
+
+    Parsing xlsx sheets through openpyxl is the largest startup cost of the BLS project.
+    The first read of a sheet parses the workbook and writes the sheet to an Arrow IPC
+    (feather) file; later reads are served from that file through a memory map.
+    Sheets needed together are parsed in one pass over the workbook and kept in memory,
+    so every caller in the process shares a single open of each file.
+
+    Cache entries are keyed by the workbook path, its modification time and a hash of
+    its content, so editing a workbook invalidates its entries automatically. The cache
+    directory is kept below a size limit by evicting the least recently used entries.
+
+    Configuration (environment variables):
+        BLS_CACHE_DIR       -> Cache directory, default './.bls_cache'. Set to an empty
+                               string to disable the cache.
+        BLS_CACHE_MAX_BYTES -> Size limit of the cache directory, default 256 MB.
+        BLS_EXCEL_WORKERS   -> Number of processes parsing sheets concurrently, default 1
+                               (a single pass over the workbook in this process).
+"""
+import os
+import re
+import json
+import hashlib
+import zipfile
+import importlib
+from xml.etree import ElementTree
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+DEFAULT_CACHE_DIR = './.bls_cache'
+DEFAULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+CACHE_FILE_SUFFIX = '.arrow'
+COLUMN_NAMES_METADATA_KEY = b'bls_cache_column_names'
+
+# Content hashes by (path, mtime, size), so unchanged workbooks are hashed once per process.
+_content_hashes = {}
+# Sheets already loaded in this process by (workbook fingerprint, read arguments).
+_loaded_sheets = {}
+# Sheets to load together in one pass by workbook path.
+_registered_sheets = {}
+# Patterns of the sheet names to load together in one pass by workbook path.
+_registered_patterns = {}
+# Sheet names by workbook fingerprint.
+_sheet_names = {}
+# pyarrow, imported on first use since it is an optional dependency.
+_pyarrow = {}
+
+
+def _import_pyarrow():
+    """
+        Import pyarrow and its feather module on first use, so importing this module
+        only loads pandas and numpy.
+        :return module -> pyarrow or None when it is not installed.
+    """
+    if 'module' not in _pyarrow:
+        try:
+            importlib.import_module('pyarrow.feather')
+            _pyarrow['module'] = importlib.import_module('pyarrow')
+        except ImportError:  # pragma: no cover - pyarrow is an optional dependency
+            _pyarrow['module'] = None
+    return _pyarrow['module']
+
+def get_cache_dir():
+    """
+        Get the cache directory from the environment.
+        :return string -> Cache directory or None when the cache is disabled.
+    """
+    cache_dir = os.environ.get('BLS_CACHE_DIR', DEFAULT_CACHE_DIR)
+    if not cache_dir or _import_pyarrow() is None:
+        return None
+    return cache_dir
+
+def get_cache_max_bytes():
+    """
+        Get the size limit of the cache directory from the environment.
+        :return int -> Maximum number of bytes kept in the cache directory.
+    """
+    return int(os.environ.get('BLS_CACHE_MAX_BYTES', DEFAULT_CACHE_MAX_BYTES))
+
+def get_excel_workers():
+    """
+        Get the number of processes used to parse sheets from the environment.
+        :return int -> Number of worker processes.
+    """
+    return max(1, int(os.environ.get('BLS_EXCEL_WORKERS', 1)))
+
+def get_file_fingerprint(filepath):
+    """
+        Fingerprint a file by its absolute path, modification time, size and content hash.
+        :param string filepath -> Filepath to the source file.
+        :return string -> Hex digest identifying the current version of the file.
+    """
+    abs_path = os.path.abspath(filepath)
+    stat = os.stat(abs_path)
+    stat_key = (abs_path, stat.st_mtime_ns, stat.st_size)
+    if stat_key not in _content_hashes:
+        content_hash = hashlib.sha256()
+        with open(abs_path, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b''):
+                content_hash.update(block)
+        _content_hashes[stat_key] = content_hash.hexdigest()
+
+    fingerprint = hashlib.sha256(
+        json.dumps([abs_path, stat.st_mtime_ns, stat.st_size, _content_hashes[stat_key]]).
+        encode('utf-8'))
+    return fingerprint.hexdigest()
+
+def _get_entry_prefix(filepath, sheet_name, read_kwargs):
+    """
+        Name the cache entries of one sheet read, independent of the workbook version.
+    """
+    entry_key = json.dumps([os.path.abspath(filepath), str(sheet_name), read_kwargs],
+                           sort_keys=True, default=str)
+    return hashlib.sha256(entry_key.encode('utf-8')).hexdigest()[:32]
+
+def _encode_column_names(columns):
+    """
+        Column names of mixed types (ex. 'occupation' and 2015) do not roundtrip through
+        Arrow, so they are stored in the schema metadata and restored on read.
+    """
+    names = []
+    for name in columns:
+        if not isinstance(name, (str, int, float)) or isinstance(name, bool):
+            return None
+        names.append([type(name).__name__, name])
+    return json.dumps(names).encode('utf-8')
+
+def _decode_column_names(encoded):
+    """
+        Restore the column names stored by _encode_column_names.
+    """
+    types = {'str': str, 'int': int, 'float': float}
+    return [types[type_name](name) for type_name, name in json.loads(encoded)]
+
+def _write_entry(df, cache_path):
+    """
+        Write a sheet to the cache. Sheets that cannot be represented in Arrow are skipped.
+        :return bool -> True when the entry was written.
+    """
+    encoded_names = _encode_column_names(df.columns)
+    if encoded_names is None:
+        return False
+    df_positional = df.copy(deep=False)
+    df_positional.columns = [str(i) for i in range(len(df.columns))]
+    pa = _import_pyarrow()
+    try:
+        table = pa.Table.from_pandas(df_positional, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError):
+        return False
+    metadata = dict(table.schema.metadata or {})
+    metadata[COLUMN_NAMES_METADATA_KEY] = encoded_names
+    table = table.replace_schema_metadata(metadata)
+
+    # Write to a temporary file first so concurrent readers never see a partial entry.
+    tmp_path = cache_path + '.' + str(os.getpid()) + '.tmp'
+    pa.feather.write_feather(table, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, cache_path)
+    return True
+
+def _read_entry(cache_path):
+    """
+        Read a sheet from the cache through a memory map.
+    """
+    table = _import_pyarrow().feather.read_table(cache_path, memory_map=True)
+    column_names = _decode_column_names(table.schema.metadata[COLUMN_NAMES_METADATA_KEY])
+    df = table.to_pandas()
+    df.columns = column_names
+    # Arrow restores missing strings as None where read_excel produces NaN.
+    for column in df.columns[df.dtypes == object]:
+        df[column] = df[column].where(df[column].notna(), np.nan)
+    # Mark the entry as recently used for the LRU eviction.
+    os.utime(cache_path)
+    return df
+
+def _remove_stale_entries(cache_dir, prefix, current_path):
+    """
+        Remove entries of the same sheet read left over from older workbook versions.
+    """
+    for file_name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, file_name)
+        if file_name.startswith(prefix) and path != current_path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def enforce_cache_size_limit(cache_dir=None, max_bytes=None):
+    """
+        Evict the least recently used entries until the cache fits in its size limit.
+        :param string cache_dir -> Cache directory, defaults to BLS_CACHE_DIR.
+        :param int max_bytes -> Size limit, defaults to BLS_CACHE_MAX_BYTES.
+        :return int -> Number of bytes left in the cache directory.
+    """
+    cache_dir = cache_dir or get_cache_dir()
+    max_bytes = get_cache_max_bytes() if max_bytes is None else max_bytes
+    if cache_dir is None or not os.path.isdir(cache_dir):
+        return 0
+
+    entries = []
+    for file_name in os.listdir(cache_dir):
+        if file_name.endswith(CACHE_FILE_SUFFIX):
+            stat = os.stat(os.path.join(cache_dir, file_name))
+            entries.append((stat.st_mtime, stat.st_size, file_name))
+    total_bytes = sum(size for _, size, _ in entries)
+    for _, size, file_name in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, file_name))
+            total_bytes -= size
+        except OSError:
+            pass
+
+    return total_bytes
+
+def clear_cache(cache_dir=None):
+    """
+        Remove every entry from the cache directory.
+        :param string cache_dir -> Cache directory, defaults to BLS_CACHE_DIR.
+    """
+    enforce_cache_size_limit(cache_dir=cache_dir, max_bytes=0)
+
+def _read_sheet_names(filepath):
+    """
+        Read the sheet names of a workbook. The names of an xlsx workbook are read from
+        its workbook part without loading any sheet.
+    """
+    try:
+        with zipfile.ZipFile(filepath) as archive:
+            root = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+    except (zipfile.BadZipFile, KeyError):
+        # Not an xlsx workbook, ex. xls.
+        with pd.ExcelFile(filepath) as workbook:
+            return [str(sheet_name) for sheet_name in workbook.sheet_names]
+    return [sheet.get('name') for sheet in root.iter() if sheet.tag.endswith('}sheet')]
+
+def get_sheet_names(filepath) -> list:
+    """
+        Get the sheet names of a workbook, in workbook order. Names are read once per
+        version of the workbook.
+        :param string filepath -> Filepath to the excel workbook.
+        :return List<string> -> Sheet names
+    """
+    fingerprint = get_file_fingerprint(filepath)
+    if fingerprint not in _sheet_names:
+        _sheet_names[fingerprint] = _read_sheet_names(filepath)
+    return list(_sheet_names[fingerprint])
+
+def register_workbook_sheets(filepath, sheet_names=(), pattern=None):
+    """
+        Declare the sheets the project needs from a workbook. The first read of any of
+        these sheets loads all of them in a single pass over the workbook.
+        :param string filepath -> Filepath to the excel workbook.
+        :param List<string> sheet_names -> Names of the sheets to load together.
+        :param string pattern -> Regular expression matching the names of other sheets to
+                                 load together, ex. r'^\\d{4}$' for the year tabs. The
+                                 sheets are discovered when the workbook is read.
+    """
+    registered = _registered_sheets.setdefault(os.path.abspath(filepath), [])
+    for sheet_name in sheet_names:
+        if str(sheet_name) not in registered:
+            registered.append(str(sheet_name))
+    if pattern is not None:
+        patterns = _registered_patterns.setdefault(os.path.abspath(filepath), [])
+        if pattern not in patterns:
+            patterns.append(pattern)
+
+def _get_registered_sheets(filepath):
+    """
+        Names of the sheets registered for a workbook, including the existing sheets
+        matching a registered pattern.
+    """
+    registered = list(_registered_sheets.get(os.path.abspath(filepath), []))
+    patterns = _registered_patterns.get(os.path.abspath(filepath))
+    if patterns:
+        for sheet_name in get_sheet_names(filepath):
+            if sheet_name not in registered and\
+                    any(re.search(pattern, sheet_name) for pattern in patterns):
+                registered.append(sheet_name)
+    return registered
+
+def clear_loaded_workbooks():
+    """
+        Release the sheets kept in memory by read_excel_sheets.
+    """
+    _loaded_sheets.clear()
+
+def _get_cached_sheet(cache_dir, entry_prefix, fingerprint):
+    """
+        Get a sheet from the columnar cache.
+        :return Dataframe -> Sheet data or None on a cache miss.
+    """
+    if cache_dir is None:
+        return None
+    cache_path = _get_entry_path(cache_dir, entry_prefix, fingerprint)
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        return _read_entry(cache_path)
+    except (OSError, KeyError, ValueError, _import_pyarrow().ArrowException):
+        # Corrupted entry, the sheet is parsed again and the entry overwritten.
+        return None
+
+def _set_cached_sheet(df, cache_dir, entry_prefix, fingerprint):
+    """
+        Write a freshly parsed sheet to the columnar cache.
+    """
+    if cache_dir is None:
+        return
+    cache_path = _get_entry_path(cache_dir, entry_prefix, fingerprint)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        if _write_entry(df, cache_path):
+            _remove_stale_entries(cache_dir, entry_prefix, cache_path)
+    except OSError:
+        # The cache is an optimization only, a read-only filesystem should not fail the read.
+        pass
+
+def _get_entry_path(cache_dir, entry_prefix, fingerprint):
+    """
+        Path of the cache entry of one sheet read for the current workbook version.
+    """
+    return os.path.join(cache_dir, entry_prefix + '-' + fingerprint[:32] + CACHE_FILE_SUFFIX)
+
+def _parse_sheet(filepath, sheet_name, read_kwargs):
+    """
+        Parse one sheet in a worker process.
+    """
+    return pd.read_excel(filepath, sheet_name=sheet_name, **read_kwargs)
+
+def _parse_sheets(filepath, sheet_names, max_workers, read_kwargs):
+    """
+        Parse sheets with a single pd.read_excel call, or concurrently with one task per
+        sheet in a process pool when more than one worker is requested.
+    """
+    max_workers = min(max_workers, len(sheet_names))
+    if max_workers <= 1:
+        return pd.read_excel(filepath, sheet_name=sheet_names, **read_kwargs)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        frames = executor.map(_parse_sheet,
+                              [filepath] * len(sheet_names),
+                              sheet_names,
+                              [read_kwargs] * len(sheet_names))
+        return dict(zip(sheet_names, frames))
+
+def read_excel_sheets(filepath, sheet_names, max_workers=None, **read_kwargs) -> dict:
+    """
+        Read several sheets of an excel workbook, opening the workbook at most once.
+        Sheets are served from memory when already loaded in this process, then from the
+        columnar cache, and the remaining ones (plus any sheet registered with
+        register_workbook_sheets) are parsed together with a single pd.read_excel call,
+        or concurrently in a process pool when max_workers is greater than 1.
+        :param string filepath -> Filepath to the excel workbook.
+        :param List<string> sheet_names -> Names of the sheets to read.
+        :param int max_workers -> Number of parsing processes, defaults to BLS_EXCEL_WORKERS.
+        :param read_kwargs -> Additional keyword arguments for pd.read_excel.
+        :return dict<string, Dataframe> -> Sheet data by sheet name
+    """
+    sheet_names = [str(sheet_name) for sheet_name in sheet_names]
+    cache_dir = get_cache_dir()
+    fingerprint = get_file_fingerprint(filepath)
+    loaded = _loaded_sheets.setdefault(
+        (fingerprint, json.dumps(read_kwargs, sort_keys=True, default=str)), {})
+
+    wanted = list(sheet_names)
+    for sheet_name in _get_registered_sheets(filepath):
+        if sheet_name not in wanted:
+            wanted.append(sheet_name)
+
+    missing = []
+    for sheet_name in wanted:
+        if sheet_name in loaded:
+            continue
+        df = _get_cached_sheet(cache_dir, _get_entry_prefix(filepath, sheet_name, read_kwargs),
+                               fingerprint)
+        if df is None:
+            missing.append(sheet_name)
+        else:
+            loaded[sheet_name] = df
+
+    if missing:
+        max_workers = get_excel_workers() if max_workers is None else max_workers
+        parsed = _parse_sheets(filepath, missing, max_workers, read_kwargs)
+        for sheet_name, df in parsed.items():
+            loaded[sheet_name] = df
+            _set_cached_sheet(df, cache_dir,
+                              _get_entry_prefix(filepath, sheet_name, read_kwargs), fingerprint)
+        if cache_dir is not None:
+            enforce_cache_size_limit(cache_dir=cache_dir)
+
+    # Hand out copies so callers cannot modify the frames shared with later callers.
+    return {sheet_name: loaded[sheet_name].copy() for sheet_name in sheet_names}
+
+def read_excel_sheet(filepath, sheet_name, **read_kwargs) -> pd.DataFrame:
+    """
+        Read one sheet of an excel workbook, served from memory or the columnar cache
+        when possible. Returns the same dataframe as
+        pd.read_excel(filepath, sheet_name=sheet_name, ...).
+        :param string filepath -> Filepath to the excel workbook.
+        :param string sheet_name -> Name of the sheet to read.
+        :param read_kwargs -> Additional keyword arguments for pd.read_excel.
+        :return Dataframe -> Sheet data
+    """
+    return read_excel_sheets(filepath, [sheet_name], **read_kwargs)[str(sheet_name)]